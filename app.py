@@ -1,25 +1,54 @@
-from flask import Flask, render_template, request, jsonify
+import time
+
+# create_app logs the time from here; benchmarks/import_time.py has the per-module breakdown
+STARTED = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, render_template, request, jsonify, stream_with_context
 from flask_cors import CORS
-from tasks.email_reader import fetch_emails
-from tasks.ai_processor import extract_tasks, summarize_tasks, extract_deadline_with_chatgpt
-from tasks.sortify_processor import extract_sortify_task
+from tasks.email_reader import fetch_emails, fetch_new_emails
+from tasks.pipeline import process_emails, iter_process_emails, request_failures
 from tasks.email_sender import send_email_via_smtp
+from tasks.ai_processor import openai_module
+from tasks import cache, jobs, outbox, metrics, preprocess, deadline_parser, rate_limiter, gmail_client, budget, team, push
 import os
+import json
 import logging
+import importlib
 import smtplib
 
 logging.basicConfig(level=logging.DEBUG)
-gmail_user = os.getenv("EMAIL_ADDRESS")
 
-app = Flask(__name__)
-CORS(app)
+# Modules imported on first use elsewhere, loaded up front by warm_up()
+LAZY_MODULES = [
+    "openai",
+    "httplib2",
+    "google.oauth2.credentials",
+    "google_auth_httplib2",
+    "googleapiclient.discovery",
+]
+
+routes = Blueprint("sortify", __name__)
+
+
+def report_failures(response, failed, emails):
+    """
+    Adds the emails whose extraction failed to a fetch response and returns
+    the status: 502 when every email failed, otherwise 200 with the partial
+    results. Failed emails are not stored and are extracted on the next fetch.
+    """
+    response["failed_emails"] = len(failed)
+    if failed and len(failed) == len(emails):
+        response["error"] = "Task extraction failed, try again later."
+        return 502
+    return 200
+
 
-@app.route("/")
+@routes.route("/")
 def index():
     logging.debug("Rendering index page.")
     return render_template("index.html")
 
-@app.route("/fetch-emails", methods=["POST"])
+@routes.route("/fetch-emails", methods=["POST"])
 def fetch_and_process_emails():
     try:
         data = request.json
@@ -27,99 +56,312 @@ def fetch_and_process_emails():
         refresh_token = data.get("refresh_token")
         fetch_from = data.get("fetch_from")
         fetch_to = data.get("fetch_to")
+        incremental = bool(data.get("incremental"))
         logging.debug("Received fetch_emails request; access token provided: %s", bool(access_token))
         
         if not access_token:
             return jsonify({"error": "Access token is required."}), 401
         
-        # Step 1: Fetch emails
-        emails = fetch_emails(access_token, refresh_token, fetch_from, fetch_to)
-        logging.debug("Fetched %d emails from Gmail API", len(emails))
-
-        # Step 2: Process each email
-        actionable_tasks = []
-        for email in emails:
-            logging.debug("Processing email from: %s with subject: %s", email.get("from"), email.get("subject"))
-            if email.get("from") and gmail_user in email.get("from"):
-                detailed_tasks, deadline = extract_sortify_task(email["body"])
-                actionable_tasks.append({
-                    "subject": email["subject"],
-                    "from": email["from"],
-                    "summary": detailed_tasks,
-                    "deadline": deadline if deadline else "No deadline"
-                })
+        started = time.perf_counter()
+        with metrics.request_timings() as timings, budget.request_usage() as usage, request_failures() as failed:
+            # Step 1: Fetch emails (only the ones added since the last sync when incremental)
+            if incremental:
+                emails = fetch_new_emails(access_token, refresh_token, fetch_from, fetch_to)
             else:
-                detailed_tasks = extract_tasks(email["body"])  # Extract detailed tasks
-                if "No actionable tasks" not in detailed_tasks:  # Filter out non-actionable tasks
-                    deadline = extract_deadline_with_chatgpt(detailed_tasks)  # Extract deadline
-                    actionable_tasks.append({
-                        "subject": email["subject"],
-                        "from": email["from"],
-                        "summary": detailed_tasks,
-                        "deadline": deadline if deadline else "No deadline"
-                    })
+                emails = fetch_emails(access_token, refresh_token, fetch_from, fetch_to)
+            logging.debug("Fetched %d emails from Gmail API", len(emails))
+
+            # Step 2: Process emails concurrently (order is preserved)
+            actionable_tasks = process_emails(emails)
 
         # Step 4: Structure response
         response = {
             "tasks": actionable_tasks,  # Includes per-email summaries
         }
+        status = report_failures(response, failed, emails)
+        if data.get("timings"):
+            # Stage totals add up across worker threads, so they can exceed total_ms
+            response["timings"] = {"total_ms": round((time.perf_counter() - started) * 1000, 3), "stages": timings}
+        if data.get("usage"):
+            response["usage"] = dict(usage, cost_usd=budget.cost(usage["prompt_tokens"], usage["completion_tokens"]))
 
         logging.debug("Returning response with %d actionable tasks", len(actionable_tasks))
         # Return the response as JSON
-        return jsonify(response)
+        return jsonify(response), status
     except Exception as e:
         logging.error("Error in fetch_and_process_emails: %s", str(e))
         return jsonify({"error": str(e)}), 500
 
-@app.route("/fetch-old-emails", methods=["POST"])
+@routes.route("/fetch-emails/stream", methods=["POST"])
+def stream_emails():
+    """
+    Same input as /fetch-emails, but answers with newline-delimited JSON events:
+    one "start", then a "task" for each actionable task as soon as it is extracted,
+    a "progress" after every email, and a final "done" summary (or an "error").
+    """
+    # Parsed here rather than in a try block, so answer a bad body the way the other endpoints do
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "A JSON body is required."}), 400
+    access_token = data.get("access_token")
+    refresh_token = data.get("refresh_token")
+    fetch_from = data.get("fetch_from")
+    fetch_to = data.get("fetch_to")
+    incremental = bool(data.get("incremental"))
+    logging.debug("Received stream_emails request; access token provided: %s", bool(access_token))
+
+    if not access_token:
+        return jsonify({"error": "Access token is required."}), 401
+
+    def event(payload):
+        return json.dumps(payload) + "\n"
+
+    def generate():
+        started = time.monotonic()
+        try:
+            with metrics.request_timings() as timings, budget.request_usage() as usage, request_failures() as failed:
+                yield from _stream_events(started, timings, usage, failed)
+        except Exception as e:
+            logging.error("Error in stream_emails: %s", str(e))
+            yield event({"type": "error", "error": str(e)})
+
+    def _stream_events(started, timings, usage, failed):
+        if incremental:
+            emails = fetch_new_emails(access_token, refresh_token, fetch_from, fetch_to)
+        else:
+            emails = fetch_emails(access_token, refresh_token, fetch_from, fetch_to)
+        if isinstance(emails, dict):
+            yield event({"type": "error", "error": emails.get("error"), "status": emails.get("status")})
+            return
+
+        yield event({"type": "start", "total": len(emails)})
+        processed = 0
+        task_count = 0
+        for index, task in iter_process_emails(emails):
+            processed += 1
+            if task is not None:
+                task_count += 1
+                yield event({"type": "task", "index": index, "task": task})
+            yield event({"type": "progress", "processed": processed, "total": len(emails)})
+
+        done = {
+            "type": "done",
+            "processed": processed,
+            "tasks": task_count,
+            "failed_emails": len(failed),
+            "elapsed_ms": int((time.monotonic() - started) * 1000)
+        }
+        if data.get("timings"):
+            done["timings"] = timings
+        if data.get("usage"):
+            done["usage"] = dict(usage, cost_usd=budget.cost(usage["prompt_tokens"], usage["completion_tokens"]))
+        yield event(done)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+@routes.route("/fetch-emails/team", methods=["POST"])
+def fetch_team_emails():
+    """
+    /fetch-emails for several accounts at once. Takes {"accounts": [{"access_token",
+    "refresh_token", "fetch_from", "fetch_to"}, ...]}; a window left out of an
+    account falls back to the top-level fetch_from / fetch_to. Returns the
+    results per account and the tasks of all accounts merged, with tasks shared
+    through Sortify listed once.
+    """
+    try:
+        data = request.json
+        accounts = data.get("accounts")
+        if not isinstance(accounts, list) or not accounts:
+            return jsonify({"error": "A non-empty list of accounts is required."}), 400
+        if len(accounts) > team.TEAM_MAX_ACCOUNTS:
+            return jsonify({"error": f"At most {team.TEAM_MAX_ACCOUNTS} accounts per request."}), 400
+        if not all(isinstance(account, dict) for account in accounts):
+            return jsonify({"error": "Each account must be an object."}), 400
+        logging.debug("Received fetch_team_emails request for %d accounts", len(accounts))
+
+        started = time.perf_counter()
+        with metrics.request_timings() as timings, budget.request_usage() as usage:
+            results = team.process_accounts(
+                accounts,
+                defaults={"fetch_from": data.get("fetch_from"), "fetch_to": data.get("fetch_to")},
+                incremental=bool(data.get("incremental"))
+            )
+        response = {"accounts": results, "tasks": team.merge_tasks(results)}
+        if data.get("timings"):
+            response["timings"] = {"total_ms": round((time.perf_counter() - started) * 1000, 3), "stages": timings}
+        if data.get("usage"):
+            response["usage"] = dict(usage, cost_usd=budget.cost(usage["prompt_tokens"], usage["completion_tokens"]))
+
+        logging.debug("Returning %d merged tasks for %d accounts", len(response["tasks"]), len(results))
+        return jsonify(response)
+    except Exception as e:
+        logging.error("Error in fetch_team_emails: %s", str(e))
+        return jsonify({"error": str(e)}), 500
+
+@routes.route("/fetch-old-emails", methods=["POST"])
 def fetch_old_emails():
     try:
         data = request.json
         access_token = data.get("access_token")
         refresh_token = data.get("refresh_token")
         first_updated = data.get("first_updated")
+        background = bool(data.get("background"))
         logging.debug("Received fetch_old_emails request; access token provided: %s", bool(access_token))
         
         logging.info(first_updated)
         if not access_token:
             return jsonify({"error": "Access token is required."}), 401
+
+        # Hand long backfills to the job workers and let the client poll /jobs/<job_id>
+        if background:
+            job_id = jobs.enqueue_backfill(access_token, refresh_token, first_updated)
+            return jsonify({"job_id": job_id, "status": "queued"}), 202
         
         # Fetch emails using first_updated instead of last_updated
         emails = fetch_emails(access_token, refresh_token, first_updated)
         logging.debug("Fetched %d emails from Gmail API", len(emails))
 
-        # Process each email
-        actionable_tasks = []
-        for email in emails:
-            logging.debug("Processing email from: %s with subject: %s", email.get("from"), email.get("subject"))
-            if email.get("from") and gmail_user in email.get("from"):
-                detailed_tasks, deadline = extract_sortify_task(email["body"])
-                actionable_tasks.append({
-                    "subject": email["subject"],
-                    "from": email["from"],
-                    "summary": detailed_tasks,
-                    "deadline": deadline if deadline else "No deadline"
-                })
-            else:
-                detailed_tasks = extract_tasks(email["body"])  # Extract detailed tasks
-                if "No actionable tasks" not in detailed_tasks:  # Filter out non-actionable tasks
-                    deadline = extract_deadline_with_chatgpt(detailed_tasks)  # Extract deadline
-                    actionable_tasks.append({
-                        "subject": email["subject"],
-                        "from": email["from"],
-                        "summary": detailed_tasks,
-                        "deadline": deadline if deadline else "No deadline"
-                    })
-        
+        # Process emails concurrently (order is preserved)
+        with request_failures() as failed:
+            actionable_tasks = process_emails(emails)
+
         response = {"tasks": actionable_tasks}
+        status = report_failures(response, failed, emails)
         logging.debug("Returning response with %d actionable tasks", len(actionable_tasks))
-        return jsonify(response)
+        return jsonify(response), status
     except Exception as e:
         logging.error("Error in fetch_old_emails: %s", str(e))
         return jsonify({"error": str(e)}), 500
 
+@routes.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    include_tasks = request.args.get("include_tasks", "true").lower() != "false"
+    job = jobs.get_job(job_id, include_tasks=include_tasks)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job)
+
+@routes.route("/gmail/watch", methods=["POST"])
+def gmail_watch():
+    """
+    Starts push ingestion for the account: Gmail notifies /gmail/push of new
+    mail and the job workers extract it into the task store read by /tasks.
+    """
+    try:
+        data = request.json
+        access_token = data.get("access_token")
+        refresh_token = data.get("refresh_token")
+        if not access_token:
+            return jsonify({"error": "Access token is required."}), 401
+        if not refresh_token:
+            return jsonify({"error": "A refresh token is required to watch an account."}), 400
+        return jsonify(push.register_watch(access_token, refresh_token))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logging.error("Error in gmail watch endpoint: %s", str(e))
+        return jsonify({"error": str(e)}), 500
+
+@routes.route("/gmail/watch/stop", methods=["POST"])
+def gmail_watch_stop():
+    try:
+        data = request.json
+        access_token = data.get("access_token")
+        refresh_token = data.get("refresh_token")
+        if not access_token:
+            return jsonify({"error": "Access token is required."}), 401
+        return jsonify({"email": push.stop_watch(access_token, refresh_token), "watching": False})
+    except Exception as e:
+        logging.error("Error in gmail watch stop endpoint: %s", str(e))
+        return jsonify({"error": str(e)}), 500
+
+@routes.route("/gmail/push", methods=["POST"])
+def gmail_push():
+    """
+    Pub/Sub push endpoint. Anything but a 2xx makes Pub/Sub redeliver, so
+    notifications that cannot be used are acknowledged as well.
+    """
+    if not push.verify_push_token(request.args.get("token")):
+        return jsonify({"error": "Invalid token."}), 403
+    try:
+        push.handle_notification(request.get_json(silent=True) or {})
+    except Exception as e:
+        logging.error("Error in gmail push endpoint: %s", str(e))
+        return jsonify({"error": str(e)}), 500
+    return "", 204
+
+@routes.route("/tasks", methods=["POST"])
+def ready_tasks():
+    """
+    Tasks already extracted from pushed mail, without fetching or calling OpenAI.
+    Accounts without a watch get "watching": false and should use /fetch-emails.
+    """
+    try:
+        data = request.json
+        access_token = data.get("access_token")
+        refresh_token = data.get("refresh_token")
+        if not access_token:
+            return jsonify({"error": "Access token is required."}), 401
+        account = gmail_client.known_account_email(access_token, refresh_token)
+        if account is None:
+            with gmail_client.gmail_service(access_token, refresh_token) as service:
+                account = gmail_client.get_account_email(service, access_token, refresh_token)
+        result = push.ready_tasks(account, data.get("fetch_from"), data.get("fetch_to"))
+        return jsonify(dict(result, email=account))
+    except Exception as e:
+        logging.error("Error in tasks endpoint: %s", str(e))
+        return jsonify({"error": str(e)}), 500
+
+@routes.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    return jsonify(cache.stats())
+
+@routes.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: stage latencies and counters from tasks.metrics,
+    plus the numeric stats of the cache, preprocessing, deadline parser,
+    Gmail client pool and OpenAI rate limiter as gauges.
+    """
+    sources = {
+        "llm_cache": cache.stats(),
+        "preprocess": preprocess.stats(),
+        "deadline_parser": deadline_parser.stats(),
+        "gmail_pool": gmail_client.pool_stats(),
+        "rate_limiter": rate_limiter.limiter.stats(),
+        "llm_budget": budget.stats(),
+    }
+    gauges = {}
+    for source, values in sources.items():
+        for key, value in values.items():
+            if isinstance(value, (bool, int, float)):
+                gauges[f"{source}_{key}"] = int(value) if isinstance(value, bool) else value
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+@routes.route("/usage", methods=["GET", "POST"])
+def llm_usage():
+    """
+    OpenAI token usage and estimated cost in the current budget window.
+    GET returns the totals for everyone; POST with the account's tokens adds
+    that account's usage and remaining budget.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        access_token = data.get("access_token")
+        refresh_token = data.get("refresh_token")
+        account = None
+        if access_token:
+            account = gmail_client.known_account_email(access_token, refresh_token)
+            if account is None:
+                with gmail_client.gmail_service(access_token, refresh_token) as service:
+                    account = gmail_client.get_account_email(service, access_token, refresh_token)
+        return jsonify(budget.summary(account))
+    except Exception as e:
+        logging.error("Error in usage endpoint: %s", str(e))
+        return jsonify({"error": str(e)}), 500
+
 # New endpoint to send an email via Gmail SMTP
-@app.route("/send-email", methods=["POST"])
+@routes.route("/send-email", methods=["POST"])
 def send_email():
     try:
         data = request.json
@@ -138,6 +380,63 @@ def send_email():
         logging.error("Error in send-email endpoint: %s", str(e))
         return jsonify({"error": "Failed to send email."}), 500
 
+@routes.route("/send-emails", methods=["POST"])
+def send_emails():
+    """
+    Shares many tasks with many recipients in one call.
+    Body: {"sender_name", "recipients": [emails], "tasks": [{"task", "deadline"}]}.
+    The emails are queued in the outbox and sent in the background with retries;
+    poll /outbox?ids=... for delivery status.
+    """
+    try:
+        data = request.json
+        sender_name = data.get("sender_name")
+        recipients = data.get("recipients")
+        tasks = data.get("tasks")
+
+        # A string here would be queued one character at a time
+        valid_recipients = isinstance(recipients, list) and recipients and all(isinstance(r, str) and r for r in recipients)
+        valid_tasks = isinstance(tasks, list) and tasks and all(isinstance(item, dict) and item.get("task") for item in tasks)
+        if not sender_name or not valid_recipients or not valid_tasks:
+            return jsonify({"error": "sender_name, a list of recipients and a list of {\"task\", \"deadline\"} tasks are required."}), 400
+
+        outbox_ids = outbox.enqueue_many(sender_name, recipients, tasks)
+        return jsonify({"message": "Emails queued.", "outbox_ids": outbox_ids}), 202
+    except Exception as e:
+        logging.error("Error in send-emails endpoint: %s", str(e))
+        return jsonify({"error": "Failed to queue emails."}), 500
+
+@routes.route("/outbox", methods=["GET"])
+def outbox_status():
+    outbox_ids = [i for i in request.args.get("ids", "").split(",") if i]
+    return jsonify({"messages": outbox.status(outbox_ids)})
+
+def warm_up():
+    """
+    Imports the lazily loaded clients now. gunicorn.conf.py calls this in the
+    master when preloading, so forked workers share them copy-on-write.
+    """
+    started = time.perf_counter()
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
+    openai_module()
+    logging.info("Preloaded %d client modules in %.0f ms", len(LAZY_MODULES), (time.perf_counter() - started) * 1000)
+
+
+def create_app():
+    """
+    Builds the Flask app. The OpenAI and Google clients are not imported here,
+    so a worker is ready to serve sooner; see warm_up().
+    """
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(routes)
+    logging.info("App created %.0f ms after startup", (time.perf_counter() - STARTED) * 1000)
+    return app
+
+
+app = create_app()
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5174))
     logging.info("Starting server on host 0.0.0.0 and port %d", port)
@@ -0,0 +1,155 @@
+"""
+Async serving mode: the same endpoints as app.py on aiohttp, with
+non-blocking Gmail and OpenAI clients so one process serves many users.
+
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+"""
+import os
+import time
+import asyncio
+import logging
+import aiohttp
+from aiohttp import web
+from tasks.async_gmail import fetch_emails_async
+from tasks.async_pipeline import process_emails_async
+from tasks.pipeline import request_failures
+from tasks.ai_processor import openai_module
+from tasks.email_sender import send_email_via_smtp
+from tasks import jobs, metrics, budget
+
+logging.basicConfig(level=logging.DEBUG)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == "OPTIONS":
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    return response
+
+
+@web.middleware
+async def openai_session_middleware(request, handler):
+    # Lets openai's acreate reuse one keep-alive session instead of opening one per call
+    openai_module().aiosession.set(request.app["openai_session"])
+    return await handler(request)
+
+
+async def index(request):
+    logging.debug("Rendering index page.")
+    return web.FileResponse(os.path.join(BASE_DIR, "templates", "index.html"))
+
+
+async def _fetch_and_process(request, fetch_from, fetch_to):
+    data = await request.json()
+    access_token = data.get("access_token")
+    refresh_token = data.get("refresh_token")
+    if not access_token:
+        return web.json_response({"error": "Access token is required."}, status=401)
+
+    started = time.perf_counter()
+    with metrics.request_timings() as timings, budget.request_usage() as usage, request_failures() as failed:
+        emails = await fetch_emails_async(request.app["gmail_session"], access_token, refresh_token, data.get(fetch_from), data.get(fetch_to) if fetch_to else None)
+        if isinstance(emails, dict):
+            return web.json_response(emails, status=emails.get("status", 500))
+        logging.debug("Fetched %d emails from Gmail API", len(emails))
+
+        actionable_tasks = await process_emails_async(emails)
+    logging.debug("Returning response with %d actionable tasks", len(actionable_tasks))
+    # Failed emails are not stored and are extracted on the next fetch; see app.report_failures
+    response = {"tasks": actionable_tasks, "failed_emails": len(failed)}
+    status = 200
+    if failed and len(failed) == len(emails):
+        response["error"] = "Task extraction failed, try again later."
+        status = 502
+    if data.get("timings"):
+        response["timings"] = {"total_ms": round((time.perf_counter() - started) * 1000, 3), "stages": timings}
+    if data.get("usage"):
+        response["usage"] = dict(usage, cost_usd=budget.cost(usage["prompt_tokens"], usage["completion_tokens"]))
+    return web.json_response(response, status=status)
+
+
+async def fetch_and_process_emails(request):
+    try:
+        return await _fetch_and_process(request, "fetch_from", "fetch_to")
+    except Exception as e:
+        logging.error("Error in fetch_and_process_emails: %s", str(e))
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def fetch_old_emails(request):
+    try:
+        data = await request.json()
+        if data.get("background") and data.get("access_token"):
+            job_id = jobs.enqueue_backfill(data["access_token"], data.get("refresh_token"), data.get("first_updated"))
+            return web.json_response({"job_id": job_id, "status": "queued"}, status=202)
+        return await _fetch_and_process(request, "first_updated", None)
+    except Exception as e:
+        logging.error("Error in fetch_old_emails: %s", str(e))
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def send_email(request):
+    try:
+        data = await request.json()
+        sender_name = data.get("sender_name")
+        recepient_email = data.get("recepient_email")
+        deadline = data.get("deadline")
+        task = data.get("task")
+
+        if not all([sender_name, recepient_email, task]):
+            return web.json_response({"error": "All fields are required."}, status=400)
+
+        # smtplib is blocking; the pooled connection keeps this short
+        await asyncio.get_running_loop().run_in_executor(None, send_email_via_smtp, sender_name, recepient_email, deadline, task)
+        return web.json_response({"message": "Email sent successfully."})
+    except Exception as e:
+        logging.error("Error in send-email endpoint: %s", str(e))
+        return web.json_response({"error": "Failed to send email."}, status=500)
+
+
+async def prometheus_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def llm_usage(request):
+    return web.json_response(await asyncio.to_thread(budget.summary))
+
+
+async def _open_sessions(app):
+    timeout = aiohttp.ClientTimeout(total=120)
+    app["gmail_session"] = aiohttp.ClientSession(timeout=timeout)
+    app["openai_session"] = aiohttp.ClientSession(timeout=timeout)
+
+
+async def _close_sessions(app):
+    await app["gmail_session"].close()
+    await app["openai_session"].close()
+
+
+def create_app():
+    app = web.Application(middlewares=[cors_middleware, openai_session_middleware])
+    app.router.add_get("/", index)
+    app.router.add_static("/static", os.path.join(BASE_DIR, "static"))
+    app.router.add_post("/fetch-emails", fetch_and_process_emails)
+    app.router.add_post("/fetch-old-emails", fetch_old_emails)
+    app.router.add_post("/send-email", send_email)
+    app.router.add_get("/metrics", prometheus_metrics)
+    app.router.add_get("/usage", llm_usage)
+    app.on_startup.append(_open_sessions)
+    app.on_cleanup.append(_close_sessions)
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", 5174))
+    logging.info("Starting async server on host 0.0.0.0 and port %d", port)
+    web.run_app(app, host="0.0.0.0", port=port)
@@ -0,0 +1,112 @@
+"""
+Micro-benchmark for tasks.utils.score_email_importance.
+
+Compares the precompiled single-pass scorer against the previous
+implementation (one re.search per keyword per field), checks that both
+return identical scores, and prints timings per body size.
+
+    python -m benchmarks.bench_scoring
+"""
+import re
+import random
+import timeit
+from tasks.utils import score_email_importance, IMPORTANT_KEYWORDS, SPAM_KEYWORDS, SPAM_SENDER_DOMAINS, gmail_user
+
+
+def legacy_score_email_importance(subject, body, sender=None, my_email=None):
+    # Reference copy of the scorer before it was precompiled
+    score = 1
+
+    def keyword_score(text, keywords):
+        score = 0
+        if not text:
+            return score
+        for keyword, weight in keywords.items():
+            if re.search(rf'\b{re.escape(keyword)}\b', text, re.IGNORECASE):
+                score += weight
+        return score
+
+    def pattern_score(text):
+        score = 0
+        if not text:
+            return score
+        patterns = [
+            r"\b\d{2,4}\s*off\b",
+            r"\bup to\s*\d{1,4}%\s*off\b",
+            r"\bsave\s*\d{1,4}\b",
+            r"\b\d{2,4}%\s*discount\b",
+        ]
+        for pattern in patterns:
+            if re.search(pattern, text, re.IGNORECASE):
+                score -= 6
+        return score
+
+    if sender:
+        sender_lower = sender.lower()
+        if gmail_user and gmail_user.lower() in sender_lower:
+            return 10
+        if "no-reply" in sender_lower or "noreply" in sender_lower or "newsletter" in sender_lower:
+            score -= 2
+        if my_email and my_email.lower() in sender_lower:
+            score -= 2
+        if any(domain in sender_lower for domain in SPAM_SENDER_DOMAINS):
+            score -= 5
+
+    score += keyword_score(subject, IMPORTANT_KEYWORDS)
+    score += keyword_score(body, IMPORTANT_KEYWORDS)
+    score += keyword_score(subject, SPAM_KEYWORDS)
+    score += keyword_score(body, SPAM_KEYWORDS)
+    score += pattern_score(subject)
+    score += pattern_score(body)
+    return score
+
+
+FILLER = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua orders updated offering taskbar "
+).split()
+KEYWORDS = list(IMPORTANT_KEYWORDS) + list(SPAM_KEYWORDS)
+EXTRAS = ["ſale", "50 OFF", "up to 70% off", "save 100", "20% discount", "Order-now", "MENTIONED YOU IN A COMMENT", "e-mail:", "auto-generated"]
+
+
+def random_text(rng, words, keyword_rate=0.05):
+    tokens = []
+    for _ in range(words):
+        roll = rng.random()
+        if roll < keyword_rate:
+            keyword = rng.choice(KEYWORDS)
+            tokens.append(keyword.upper() if rng.random() < 0.2 else keyword)
+        elif roll < keyword_rate * 1.3:
+            tokens.append(rng.choice(EXTRAS))
+        else:
+            tokens.append(rng.choice(FILLER))
+    return rng.choice([" ", "\n", ", ", ". "]).join(tokens)
+
+
+def check_equivalence(samples=2000, seed=7):
+    rng = random.Random(seed)
+    for _ in range(samples):
+        subject = random_text(rng, rng.randint(0, 12), keyword_rate=0.2)
+        body = random_text(rng, rng.randint(0, 400), keyword_rate=rng.choice([0.0, 0.02, 0.2]))
+        sender = rng.choice([None, "Jane <jane@example.com>", "noreply@hubspot.com", "news@mailchimp.com"])
+        expected = legacy_score_email_importance(subject, body, sender=sender, my_email="john@example.com")
+        actual = score_email_importance(subject, body, sender=sender, my_email="john@example.com")
+        assert expected == actual, (subject, body, sender, expected, actual)
+    print(f"Scores identical on {samples} random emails.")
+
+
+def run_benchmark(sizes=(200, 2000, 20000, 100000), keyword_rate=0.005, repeat=5):
+    rng = random.Random(11)
+    print(f"{'body words':>10} {'legacy ms':>10} {'compiled ms':>12} {'speedup':>8}")
+    for words in sizes:
+        subject = random_text(rng, 8, keyword_rate=0.2)
+        body = random_text(rng, words, keyword_rate=keyword_rate)
+        number = max(1, 20000 // words)
+        legacy = min(timeit.repeat(lambda: legacy_score_email_importance(subject, body), number=number, repeat=repeat)) / number
+        compiled = min(timeit.repeat(lambda: score_email_importance(subject, body), number=number, repeat=repeat)) / number
+        print(f"{words:>10} {legacy * 1000:>10.3f} {compiled * 1000:>12.3f} {legacy / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    check_equivalence()
+    run_benchmark()
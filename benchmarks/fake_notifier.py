@@ -0,0 +1,186 @@
+"""
+Local stand-in for Gmail's Pub/Sub push notifications, to try the push path
+(POST /gmail/watch, /gmail/push, /tasks) without a Google Cloud project.
+
+    python -m benchmarks.fake_notifier                    # end-to-end demo
+    python -m benchmarks.fake_notifier --deliver 20 --users 4
+    python -m benchmarks.fake_notifier --notify http://localhost:5000/gmail/push --email me@example.com --history-id 1234
+
+The demo starts the fake Gmail and OpenAI servers, registers a watch for each
+user, delivers new mail to the fake mailbox, posts the notification Gmail
+would send, runs the job worker once and then compares the latency of the
+/tasks read with a full POST /fetch-emails of the same window.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import logging
+import argparse
+import tempfile
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from statistics import median
+from benchmarks.run_scenarios import _free_port, _start_fake
+
+DEFAULT_GMAIL_FAULTS = {"latency_ms": 10, "jitter_ms": 10}
+DEFAULT_OPENAI_FAULTS = {"latency_ms": 80, "jitter_ms": 80}
+SUBSCRIPTION = "projects/sortify-bench/subscriptions/gmail-push"
+
+
+def push_envelope(email_address, history_id, message_id=None):
+    """
+    The body Pub/Sub posts to a push endpoint for one Gmail notification.
+    """
+    data = json.dumps({"emailAddress": email_address, "historyId": int(history_id)})
+    return {
+        "message": {
+            "data": base64.b64encode(data.encode("utf-8")).decode("ascii"),
+            "messageId": message_id or str(int(time.time() * 1e6)),
+            "publishTime": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        },
+        "subscription": SUBSCRIPTION,
+    }
+
+
+def notify(webhook_url, email_address, history_id, token=None):
+    """
+    Posts a notification to a running app. Returns the HTTP status.
+    """
+    url = webhook_url + (f"?token={token}" if token else "")
+    request = urllib.request.Request(
+        url, data=json.dumps(push_envelope(email_address, history_id)).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status
+
+
+def deliver(gmail_port, count):
+    """
+    Adds count new messages to the fake mailbox. Returns the new historyId.
+    """
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{gmail_port}/_bench/deliver", data=json.dumps({"count": count}).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())["historyId"]
+
+
+def _window():
+    now = datetime.now(timezone.utc)
+    return {
+        "fetch_from": (now - timedelta(days=3)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "fetch_to": (now + timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+
+
+def _timed_post(client, path, payload):
+    started = time.perf_counter()
+    response = client.post(path, json=payload)
+    return (time.perf_counter() - started) * 1000, response
+
+
+def run_demo(users, mailbox_size, delivered):
+    # The app reads these at import time, so they are set before importing it
+    gmail_port, openai_port = _free_port(), _free_port()
+    workdir = tempfile.mkdtemp(prefix="sortify-push-")
+    os.environ["GMAIL_API_ROOT"] = f"http://127.0.0.1:{gmail_port}/"
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{openai_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("SORTIFY_DB_PATH", os.path.join(workdir, "bench.db"))
+    os.environ.setdefault("CLASSIFIER_MODEL_PATH", os.path.join(workdir, "classifier.joblib"))
+    os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+    os.environ.setdefault("OPENAI_RPM", "1000000")
+    os.environ.setdefault("OPENAI_TPM", "1000000000")
+    os.environ.setdefault("GMAIL_PUSH_TOPIC", "projects/sortify-bench/topics/gmail-push")
+    os.environ.setdefault("GMAIL_PUSH_TOKEN", "bench-push-token")
+
+    processes = [
+        _start_fake("gmail", gmail_port, {"size": mailbox_size, "thread_shape": "single"}, DEFAULT_GMAIL_FAULTS),
+        _start_fake("openai", openai_port, None, DEFAULT_OPENAI_FAULTS),
+    ]
+    try:
+        import openai
+        from app import app
+        from tasks import jobs
+        openai.api_base = os.environ["OPENAI_API_BASE"]
+        logging.getLogger().setLevel(logging.WARNING)
+
+        client = app.test_client()
+        tokens = [f"pushuser{i}" for i in range(users)]
+        accounts = {}
+        for token in tokens:
+            response = client.post("/gmail/watch", json={"access_token": token, "refresh_token": token})
+            accounts[token] = response.get_json()["account"]
+
+        # The first sync of each watch extracts the existing inbox
+        started = time.perf_counter()
+        jobs.run_worker(once=True)
+        seed_ms = (time.perf_counter() - started) * 1000
+
+        history_id = deliver(gmail_port, delivered)
+        for token in tokens:
+            client.post(
+                f"/gmail/push?token={os.environ['GMAIL_PUSH_TOKEN']}",
+                json=push_envelope(accounts[token], history_id)
+            )
+        started = time.perf_counter()
+        jobs.run_worker(once=True)
+        push_ms = (time.perf_counter() - started) * 1000
+
+        read_ms, fetch_ms, ready, fetched = [], [], 0, 0
+        for token in tokens:
+            payload = dict(_window(), access_token=token, refresh_token=token)
+            elapsed, response = _timed_post(client, "/tasks", payload)
+            read_ms.append(elapsed)
+            ready += len(response.get_json().get("tasks", []))
+            # Fresh credentials so the processed-message store cannot answer for it
+            fresh = f"fetch{token}"
+            elapsed, response = _timed_post(client, "/fetch-emails", dict(payload, access_token=fresh, refresh_token=fresh))
+            fetch_ms.append(elapsed)
+            fetched += len(response.get_json().get("tasks", []))
+    finally:
+        for process in processes:
+            process.terminate()
+
+    return {
+        "users": users,
+        "mailbox_size": mailbox_size,
+        "delivered": delivered,
+        "seed_sync_ms": round(seed_ms, 1),
+        "push_sync_ms": round(push_ms, 1),
+        "tasks_read_p50_ms": round(median(read_ms), 1),
+        "fetch_emails_p50_ms": round(median(fetch_ms), 1),
+        "tasks_ready": ready,
+        "tasks_fetched": fetched,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--mailbox-size", type=int, default=60)
+    parser.add_argument("--deliver", type=int, default=10, help="new messages delivered after the watch starts")
+    parser.add_argument("--notify", metavar="WEBHOOK_URL", help="only post one notification to a running app")
+    parser.add_argument("--email", help="account address for --notify")
+    parser.add_argument("--history-id", help="historyId for --notify")
+    parser.add_argument("--token", default=os.getenv("GMAIL_PUSH_TOKEN"), help="push token for --notify")
+    args = parser.parse_args(argv)
+
+    if args.notify:
+        if not args.email or not args.history_id:
+            parser.error("--notify needs --email and --history-id")
+        print(notify(args.notify, args.email, args.history_id, args.token))
+        return 0
+
+    result = run_demo(args.users, args.mailbox_size, args.deliver)
+    for key, value in result.items():
+        print(f"{key:<22} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
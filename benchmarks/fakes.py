@@ -0,0 +1,378 @@
+"""
+Local stand-ins for the Gmail and OpenAI HTTP APIs, with configurable latency
+and error rates and per-endpoint call counters.
+
+Both run on aiohttp in a background thread:
+
+    gmail = FakeGmailServer(generate_mailbox(200), Faults(latency_ms=20)).start()
+    openai_server = FakeOpenAIServer(Faults(latency_ms=300, error_rate=0.02)).start()
+    os.environ["GMAIL_API_ROOT"] = gmail.url          # read by tasks.gmail_client
+    openai.api_base = openai_server.url + "/v1"
+
+Call counters are also served at /_bench/calls (reset with POST /_bench/reset),
+so the servers can run in another process, see serve().
+
+Gmail covers profile, messages.list (with after:/before: queries), messages.get
+(full and metadata), history.list, watch/stop and the multipart batch endpoint.
+Which emails are actionable is decided from the email text, see
+is_actionable_text. POST /_bench/deliver {"count": n} adds n new messages, so
+history.list and push notifications (benchmarks/fake_notifier.py) have
+something to report.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from datetime import date, timedelta
+from email.parser import BytesParser
+from aiohttp import web
+
+ACTION_PATTERN = re.compile(r"\b(please|can you|could you|reminder:|action required)\b", re.IGNORECASE)
+EMAIL_SECTION_PATTERN = re.compile(r"^### Email (\d+)\n(.*?)(?=^### Email \d+\n|\Z)", re.MULTILINE | re.DOTALL)
+
+
+def is_actionable_text(text):
+    return bool(ACTION_PATTERN.search(text or ""))
+
+
+class Faults:
+    """
+    Latency and error injection for one fake server.
+    error_rate is the share of calls (or batch parts) answered with error_status.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, error_status=429, seed=3):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+
+    async def delay(self):
+        latency = self.latency_ms + self.rng.uniform(0, self.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def should_fail(self):
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+
+class _BackgroundServer:
+    """
+    Runs an aiohttp application on 127.0.0.1 (random port) in a daemon thread.
+    """
+
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+        self.calls = {}
+        self.port = None
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+
+    def count(self, endpoint, n=1):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + n
+
+    def reset_counters(self):
+        self.calls = {}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def make_app(self):
+        raise NotImplementedError
+
+    def start(self, port=0):
+        threading.Thread(target=self._run, args=(port,), daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def _app(self):
+        app = self.make_app()
+        app.router.add_get("/_bench/calls", self._get_calls)
+        app.router.add_post("/_bench/reset", self._reset)
+        return app
+
+    async def _get_calls(self, request):
+        return web.json_response(self.calls)
+
+    async def _reset(self, request):
+        self.reset_counters()
+        return web.json_response({})
+
+    def _run(self, port):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+GMAIL_ERROR_STATUSES = {400: "INVALID_ARGUMENT", 404: "NOT_FOUND", 429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE"}
+
+
+def _gmail_error(status):
+    return {"error": {"code": status, "message": "Fake Gmail error", "status": GMAIL_ERROR_STATUSES.get(status, "UNKNOWN")}}
+
+
+class FakeGmailServer(_BackgroundServer):
+    """
+    Serves one synthetic mailbox (see benchmarks.mailbox) to every account.
+    The account address is derived from the access token, so concurrent
+    benchmark users stay apart in the processed-message store.
+    """
+
+    def __init__(self, messages, faults=None, page_size=500):
+        super().__init__(faults)
+        self.messages = {message["id"]: message for message in messages}
+        self.ordered = sorted(messages, key=lambda message: -int(message["internalDate"]))
+        self.page_size = page_size
+        self.history_id = max((int(message["historyId"]) for message in messages), default=1)
+        self.delivered = 0
+        self.watches = {}  # account -> topicName
+
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/gmail/v1/users/me/profile", self.profile)
+        app.router.add_get("/gmail/v1/users/me/messages", self.list_messages)
+        app.router.add_get("/gmail/v1/users/me/messages/{id}", self.get_message)
+        app.router.add_get("/gmail/v1/users/me/history", self.list_history)
+        app.router.add_post("/gmail/v1/users/me/watch", self.watch)
+        app.router.add_post("/gmail/v1/users/me/stop", self.stop_watch)
+        app.router.add_post("/_bench/deliver", self.deliver)
+        app.router.add_post("/batch", self.batch)
+        app.router.add_post("/batch/gmail/v1", self.batch)
+        app.router.add_post("/token", self.token)
+        return app
+
+    @staticmethod
+    def _account(request):
+        token = request.headers.get("Authorization", "").replace("Bearer ", "") or "anonymous"
+        return f"{re.sub(r'[^a-zA-Z0-9]', '', token)[:32] or 'user'}@bench.local"
+
+    async def _answer(self, endpoint, payload):
+        self.count(endpoint)
+        await self.faults.delay()
+        if self.faults.should_fail():
+            status = self.faults.error_status
+            return web.json_response(_gmail_error(status), status=status)
+        return web.json_response(payload)
+
+    async def token(self, request):
+        self.count("token")
+        return web.json_response({"access_token": "refreshed", "expires_in": 3600, "token_type": "Bearer"})
+
+    async def profile(self, request):
+        return await self._answer("profile", {
+            "emailAddress": self._account(request),
+            "messagesTotal": len(self.messages),
+            "historyId": str(self.history_id),
+        })
+
+    def _list(self, query, page_token, page_size):
+        after = re.search(r"after:(\d+)", query or "")
+        before = re.search(r"before:(\d+)", query or "")
+        matching = [
+            message for message in self.ordered
+            if (not after or int(message["internalDate"]) >= int(after.group(1)) * 1000)
+            and (not before or int(message["internalDate"]) < int(before.group(1)) * 1000)
+        ]
+        start = int(page_token or 0)
+        page = matching[start:start + page_size]
+        result = {"messages": [{"id": m["id"], "threadId": m["threadId"]} for m in page], "resultSizeEstimate": len(matching)}
+        if start + page_size < len(matching):
+            result["nextPageToken"] = str(start + page_size)
+        return result
+
+    async def list_messages(self, request):
+        page_size = min(self.page_size, int(request.query.get("maxResults", self.page_size)))
+        return await self._answer("messages.list", self._list(request.query.get("q"), request.query.get("pageToken"), page_size))
+
+    def _message(self, message_id, message_format):
+        message = self.messages.get(message_id)
+        if message is None:
+            return None
+        if message_format == "metadata":
+            return {key: message[key] for key in ("id", "threadId", "snippet", "historyId", "sizeEstimate")} | {
+                "payload": {"headers": message["payload"]["headers"]}
+            }
+        return message
+
+    async def get_message(self, request):
+        message = self._message(request.match_info["id"], request.query.get("format", "full"))
+        if message is None:
+            self.count("messages.get")
+            return web.json_response(_gmail_error(404), status=404)
+        return await self._answer("messages.get", message)
+
+    async def list_history(self, request):
+        start = int(request.query.get("startHistoryId", 0))
+        added = [
+            {"messagesAdded": [{"message": {"id": m["id"], "threadId": m["threadId"], "labelIds": m["labelIds"]}}]}
+            for m in self.ordered if int(m["historyId"]) > start
+        ]
+        return await self._answer("history.list", {"history": added, "historyId": str(self.history_id)})
+
+    async def watch(self, request):
+        body = await request.json()
+        self.watches[self._account(request)] = body.get("topicName")
+        # Gmail watches expire after 7 days
+        expiration = int((time.time() + 7 * 86400) * 1000)
+        return await self._answer("watch", {"historyId": str(self.history_id), "expiration": str(expiration)})
+
+    async def stop_watch(self, request):
+        self.count("stop")
+        self.watches.pop(self._account(request), None)
+        return web.Response(status=204)
+
+    def add_messages(self, count, actionable_ratio=0.6):
+        """
+        Adds count new single-message threads from the last hour and returns them.
+        """
+        from benchmarks.mailbox import generate_mailbox
+
+        added = generate_mailbox(count, spam_ratio=0.2, actionable_ratio=actionable_ratio, thread_shape="single",
+                                 window_hours=2, seed=1000 + self.delivered)
+        for message in added:
+            self.delivered += 1
+            self.history_id += 1
+            message["id"] = f"d{self.delivered:07d}"
+            message["threadId"] = f"dt{self.delivered:06d}"
+            message["historyId"] = str(self.history_id)
+            self.messages[message["id"]] = message
+        self.ordered = sorted(self.messages.values(), key=lambda message: -int(message["internalDate"]))
+        return added
+
+    async def deliver(self, request):
+        body = await request.json() if request.can_read_body else {}
+        added = self.add_messages(int(body.get("count", 1)), float(body.get("actionable_ratio", 0.6)))
+        return web.json_response({"ids": [message["id"] for message in added], "historyId": str(self.history_id)})
+
+    async def batch(self, request):
+        body = await request.read()
+        content_type = request.headers["Content-Type"]
+        mime = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        self.count("batch")
+        await self.faults.delay()
+
+        boundary = "batch_response_boundary"
+        parts = []
+        for part in mime.get_payload():
+            inner = part.get_payload()
+            request_line = inner.split("\n", 1)[0].strip()
+            path = request_line.split(" ")[1]
+            match = re.match(r"/gmail/v1/users/me/messages/([^?]+)(?:\?(.*))?", path)
+            query = dict(pair.split("=", 1) for pair in (match.group(2) or "").split("&") if "=" in pair) if match else {}
+            self.count("batch.part")
+
+            status, payload = 200, None
+            if match is None:
+                status, payload = 400, _gmail_error(400)
+            elif self.faults.should_fail():
+                status = self.faults.error_status
+                payload = _gmail_error(status)
+            else:
+                payload = self._message(match.group(1), query.get("format", "full"))
+                if payload is None:
+                    status, payload = 404, _gmail_error(404)
+
+            content_id = part["Content-ID"].replace("<", "<response-", 1)
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        return web.Response(
+            body=("".join(parts) + f"--{boundary}--\r\n").encode("utf-8"),
+            headers={"Content-Type": f"multipart/mixed; boundary={boundary}"}
+        )
+
+
+class FakeOpenAIServer(_BackgroundServer):
+    """
+    Answers /v1/chat/completions for the prompts in tasks/ai_processor.py.
+    Emails containing a request ("please", "can you", ...) get a task; deadlines
+    are three days from today.
+    """
+
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+    @staticmethod
+    def _task_for(text):
+        if not is_actionable_text(text):
+            return "No actionable tasks."
+        sentence = next((s for s in re.split(r"(?<=[.?!])\s+", text) if is_actionable_text(s)), text)
+        return "Follow up: " + " ".join(sentence.split())[:120]
+
+    def reply(self, messages):
+        system = messages[0]["content"]
+        user = messages[-1]["content"]
+        deadline = (date.today() + timedelta(days=3)).isoformat()
+        if "### Batch mode" in system:
+            items = [{"index": int(index), "task": self._task_for(body)} for index, body in EMAIL_SECTION_PATTERN.findall(user)]
+            return json.dumps(items)
+        if "single JSON object" in system:
+            task = self._task_for(user)
+            return json.dumps({"task": task, "deadline": "" if task.startswith("No actionable") else deadline})
+        if "extracts a single deadline" in system:
+            return deadline
+        if "to-do list" in user:
+            return "Summary of the tasks."
+        return self._task_for(user)
+
+    async def chat_completions(self, request):
+        data = await request.json()
+        self.count("chat.completions")
+        await self.faults.delay()
+        if self.faults.should_fail():
+            status = self.faults.error_status
+            return web.json_response(
+                {"error": {"message": "Injected failure", "type": "rate_limit_error" if status == 429 else "server_error"}},
+                status=status,
+                headers={"Retry-After": "0.1", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "100ms"}
+                if status == 429 else None
+            )
+
+        content = self.reply(data["messages"])
+        prompt_tokens = sum(len(message["content"]) for message in data["messages"]) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        self.count("tokens", prompt_tokens + completion_tokens)
+        return web.json_response({
+            "id": f"chatcmpl-bench-{time.monotonic_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": data.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+def serve(kind, port, mailbox=None, faults=None):
+    """
+    Runs one fake server in the foreground, for use in a separate process.
+    kind is "gmail" or "openai"; mailbox holds generate_mailbox() arguments.
+    """
+    from benchmarks.mailbox import generate_mailbox
+
+    faults = Faults(**(faults or {}))
+    if kind == "gmail":
+        server = FakeGmailServer(generate_mailbox(**(mailbox or {})), faults)
+    else:
+        server = FakeOpenAIServer(faults)
+    server.start(port)
+    threading.Event().wait()
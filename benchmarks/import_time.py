@@ -0,0 +1,122 @@
+"""
+Import-time report for worker startup: runs `python -X importtime` in fresh
+interpreters and lists the slowest top-level packages.
+
+    python -m benchmarks.import_time                  # import app
+    python -m benchmarks.import_time --module async_app --runs 10
+    python -m benchmarks.import_time --warm-up        # also time app.warm_up()
+
+Times are the median over the runs, in milliseconds. "cumulative" includes
+everything a package imported that was not loaded yet, so the rows overlap.
+With --warm-up the table also covers the modules warm_up() loads.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+
+# Importing the app needs no real credentials
+DEFAULT_ENV = {"OPENAI_API_KEY": "import-time"}
+
+
+def parse_importtime(stderr):
+    """
+    Returns {module: (self_us, cumulative_us)} from -X importtime output.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def run_once(module, warm_up):
+    code = f"import {module}"
+    if warm_up:
+        code += f"; import time; started = time.perf_counter(); {module}.warm_up(); print((time.perf_counter() - started) * 1e6)"
+    env = dict(os.environ)
+    for key, value in DEFAULT_ENV.items():
+        env.setdefault(key, value)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    modules = parse_importtime(result.stderr)
+    # Modules that warm_up() imports show up after the app's own import
+    own = {name: times for name, times in modules.items() if name != module}
+    total_us = modules[module][1] if module in modules else 0
+    warm_up_us = float(result.stdout.strip().splitlines()[-1]) if warm_up else None
+    return total_us, warm_up_us, own
+
+
+def report(module="app", runs=5, top=15, warm_up=False):
+    totals, warm_ups, per_package = [], [], {}
+    for _ in range(runs):
+        total_us, warm_up_us, modules = run_once(module, warm_up)
+        totals.append(total_us)
+        if warm_up_us is not None:
+            warm_ups.append(warm_up_us)
+        packages = {}
+        for name, (self_us, cumulative_us) in modules.items():
+            package = name.split(".")[0]
+            entry = packages.setdefault(package, [0, 0])
+            entry[0] += self_us
+            # The outermost import of a package carries its cumulative time
+            entry[1] = max(entry[1], cumulative_us)
+        for package, (self_us, cumulative_us) in packages.items():
+            per_package.setdefault(package, []).append((self_us, cumulative_us))
+
+    rows = sorted(
+        (
+            {
+                "package": package,
+                "self_ms": round(median(s for s, _ in samples) / 1000, 1),
+                "cumulative_ms": round(median(c for _, c in samples) / 1000, 1),
+            }
+            for package, samples in per_package.items()
+        ),
+        key=lambda row: -row["cumulative_ms"],
+    )
+    result = {
+        "module": module,
+        "runs": runs,
+        "import_ms": round(median(totals) / 1000, 1),
+        "packages": rows[:top],
+    }
+    if warm_ups:
+        result["warm_up_ms"] = round(median(warm_ups) / 1000, 1)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--warm-up", action="store_true", help="also time <module>.warm_up()")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    result = report(args.module, args.runs, args.top, args.warm_up)
+    print(f"import {result['module']}: {result['import_ms']} ms (median of {result['runs']} runs)")
+    if "warm_up_ms" in result:
+        print(f"{result['module']}.warm_up(): {result['warm_up_ms']} ms")
+    print(f"{'package':<28} {'cumulative ms':>14} {'self ms':>9}")
+    for row in result["packages"]:
+        print(f"{row['package']:<28} {row['cumulative_ms']:>14} {row['self_ms']:>9}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
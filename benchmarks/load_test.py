@@ -0,0 +1,83 @@
+"""
+Concurrent load test for the fetch endpoints, to compare the sync (app.py)
+and async (async_app.py) serving modes under the same load.
+
+    gunicorn app:app -w 2 -b :8001 &
+    gunicorn async_app:app -w 2 -b :8002 --worker-class aiohttp.GunicornWebWorker &
+    python -m benchmarks.load_test --target sync=http://localhost:8001 \
+        --target async=http://localhost:8002 --concurrency 50 --requests 200
+
+Point GMAIL_API_ROOT / OPENAI_API_BASE of both servers at the stand-ins in
+benchmarks/fakes.py (or real accounts) so that only the serving mode differs:
+
+    python -c "from benchmarks.fakes import serve; serve('gmail', 8801)" &
+    python -c "from benchmarks.fakes import serve; serve('openai', 8802)" &
+    export GMAIL_API_ROOT=http://127.0.0.1:8801/ OPENAI_API_BASE=http://127.0.0.1:8802/v1
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import aiohttp
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run_load(url, payload, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1200)) as session:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.post(url, json=payload) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", required=True, help="name=base_url, repeat to compare")
+    parser.add_argument("--path", default="/fetch-emails")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--payload", default='{"access_token": "load-test", "refresh_token": "load-test"}')
+    args = parser.parse_args(argv)
+
+    payload = json.loads(args.payload)
+    print(f"{'target':<10} {'rps':>8} {'p50 ms':>10} {'p99 ms':>10} {'errors':>7}")
+    for target in args.target:
+        name, base_url = target.split("=", 1)
+        result = asyncio.run(run_load(base_url.rstrip("/") + args.path, payload, args.concurrency, args.requests))
+        print(f"{name:<10} {result['throughput_rps']:>8} {result['p50_ms']:>10} {result['p99_ms']:>10} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
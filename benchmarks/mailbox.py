@@ -0,0 +1,135 @@
+"""
+Synthetic mailboxes for the benchmark stand-ins, as Gmail message resources.
+
+generate_mailbox() mixes actionable requests, FYI mail and promotional spam,
+with body sizes, quoted reply history and thread shapes set by the caller.
+"""
+import base64
+import random
+from datetime import datetime, timedelta, timezone
+from tasks.utils import SPAM_SENDER_DOMAINS
+
+PEOPLE = ["Ana Cruz", "Ben Ito", "Chloe Park", "Dev Patel", "Eli Moreno", "Fay Chen", "Gus Olsen", "Hana Sato"]
+WORK_DOMAINS = ["acme.com", "globex.io", "initech.net", "umbrella.org"]
+TOPICS = ["Q3 budget", "vendor contract", "launch checklist", "hiring plan", "board deck", "customer renewal", "security review", "offsite agenda"]
+REQUESTS = [
+    "Can you review the {topic} and send comments by Friday?",
+    "Please update the {topic} before {day}.",
+    "Could you confirm the numbers in the {topic} by tomorrow?",
+    "Reminder: submit your input on the {topic} by {day}.",
+    "Action required: approve the {topic} in the portal.",
+]
+UPDATES = [
+    "Sharing the latest {topic} for awareness, no changes needed on your side.",
+    "The {topic} was finalized yesterday and everything looks on track.",
+    "Notes from today's sync on the {topic} are in the shared folder.",
+]
+PROMOTIONS = [
+    "Flash sale! Up to 70% off everything this weekend only.",
+    "Exclusive offer: save 500 on your next order with code SAVE500.",
+    "New arrivals just dropped. Shop now and get free shipping.",
+]
+FILLER = (
+    "the team met to go over the plan and the open questions from last week while "
+    "we keep track of the timeline the owners and the risks that came up in review "
+).split()
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+
+
+def _filler(rng, words):
+    return " ".join(rng.choice(FILLER) for _ in range(words))
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def _kind(rng, spam_ratio, actionable_ratio):
+    if rng.random() < spam_ratio:
+        return "spam"
+    return "actionable" if rng.random() < actionable_ratio else "update"
+
+
+def _thread_sizes(rng, size, thread_shape):
+    """
+    Splits size messages into threads: "single" (one message each),
+    "chatty" (5 to 20 replies) or "mixed" (mostly singles, some 2 to 8).
+    """
+    sizes = []
+    while sum(sizes) < size:
+        if thread_shape == "single":
+            sizes.append(1)
+        elif thread_shape == "chatty":
+            sizes.append(rng.randint(5, 20))
+        else:
+            sizes.append(1 if rng.random() < 0.7 else rng.randint(2, 8))
+    sizes[-1] -= sum(sizes) - size
+    return sizes
+
+
+def make_message(message_id, thread_id, sender, subject, body, sent_at, history_id):
+    snippet = " ".join(body.split())[:200]
+    return {
+        "id": message_id,
+        "threadId": thread_id,
+        "labelIds": ["INBOX"],
+        "snippet": snippet,
+        "historyId": str(history_id),
+        "internalDate": str(int(sent_at.timestamp() * 1000)),
+        "sizeEstimate": len(body.encode("utf-8")) + 600,
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": [
+                {"name": "From", "value": sender},
+                {"name": "To", "value": "me@bench.local"},
+                {"name": "Subject", "value": subject},
+                {"name": "Date", "value": sent_at.strftime("%a, %d %b %Y %H:%M:%S %z")},
+            ],
+            "parts": [{"mimeType": "text/plain", "body": {"data": _b64(body)}}],
+        },
+    }
+
+
+def generate_mailbox(size=100, spam_ratio=0.3, actionable_ratio=0.6, thread_shape="mixed",
+                     body_words=(40, 300), quoted_history=True, window_hours=48, seed=7, now=None):
+    """
+    Returns size Gmail message resources spread over the last window_hours.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    messages = []
+    history_id = 1000
+
+    for thread_number, thread_size in enumerate(_thread_sizes(rng, size, thread_shape)):
+        thread_id = f"t{thread_number:06d}"
+        kind = _kind(rng, spam_ratio, actionable_ratio)
+        topic = rng.choice(TOPICS)
+        started = now - timedelta(hours=rng.uniform(1, window_hours - 1))
+        previous = []
+
+        for reply in range(thread_size):
+            sent_at = min(now - timedelta(minutes=1), started + timedelta(minutes=17 * reply))
+            if kind == "spam":
+                sender = f"Deals <promo@{rng.choice(SPAM_SENDER_DOMAINS)}.com>"
+                subject = rng.choice(["Don't miss out", "Your weekly deals", "Last chance"])
+                text = rng.choice(PROMOTIONS)
+            else:
+                person = rng.choice(PEOPLE)
+                sender = f"{person} <{person.split()[0].lower()}@{rng.choice(WORK_DOMAINS)}>"
+                subject = ("Re: " if reply else "") + topic.capitalize()
+                # Later replies in a thread are mostly short acknowledgements
+                template = rng.choice(REQUESTS if kind == "actionable" and (reply == 0 or rng.random() < 0.3) else UPDATES)
+                text = template.format(topic=topic, day=rng.choice(DAYS))
+
+            body = f"Hi,\n\n{text}\n\n{_filler(rng, rng.randint(*body_words))}\n\nThanks,\n{sender.split()[0]}\n"
+            if kind == "spam":
+                body += "\nYou are receiving this email because you subscribed. Unsubscribe here: https://example.com/u?id=123\n"
+            if quoted_history and previous:
+                quoted = "\n".join("> " + line for line in previous[-1].splitlines())
+                body += f"\nOn {sent_at.strftime('%a, %b %d, %Y')} someone <x@y.com> wrote:\n{quoted}\n"
+
+            history_id += 1
+            messages.append(make_message(f"m{len(messages):07d}", thread_id, sender, subject, body, sent_at, history_id))
+            previous.append(body)
+
+    return messages
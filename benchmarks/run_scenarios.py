@@ -0,0 +1,231 @@
+"""
+End-to-end benchmark of POST /fetch-emails against the local Gmail and OpenAI
+stand-ins in benchmarks/fakes.py, so the pipeline can be measured without
+credentials and regressions caught between commits.
+
+    python -m benchmarks.run_scenarios                      # all scenarios
+    python -m benchmarks.run_scenarios --scenario chatty_threads --users 8
+    python -m benchmarks.run_scenarios --json after.json --baseline before.json
+
+Each scenario runs a "cold" phase (new users, nothing stored yet) and a "warm"
+phase (the same users again) and reports throughput, p50/p99 latency, Gmail and
+OpenAI calls per email, and the tracemalloc peak of one extra cold request.
+The fakes run in child processes so they are not part of the memory figure.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.fakes import serve
+from benchmarks.load_test import percentile
+
+DEFAULT_GMAIL_FAULTS = {"latency_ms": 10, "jitter_ms": 10}
+DEFAULT_OPENAI_FAULTS = {"latency_ms": 80, "jitter_ms": 80}
+
+SCENARIOS = {
+    "small_inbox": {"mailbox": {"size": 40, "spam_ratio": 0.3, "thread_shape": "single"}},
+    "mixed_inbox": {"mailbox": {"size": 200, "spam_ratio": 0.3, "thread_shape": "mixed"}},
+    "chatty_threads": {"mailbox": {"size": 200, "spam_ratio": 0.1, "thread_shape": "chatty"}},
+    "spam_heavy": {"mailbox": {"size": 300, "spam_ratio": 0.8, "thread_shape": "single"}},
+    "large_bodies": {"mailbox": {"size": 60, "body_words": (1500, 4000), "thread_shape": "single"}},
+    "flaky_apis": {
+        "mailbox": {"size": 100, "thread_shape": "mixed"},
+        "gmail_faults": {"latency_ms": 30, "jitter_ms": 30, "error_rate": 0.05},
+        "openai_faults": {"latency_ms": 150, "jitter_ms": 100, "error_rate": 0.05},
+    },
+}
+# Metrics where a higher value is a regression
+LOWER_IS_BETTER = ["p50_ms", "p99_ms", "gmail_calls_per_email", "llm_calls_per_email", "llm_tokens_per_email", "peak_memory_mb"]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get_json(url, method="GET"):
+    request = urllib.request.Request(url, method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read() or b"{}")
+
+
+def _start_fake(kind, port, mailbox=None, faults=None):
+    process = multiprocessing.Process(target=serve, args=(kind, port, mailbox, faults), daemon=True)
+    process.start()
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            _get_json(f"http://127.0.0.1:{port}/_bench/calls")
+            return process
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Fake {kind} server did not start on port {port}")
+            time.sleep(0.05)
+
+
+def _calls(port, reset=False):
+    calls = _get_json(f"http://127.0.0.1:{port}/_bench/calls")
+    if reset:
+        _get_json(f"http://127.0.0.1:{port}/_bench/reset", method="POST")
+    return calls
+
+
+def _fetch(client, token):
+    now = datetime.now(timezone.utc)
+    payload = {
+        "access_token": token,
+        "refresh_token": token,
+        "fetch_from": (now - timedelta(days=3)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "fetch_to": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+    started = time.perf_counter()
+    response = client.post("/fetch-emails", json=payload)
+    elapsed = time.perf_counter() - started
+    tasks = len(response.get_json().get("tasks", [])) if response.status_code == 200 else 0
+    return elapsed, response.status_code, tasks
+
+
+def run_phase(app, tokens, concurrency, emails_per_request, gmail_port, openai_port):
+    _calls(gmail_port, reset=True)
+    _calls(openai_port, reset=True)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda token: _fetch(app.test_client(), token), tokens))
+    elapsed = time.perf_counter() - started
+
+    gmail_calls = _calls(gmail_port)
+    openai_calls = _calls(openai_port)
+    latencies = [latency for latency, _, _ in results]
+    emails = max(1, emails_per_request * len(tokens))
+    # One batch part is one message fetch; the batch request itself is counted too
+    gmail_total = sum(count for endpoint, count in gmail_calls.items() if endpoint != "token")
+    return {
+        "requests": len(tokens),
+        "errors": sum(1 for _, status, _ in results if status != 200),
+        "tasks_per_request": round(sum(tasks for _, _, tasks in results) / len(tokens), 1),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(tokens) / elapsed, 2),
+        "emails_per_s": round(emails / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "gmail_calls_per_email": round(gmail_total / emails, 3),
+        "llm_calls_per_email": round(openai_calls.get("chat.completions", 0) / emails, 3),
+        "llm_tokens_per_email": round(openai_calls.get("tokens", 0) / emails, 1),
+    }
+
+
+def measure_memory(app, token):
+    tracemalloc.start()
+    try:
+        _fetch(app.test_client(), token)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 2)
+
+
+def run_scenario(app, name, scenario, users, concurrency, gmail_port, openai_port, run_id):
+    from benchmarks.mailbox import generate_mailbox
+
+    mailbox = scenario.get("mailbox", {})
+    gmail = _start_fake("gmail", gmail_port, mailbox, scenario.get("gmail_faults", DEFAULT_GMAIL_FAULTS))
+    openai_server = _start_fake("openai", openai_port, None, scenario.get("openai_faults", DEFAULT_OPENAI_FAULTS))
+    try:
+        emails_per_request = len(generate_mailbox(**mailbox))
+        tokens = [f"{name}{run_id}u{user}" for user in range(users)]
+        results = {}
+        for phase in ("cold", "warm"):
+            results[phase] = run_phase(app, tokens, concurrency, emails_per_request, gmail_port, openai_port)
+        results["cold"]["peak_memory_mb"] = measure_memory(app, f"{name}{run_id}mem")
+        return results
+    finally:
+        gmail.terminate()
+        openai_server.terminate()
+        gmail.join()
+        openai_server.join()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a line per metric that got worse than baseline by more than tolerance.
+    """
+    regressions = []
+    for name, phases in results.items():
+        for phase, metrics in phases.items():
+            before = baseline.get(name, {}).get(phase, {})
+            for metric in LOWER_IS_BETTER + ["throughput_rps"]:
+                if metric not in metrics or not before.get(metric):
+                    continue
+                change = (metrics[metric] - before[metric]) / before[metric]
+                if metric == "throughput_rps":
+                    change = -change
+                if change > tolerance:
+                    regressions.append(f"{name}/{phase} {metric}: {before[metric]} -> {metrics[metric]} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="repeat to pick several (default: all)")
+    parser.add_argument("--users", type=int, default=4, help="requests per phase, one per simulated user")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before flagging")
+    args = parser.parse_args(argv)
+
+    # The app reads these at import time, so they are set before importing it
+    gmail_port, openai_port = _free_port(), _free_port()
+    workdir = tempfile.mkdtemp(prefix="sortify-bench-")
+    os.environ["GMAIL_API_ROOT"] = f"http://127.0.0.1:{gmail_port}/"
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{openai_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("SORTIFY_DB_PATH", os.path.join(workdir, "bench.db"))
+    os.environ.setdefault("CLASSIFIER_MODEL_PATH", os.path.join(workdir, "classifier.joblib"))
+    os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+    # The fake has no quota; keep the client-side limiter out of the measurement
+    os.environ.setdefault("OPENAI_RPM", "1000000")
+    os.environ.setdefault("OPENAI_TPM", "1000000000")
+
+    import openai
+    from app import app
+    openai.api_base = os.environ["OPENAI_API_BASE"]
+    logging.getLogger().setLevel(logging.WARNING)
+
+    run_id = int(time.time())
+    results = {}
+    header = f"{'scenario':<16} {'phase':<5} {'rps':>7} {'emails/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'gmail/em':>9} {'llm/em':>7} {'tok/em':>7} {'peak MB':>8} {'err':>4}"
+    print(header)
+    for name in args.scenario or list(SCENARIOS):
+        results[name] = run_scenario(app, name, SCENARIOS[name], args.users, args.concurrency, gmail_port, openai_port, run_id)
+        for phase, m in results[name].items():
+            print(
+                f"{name:<16} {phase:<5} {m['throughput_rps']:>7} {m['emails_per_s']:>9} {m['p50_ms']:>9} {m['p99_ms']:>9} "
+                f"{m['gmail_calls_per_email']:>9} {m['llm_calls_per_email']:>7} {m['llm_tokens_per_email']:>7} "
+                f"{m.get('peak_memory_mb', ''):>8} {m['errors']:>4}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
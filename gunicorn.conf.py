@@ -0,0 +1,25 @@
+"""
+Gunicorn settings, read from the working directory by `gunicorn app:app`.
+
+The app is imported once in the master (preload_app, same as --preload in the
+Procfile) and workers are forked from it, so a recycled or added worker starts
+without importing anything and shares the loaded modules copy-on-write.
+"""
+import gc
+
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before workers are forked
+    from app import warm_up
+    warm_up()
+    # Keep the garbage collector from touching (and so copying) the preloaded objects in each worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Threads do not survive the fork, so each worker starts its own outbox
+    # senders; entries queued before a restart go out without waiting for a request
+    from tasks import outbox
+    outbox.start_workers()
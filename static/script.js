@@ -60,14 +60,12 @@ const createTaskElement = (task, index) => {
     return taskDiv;
 };
 
-const setupTaskCheckboxes = () => {
-    document.querySelectorAll(".task-checkbox").forEach(checkbox => {
-        checkbox.addEventListener("change", (e) => {
-            const taskDiv = e.target.closest(".task");
-            const summary = taskDiv.querySelector(".summary");
-            taskDiv.classList.toggle("completed", e.target.checked);
-            summary.classList.toggle("crossed", e.target.checked);
-        });
+const setupTaskCheckbox = (taskDiv) => {
+    const checkbox = taskDiv.querySelector(".task-checkbox");
+    checkbox.addEventListener("change", (e) => {
+        const summary = taskDiv.querySelector(".summary");
+        taskDiv.classList.toggle("completed", e.target.checked);
+        summary.classList.toggle("crossed", e.target.checked);
     });
 };
 
@@ -82,28 +80,59 @@ const closeModal = () => {
     modal.classList.add("hidden");
 };
 
+// Reads a newline-delimited JSON response and calls onEvent for every line
+const readEventStream = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+    }
+    if (buffer.trim()) {
+        onEvent(JSON.parse(buffer));
+    }
+};
+
 // Event Listeners
 fetchButton.addEventListener("click", async () => {
     const messages = ["Fetching emails...", "Analyzing content...", "Preparing tasks..."];
     const messageInterval = setLoadingState(true, messages);
+    let taskCount = 0;
 
     try {
-        const response = await fetch("/fetch-emails", { method: "POST" });
-        const data = await response.json();
+        const response = await fetch("/fetch-emails/stream", { method: "POST" });
 
-        clearInterval(messageInterval);
-        setLoadingState(false);
-
-        if (response.ok) {
-            resultsContainer.innerHTML = "";
-            data.tasks.forEach((task, index) => {
-                const taskElement = createTaskElement(task, index);
-                resultsContainer.appendChild(taskElement);
-            });
-            setupTaskCheckboxes();
-        } else {
+        if (!response.ok) {
+            const data = await response.json();
+            clearInterval(messageInterval);
+            setLoadingState(false);
             showError(data.error);
+            return;
         }
+
+        // Render each task as soon as the server has extracted it
+        await readEventStream(response, (event) => {
+            if (event.type === "task") {
+                const taskElement = createTaskElement(event.task, taskCount++);
+                resultsContainer.appendChild(taskElement);
+                setupTaskCheckbox(taskElement);
+            } else if (event.type === "progress") {
+                clearInterval(messageInterval);
+                loadingMessage.textContent = `Analyzed ${event.processed} of ${event.total} emails...`;
+            } else if (event.type === "error") {
+                throw new Error(event.error);
+            }
+        });
+
+        clearInterval(messageInterval);
+        setLoadingState(false);
     } catch (error) {
         clearInterval(messageInterval);
         setLoadingState(false);
@@ -1,20 +1,105 @@
 import os
-import openai
 from datetime import datetime
 import logging
 from tasks.utils import is_important_email
-from tasks.prompt import prompt
+from tasks.prompt import prompt, combined_prompt, batch_prompt
+from tasks import cache, rate_limiter, metrics, budget
+from tasks.preprocess import estimate_tokens
+from tasks.deadline_parser import resolve_deadline
 import re
+import json
+import time
 
-# Set OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
-today_str = datetime.today().strftime('%Y-%m-%d')
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 
+# Batch mode packs several emails into one completion under these limits
+BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", 3000))
+BATCH_MAX_EMAILS = int(os.getenv("LLM_BATCH_MAX_EMAILS", 20))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 60))
 
-def extract_tasks(email_body):
-    logging.debug("Processing emails...")
 
-    messages = [
+class ExtractionError(Exception):
+    """
+    An OpenAI call failed after its retries. Unlike "No actionable tasks." this
+    is not an answer about the email, so callers must not store it as one.
+    """
+
+
+def openai_module():
+    """
+    Returns the openai module, importing it on first use. It pulls in aiohttp and
+    numpy and is the slowest import in the app, so it is kept off the startup path.
+    """
+    import openai
+    if openai.api_key is None:
+        openai.api_key = OPENAI_API_KEY
+    return openai
+
+
+def record_usage(usage, endpoint, estimated_prompt_tokens=0):
+    """
+    Counts a successful completion and records its tokens against the current
+    account's budget. Without a usage block the prompt size is estimated.
+    """
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens", estimated_prompt_tokens)
+    completion_tokens = usage.get("completion_tokens", 0)
+    metrics.inc("llm_calls_total", outcome="ok")
+    metrics.inc("llm_tokens_total", prompt_tokens, type="prompt")
+    metrics.inc("llm_tokens_total", completion_tokens, type="completion")
+    budget.record(endpoint, prompt_tokens, completion_tokens)
+
+
+def chat_completion(messages, max_tokens, endpoint="other"):
+    """
+    Sends one chat completion through the shared rate limiter and returns the
+    reply text. Rate limits, timeouts and 5xx errors are retried with jittered
+    backoff; the last error is raised for the caller's fallback.
+    endpoint names the call site in the usage records (see tasks.budget).
+    """
+    openai = openai_module()
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    estimated = prompt_tokens + max_tokens
+    for attempt in range(rate_limiter.LLM_MAX_RETRIES + 1):
+        rate_limiter.limiter.acquire(estimated)
+        try:
+            response = openai.ChatCompletion.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=max_tokens,
+                request_timeout=LLM_REQUEST_TIMEOUT,
+            )
+        except rate_limiter.retryable_errors() as e:
+            if isinstance(e, openai.error.RateLimitError):
+                rate_limiter.limiter.on_rate_limited(rate_limiter.error_headers(e))
+            if attempt == rate_limiter.LLM_MAX_RETRIES:
+                metrics.inc("llm_calls_total", outcome="error")
+                raise
+            metrics.inc("llm_calls_total", outcome="retry")
+            delay = rate_limiter.backoff_delay(attempt)
+            logging.warning("OpenAI call failed (%s), retry %d in %.1fs", e, attempt + 1, delay)
+            time.sleep(delay)
+            continue
+        except Exception:
+            metrics.inc("llm_calls_total", outcome="error")
+            raise
+        rate_limiter.limiter.on_success(estimated, response.get("usage"))
+        record_usage(response.get("usage"), endpoint, prompt_tokens)
+        return response['choices'][0]['message']['content'].strip()
+
+
+def _clean_task(task):
+    return re.sub(r'(\*\*|\*)', '', task)
+
+
+def tasks_cache_key(email_body):
+    return cache.make_key("extract_tasks", OPENAI_MODEL, prompt, email_body)
+
+
+def tasks_messages(email_body):
+    return [
         {
             "role": "system",
             "content": prompt
@@ -25,31 +110,9 @@ def extract_tasks(email_body):
         }
     ]
 
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=500,
-        )
-        tasks = response['choices'][0]['message']['content'].strip()
-    except Exception as e:
-        logging.error("Error calling openai API in extract_tasks: %s", e)
-        tasks = "No actionable tasks."
-
-    # logging.debug("Extracted Tasks:\n%s", tasks)
-    cleaned_task = re.sub(r'(\*\*|\*)', '', tasks)
-    return cleaned_task
-
-
-def extract_deadline_with_chatgpt(tasks):
-    """
-    Uses ChatGPT to extract and normalize deadlines from the task list.
-    Converts phrases like 'tomorrow' or 'next week' into actual dates.
-    """
-    logging.debug("Extracting deadlines...")
 
-    messages = [
+def deadline_messages(tasks, today_str):
+    return [
          {
             "role": "system",
             "content": (
@@ -68,22 +131,285 @@ def extract_deadline_with_chatgpt(tasks):
         }
     ]
 
+
+def combined_messages(email_body, today_str):
+    return [
+        {
+            "role": "system",
+            "content": combined_prompt.replace("{today}", today_str)
+        },
+        {
+            "role": "user",
+            "content": f"Here is the email content:\n\n{email_body}"
+        }
+    ]
+
+
+def deadline_cache_key(messages, tasks, today_str):
+    # Keyed on today's date because relative dates resolve differently each day
+    return cache.make_key("extract_deadline", OPENAI_MODEL, today_str, messages[0]["content"], tasks)
+
+
+def combined_cache_key(messages, email_body, today_str):
+    return cache.make_key("extract_combined", OPENAI_MODEL, today_str, messages[0]["content"], email_body)
+
+
+@metrics.timed("extract_tasks")
+def extract_tasks(email_body):
+    logging.debug("Processing emails...")
+
+    messages = tasks_messages(email_body)
+
+    cache_key = tasks_cache_key(email_body)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        tasks = chat_completion(messages, 500, "extract_tasks")
+    except Exception as e:
+        logging.error("Error calling openai API in extract_tasks: %s", e)
+        raise ExtractionError(str(e)) from e
+
+    # logging.debug("Extracted Tasks:\n%s", tasks)
+    cleaned_task = _clean_task(tasks)
+    cache.put(cache_key, cleaned_task, kind="extract_tasks")
+    return cleaned_task
+
+
+def pack_batches(email_bodies, token_budget=None, max_emails=None):
+    """
+    Greedily groups email indexes so each group fits the token budget.
+    An email larger than the budget gets a group of its own.
+    """
+    token_budget = token_budget or BATCH_TOKEN_BUDGET
+    max_emails = max_emails or BATCH_MAX_EMAILS
+
+    batches = []
+    current, current_tokens = [], 0
+    for index, body in enumerate(email_bodies):
+        tokens = estimate_tokens(body)
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_emails):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_response(content, count):
+    """
+    Parses the JSON array returned in batch mode.
+    Returns {index: task} for the well-formed items only (indexes are 0-based).
+    """
+    try:
+        items = json.loads(content)
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, task = item.get("index"), item.get("task")
+        if isinstance(index, bool) or not isinstance(index, int) or not 1 <= index <= count:
+            continue
+        if not isinstance(task, str) or not task.strip():
+            continue
+        if index - 1 in results:
+            # Duplicate answers for one email are ambiguous, retry it individually
+            results[index - 1] = None
+            continue
+        results[index - 1] = _clean_task(task.strip())
+    return {index: task for index, task in results.items() if task is not None}
+
+
+@metrics.timed("extract_batch")
+def _extract_batch(email_bodies):
+    """
+    Extracts tasks for a group of emails with one completion.
+    Items that are missing or malformed are re-split and retried, down to single emails.
+    Emails whose completion failed come back as None.
+    """
+    if len(email_bodies) == 1:
+        try:
+            return [extract_tasks(email_bodies[0])]
+        except ExtractionError:
+            return [None]
+
+    numbered = "\n\n".join(f"### Email {i}\n{body}" for i, body in enumerate(email_bodies, start=1))
+    messages = [
+        {
+            "role": "system",
+            "content": batch_prompt
+        },
+        {
+            "role": "user",
+            "content": f"Here are the emails:\n\n{numbered}"
+        }
+    ]
+
+    try:
+        content = chat_completion(messages, min(4000, 100 * len(email_bodies) + 100), "extract_batch")
+    except Exception as e:
+        # Retries are used up; splitting the batch would only send more calls into the same errors
+        logging.error("Error calling openai API in _extract_batch: %s", e)
+        return [None] * len(email_bodies)
+    parsed = parse_batch_response(content, len(email_bodies))
+
+    results = [parsed.get(i) for i in range(len(email_bodies))]
+    missing = [i for i, task in enumerate(results) if task is None]
+    for i, task in enumerate(results):
+        if task is not None:
+            cache.put(tasks_cache_key(email_bodies[i]), task, kind="extract_tasks")
+
+    if missing:
+        logging.warning("Batch of %d emails returned %d bad or missing items, re-splitting", len(email_bodies), len(missing))
+        if len(missing) == len(email_bodies):
+            # Nothing usable came back, split the batch in half
+            middle = len(missing) // 2
+            halves = [missing[:middle], missing[middle:]]
+        else:
+            halves = [missing]
+        for half in halves:
+            retried = _extract_batch([email_bodies[i] for i in half])
+            for i, task in zip(half, retried):
+                results[i] = task
+    return results
+
+
+def extract_tasks_batched(email_bodies, map_fn=map):
+    """
+    Batch mode for extract_tasks: packs emails into as few completions as fit the
+    token budget. Returns one task per email, in input order, or None for an
+    email whose completion failed.
+    map_fn lets the caller run the batches concurrently (e.g. executor.map).
+    """
+    results = [None] * len(email_bodies)
+    pending = []
+    for i, body in enumerate(email_bodies):
+        cached = cache.get(tasks_cache_key(body))
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append(i)
+
+    batches = [[pending[j] for j in batch] for batch in pack_batches([email_bodies[i] for i in pending])]
+    logging.debug("Extracting tasks for %d emails in %d batches", len(pending), len(batches))
+
+    batch_results = map_fn(lambda batch: _extract_batch([email_bodies[i] for i in batch]), batches)
+    for batch, tasks in zip(batches, batch_results):
+        for i, task in zip(batch, tasks):
+            results[i] = task
+    return results
+
+
+@metrics.timed("deadline")
+def extract_deadline_with_chatgpt(tasks):
+    """
+    Uses ChatGPT to extract and normalize deadlines from the task list.
+    Converts phrases like 'tomorrow' or 'next week' into actual dates.
+    """
+    logging.debug("Extracting deadlines...")
+
+    # Computed per call so long-running workers do not keep yesterday's date
+    today = datetime.today()
+    today_str = today.strftime('%Y-%m-%d')
+
+    # Explicit dates and common relative phrases do not need the LLM
+    deadline = resolve_deadline(tasks, today.date())
+    if deadline is not None:
+        logging.debug("Deadline resolved locally: %r", deadline)
+        return deadline
+
+    messages = deadline_messages(tasks, today_str)
+
+    cache_key = deadline_cache_key(messages, tasks, today_str)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=150,
-        )
-        deadlines = response['choices'][0]['message']['content'].strip()
+        deadlines = chat_completion(messages, 150, "deadline")
         logging.debug("Extracted Deadlines:\n%s", deadlines)
     except Exception as e:
         logging.error("Error calling openai API in extract_deadline_with_chatgpt: %s", e)
-        deadlines = ""
+        raise ExtractionError(str(e)) from e
 
+    cache.put(cache_key, deadlines, kind="extract_deadline")
     return deadlines
 
 
+def parse_combined_response(content, today_str):
+    """
+    Strictly parses the JSON returned in combined mode.
+    Returns (task, deadline), or None if the content is malformed.
+    """
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+
+    if not isinstance(data, dict) or set(data) != {"task", "deadline"}:
+        return None
+    task, deadline = data["task"], data["deadline"]
+    if not isinstance(task, str) or not task.strip() or not isinstance(deadline, str):
+        return None
+
+    deadline = deadline.strip()
+    if deadline:
+        try:
+            datetime.strptime(deadline, '%Y-%m-%d')
+        except ValueError:
+            return None
+        # Same rule as the two-call path: never a date earlier than today
+        if deadline < today_str:
+            deadline = ""
+
+    task = _clean_task(task.strip())
+    if "No actionable tasks" in task:
+        deadline = ""
+    return task, deadline
+
+
+@metrics.timed("extract_combined")
+def extract_task_and_deadline(email_body):
+    """
+    Extracts the task and a normalized YYYY-MM-DD deadline with a single JSON completion.
+    Falls back to extract_tasks + extract_deadline_with_chatgpt if the JSON is malformed.
+    """
+    logging.debug("Extracting task and deadline in one call...")
+
+    today_str = datetime.today().strftime('%Y-%m-%d')
+    messages = combined_messages(email_body, today_str)
+
+    cache_key = combined_cache_key(messages, email_body, today_str)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return tuple(cached)
+
+    try:
+        content = chat_completion(messages, 500, "extract_combined")
+    except Exception as e:
+        logging.error("Error calling openai API in extract_task_and_deadline: %s", e)
+        raise ExtractionError(str(e)) from e
+
+    result = parse_combined_response(content, today_str)
+    if result is None:
+        logging.warning("Malformed combined extraction response, falling back to two calls: %s", content)
+        task = extract_tasks(email_body)
+        if "No actionable tasks" in task:
+            return task, ""
+        return task, extract_deadline_with_chatgpt(task)
+
+    cache.put(cache_key, list(result), kind="extract_combined")
+    return result
+
+
 def summarize_tasks(tasks,):
     """
     Summarizes tasks into a single sentence and includes the deadline if available.
@@ -107,13 +433,7 @@ def summarize_tasks(tasks,):
     ]
 
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=100,  # Ensure brevity
-        )
-        summary = response['choices'][0]['message']['content'].strip()
+        summary = chat_completion(messages, 100, "summarize")
         logging.debug("Task Summary:\n%s", summary)
     except Exception as e:
         logging.error("Error calling openai API in summarize_tasks: %s", e)
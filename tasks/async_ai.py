@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from datetime import datetime
+from tasks import cache, rate_limiter, metrics
+from tasks.deadline_parser import resolve_deadline
+from tasks.ai_processor import (
+    OPENAI_MODEL, LLM_REQUEST_TIMEOUT, ExtractionError, openai_module, estimate_tokens, record_usage, tasks_messages, deadline_messages, combined_messages,
+    tasks_cache_key, deadline_cache_key, combined_cache_key, parse_combined_response, _clean_task
+)
+
+
+async def _complete(messages, max_tokens, endpoint):
+    """
+    Non-blocking chat_completion: same limiter, retries and backoff.
+    Uses the aiohttp session set in openai.aiosession, if any.
+    """
+    openai = openai_module()
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    estimated = prompt_tokens + max_tokens
+    for attempt in range(rate_limiter.LLM_MAX_RETRIES + 1):
+        await rate_limiter.limiter.acquire_async(estimated)
+        try:
+            response = await openai.ChatCompletion.acreate(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=max_tokens,
+                request_timeout=LLM_REQUEST_TIMEOUT,
+            )
+        except rate_limiter.retryable_errors() as e:
+            if isinstance(e, openai.error.RateLimitError):
+                await asyncio.to_thread(rate_limiter.limiter.on_rate_limited, rate_limiter.error_headers(e))
+            if attempt == rate_limiter.LLM_MAX_RETRIES:
+                metrics.inc("llm_calls_total", outcome="error")
+                raise
+            metrics.inc("llm_calls_total", outcome="retry")
+            delay = rate_limiter.backoff_delay(attempt)
+            logging.warning("OpenAI call failed (%s), retry %d in %.1fs", e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+            continue
+        except Exception:
+            metrics.inc("llm_calls_total", outcome="error")
+            raise
+        # The limiter state and usage are in SQLite, keep their writes off the event loop
+        await asyncio.to_thread(rate_limiter.limiter.on_success, estimated, response.get("usage"))
+        await asyncio.to_thread(record_usage, response.get("usage"), endpoint, prompt_tokens)
+        return response['choices'][0]['message']['content'].strip()
+
+
+@metrics.timed("extract_tasks")
+async def extract_tasks_async(email_body):
+    """
+    Non-blocking extract_tasks: same prompt and cache entries, raises ExtractionError the same way.
+    The SQLite cache is read and written from a worker thread.
+    """
+    cache_key = tasks_cache_key(email_body)
+    cached = await asyncio.to_thread(cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        tasks = await _complete(tasks_messages(email_body), 500, "extract_tasks")
+    except Exception as e:
+        logging.error("Error calling openai API in extract_tasks_async: %s", e)
+        raise ExtractionError(str(e)) from e
+
+    cleaned_task = _clean_task(tasks)
+    await asyncio.to_thread(cache.put, cache_key, cleaned_task, kind="extract_tasks")
+    return cleaned_task
+
+
+@metrics.timed("deadline")
+async def extract_deadline_async(tasks):
+    """
+    Non-blocking extract_deadline_with_chatgpt.
+    """
+    today = datetime.today()
+    today_str = today.strftime('%Y-%m-%d')
+    deadline = resolve_deadline(tasks, today.date())
+    if deadline is not None:
+        return deadline
+
+    messages = deadline_messages(tasks, today_str)
+    cache_key = deadline_cache_key(messages, tasks, today_str)
+    cached = await asyncio.to_thread(cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        deadline = await _complete(messages, 150, "deadline")
+    except Exception as e:
+        logging.error("Error calling openai API in extract_deadline_async: %s", e)
+        raise ExtractionError(str(e)) from e
+
+    await asyncio.to_thread(cache.put, cache_key, deadline, kind="extract_deadline")
+    return deadline
+
+
+@metrics.timed("extract_combined")
+async def extract_task_and_deadline_async(email_body):
+    """
+    Non-blocking extract_task_and_deadline, with the same two-call fallback on malformed JSON.
+    """
+    today_str = datetime.today().strftime('%Y-%m-%d')
+    messages = combined_messages(email_body, today_str)
+    cache_key = combined_cache_key(messages, email_body, today_str)
+    cached = await asyncio.to_thread(cache.get, cache_key)
+    if cached is not None:
+        return tuple(cached)
+
+    try:
+        content = await _complete(messages, 500, "extract_combined")
+    except Exception as e:
+        logging.error("Error calling openai API in extract_task_and_deadline_async: %s", e)
+        raise ExtractionError(str(e)) from e
+
+    result = parse_combined_response(content, today_str)
+    if result is None:
+        logging.warning("Malformed combined extraction response, falling back to two calls: %s", content)
+        task = await extract_tasks_async(email_body)
+        if "No actionable tasks" in task:
+            return task, ""
+        return task, await extract_deadline_async(task)
+
+    await asyncio.to_thread(cache.put, cache_key, list(result), kind="extract_combined")
+    return result
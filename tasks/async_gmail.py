@@ -0,0 +1,142 @@
+import os
+import asyncio
+import logging
+import aiohttp
+from tasks.email_reader import (
+    LIST_PAGE_SIZE, MESSAGE_FIELDS, METADATA_FIELDS, METADATA_HEADERS, PREFILTER_ENABLED,
+    parse_message, window_query, split_prefiltered, split_processed, select_important
+)
+from tasks.threads import collapse_threads
+from tasks import metrics
+from tasks.gmail_client import GMAIL_API_ROOT, CLIENT_ID, CLIENT_SECRET, TOKEN_URI, known_account_email, remember_account_email
+
+# Override to point the async client at a local Gmail stand-in
+GMAIL_API_BASE = os.getenv("GMAIL_API_BASE", (GMAIL_API_ROOT or "https://gmail.googleapis.com/").rstrip("/") + "/gmail/v1")
+# Message gets in flight at once per request (replaces the batch endpoint on this path)
+GMAIL_ASYNC_CONCURRENCY = int(os.getenv("GMAIL_ASYNC_CONCURRENCY", 20))
+GMAIL_ASYNC_RETRIES = 3
+
+
+class GmailHTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Gmail API returned {status}: {message}")
+        self.status = status
+
+
+class AsyncGmailClient:
+    """
+    Minimal non-blocking Gmail REST client on a shared aiohttp session.
+    Refreshes the access token once on 401 and retries 429/5xx with backoff.
+    """
+
+    def __init__(self, session, access_token, refresh_token):
+        self.session = session
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+
+    async def _refresh(self):
+        async with self.session.post(TOKEN_URI, data={
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token,
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+        }) as response:
+            if response.status != 200:
+                raise GmailHTTPError(401, await response.text())
+            self.access_token = (await response.json())["access_token"]
+
+    async def get(self, path, params=None):
+        refreshed = False
+        for attempt in range(GMAIL_ASYNC_RETRIES + 1):
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            async with self.session.get(f"{GMAIL_API_BASE}{path}", params=params, headers=headers) as response:
+                if response.status == 200:
+                    return await response.json()
+                text = await response.text()
+                status = response.status
+
+            if status == 401 and self.refresh_token and TOKEN_URI and not refreshed:
+                await self._refresh()
+                refreshed = True
+            elif status in (429, 500, 503) and attempt < GMAIL_ASYNC_RETRIES:
+                await asyncio.sleep(2 ** attempt)
+            else:
+                raise GmailHTTPError(status, text)
+        raise GmailHTTPError(status, text)
+
+    @metrics.timed("gmail_list")
+    async def list_message_ids(self, query):
+        message_ids = []
+        params = {"q": query, "maxResults": LIST_PAGE_SIZE}
+        while True:
+            results = await self.get("/users/me/messages", params)
+            message_ids.extend(msg["id"] for msg in results.get("messages", []))
+            if not results.get("nextPageToken"):
+                return message_ids
+            params["pageToken"] = results["nextPageToken"]
+
+    @metrics.timed("gmail_get")
+    async def get_messages(self, message_ids, format="full", fields=MESSAGE_FIELDS, metadata_headers=None):
+        """
+        Fetches messages concurrently; failed ones are logged and skipped.
+        Returns them in the order of message_ids.
+        """
+        semaphore = asyncio.Semaphore(GMAIL_ASYNC_CONCURRENCY)
+        params = [("format", format), ("fields", fields)] + [("metadataHeaders", h) for h in metadata_headers or []]
+
+        async def fetch(message_id):
+            async with semaphore:
+                try:
+                    return await self.get(f"/users/me/messages/{message_id}", params)
+                except GmailHTTPError as e:
+                    if e.status == 401:
+                        raise
+                    logging.error("Failed to fetch message %s: %s", message_id, e)
+                    return None
+
+        results = await asyncio.gather(*(fetch(message_id) for message_id in message_ids))
+        return [msg_data for msg_data in results if msg_data is not None]
+
+    async def account_email(self):
+        email_address = known_account_email(self.access_token, self.refresh_token)
+        if email_address is None:
+            email_address = (await self.get("/users/me/profile"))["emailAddress"]
+            remember_account_email(self.access_token, self.refresh_token, email_address)
+        return email_address
+
+
+async def fetch_emails_async(session, access_token, refresh_token, fetch_from, fetch_to=None):
+    """
+    Non-blocking counterpart of email_reader.fetch_emails with the same result shape.
+    The message store lookups and thread contexts are SQLite, so they run in worker threads.
+    """
+    logging.debug("Fetching emails asynchronously using provided access token.")
+    client = AsyncGmailClient(session, access_token, refresh_token)
+    try:
+        message_ids = await client.list_message_ids(window_query(fetch_from, fetch_to))
+        if not message_ids:
+            logging.info("No emails found.")
+            return []
+
+        account = await client.account_email()
+        processed_emails, message_ids = await asyncio.to_thread(split_processed, message_ids, account)
+        if PREFILTER_ENABLED and message_ids:
+            metadata_messages = await client.get_messages(
+                message_ids, format="metadata", fields=METADATA_FIELDS, metadata_headers=METADATA_HEADERS
+            )
+            message_ids = await asyncio.to_thread(split_prefiltered, metadata_messages, account)
+        if not message_ids:
+            return await asyncio.to_thread(collapse_threads, processed_emails, account)
+
+        emails = [parse_message(msg_data) for msg_data in await client.get_messages(message_ids)]
+        important = await asyncio.to_thread(select_important, emails, account)
+        return await asyncio.to_thread(collapse_threads, processed_emails + important, account)
+    except GmailHTTPError as e:
+        if e.status == 401:
+            logging.error("Unauthorized: Invalid access token.")
+            return {"error": "Unauthorized", "status": 401}
+        logging.error("An error occurred while fetching emails: %s", str(e))
+        return []
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.error("An error occurred while fetching emails: %s", str(e))
+        return []
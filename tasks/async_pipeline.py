@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from tasks import message_store, classifier, metrics, budget
+from tasks.ai_processor import ExtractionError
+from tasks.pipeline import (
+    LLM_MAX_CONCURRENCY, EXTRACTION_MODE, is_sortify_email, build_task, degraded_task, note_failed, _classifier_skips, _over_budget
+)
+from tasks.sortify_processor import extract_sortify_task
+from tasks.async_ai import extract_tasks_async, extract_deadline_async, extract_task_and_deadline_async
+
+
+async def _extract_async(email, mode):
+    if is_sortify_email(email):
+        with metrics.span("sortify_parse"):
+            detailed_tasks, deadline = extract_sortify_task(email["body"])
+    elif mode == "combined":
+        detailed_tasks, deadline = await extract_task_and_deadline_async(email["body"])
+        if "No actionable tasks" in detailed_tasks:
+            return None
+    else:
+        detailed_tasks = await extract_tasks_async(email["body"])
+        if "No actionable tasks" in detailed_tasks:
+            return None
+        deadline = await extract_deadline_async(detailed_tasks)
+
+    return build_task(email, detailed_tasks, deadline)
+
+
+def _record(email, task):
+    message_store.record_email(email, task)
+    if not is_sortify_email(email):
+        classifier.record_example(email, task is not None)
+
+
+async def process_email_async(email, mode=None):
+    """
+    Non-blocking process_email. Batch mode is not available here and runs as two_call.
+    The SQLite stores are read and written from worker threads, off the event loop.
+    """
+    if "processed" in email:
+        return email["processed"]
+
+    logging.debug("Processing email from: %s with subject: %s", email.get("from"), email.get("subject"))
+    if await asyncio.to_thread(_classifier_skips, email):
+        await asyncio.to_thread(message_store.record_email, email, None)
+        return None
+    if await asyncio.to_thread(_over_budget, email):
+        return await asyncio.to_thread(degraded_task, email)
+
+    with budget.charge_to(email.get("account")):
+        try:
+            task = await _extract_async(email, mode or EXTRACTION_MODE)
+        except ExtractionError:
+            await asyncio.to_thread(note_failed, email)
+            return None
+    await asyncio.to_thread(_record, email, task)
+    return task
+
+
+async def process_emails_async(emails, max_concurrency=None, mode=None):
+    """
+    Runs process_email_async over all emails with at most max_concurrency in flight.
+    Returns the actionable tasks in the same order as the input emails.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or LLM_MAX_CONCURRENCY)
+
+    async def bounded(email):
+        async with semaphore:
+            return await process_email_async(email, mode)
+
+    results = await asyncio.gather(*(bounded(email) for email in emails))
+    tasks = [task for task in results if task is not None]
+    metrics.inc("emails_processed_total", len(emails))
+    metrics.inc("tasks_extracted_total", len(tasks))
+    return tasks
@@ -0,0 +1,244 @@
+"""
+Token accounting and budgets for OpenAI calls.
+
+Every completion is recorded with its prompt and completion tokens, the call
+site ("endpoint": extract_tasks, deadline, ...) and the Gmail account it was
+made for. The account comes from charge_to(), which the pipeline sets per email.
+
+Budgets are token totals over a sliding window, per account and for the whole
+process. When one is used up, allow() returns False and the pipeline degrades
+to the local heuristics (tasks.utils.heuristic_task) until the window frees up.
+Checks happen before each email, so calls already in flight can overshoot a
+budget by up to LLM_MAX_CONCURRENCY completions.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from tasks.db import get_connection
+
+BUDGET_WINDOW_SECONDS = int(os.getenv("LLM_BUDGET_WINDOW_SECONDS", 24 * 3600))
+# 0 disables the budget
+ACCOUNT_TOKEN_BUDGET = int(os.getenv("LLM_ACCOUNT_TOKEN_BUDGET", 0))
+GLOBAL_TOKEN_BUDGET = int(os.getenv("LLM_GLOBAL_TOKEN_BUDGET", 0))
+# USD per 1K tokens, only used to report an estimated cost
+PROMPT_PRICE_PER_1K = float(os.getenv("LLM_PROMPT_PRICE_PER_1K", 0.0005))
+COMPLETION_PRICE_PER_1K = float(os.getenv("LLM_COMPLETION_PRICE_PER_1K", 0.0015))
+USAGE_RETENTION_DAYS = int(os.getenv("LLM_USAGE_RETENTION_DAYS", 30))
+
+# Budget checks reuse a window total for this long instead of querying per email
+CHECK_TTL_SECONDS = 5
+PRUNE_EVERY = 500
+
+_initialized = False
+_lock = threading.Lock()
+_writes = 0
+_degraded = 0
+_window_cache = {}  # account or None -> (checked_at, tokens)
+_account = contextvars.ContextVar("llm_account", default=None)
+_request_usage = contextvars.ContextVar("llm_request_usage", default=None)
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account TEXT,
+                endpoint TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                recorded_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_usage_account ON llm_usage (account, recorded_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_usage_recorded_at ON llm_usage (recorded_at)")
+        _initialized = True
+    return conn
+
+
+@contextmanager
+def charge_to(account):
+    """
+    Attributes the OpenAI calls made inside the block to account.
+    """
+    token = _account.set(account)
+    try:
+        yield
+    finally:
+        _account.reset(token)
+
+
+@contextmanager
+def request_usage():
+    """
+    Collects the tokens used inside the block into the yielded dict.
+    """
+    usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    token = _request_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _request_usage.reset(token)
+
+
+def cost(prompt_tokens, completion_tokens):
+    return round(prompt_tokens / 1000 * PROMPT_PRICE_PER_1K + completion_tokens / 1000 * COMPLETION_PRICE_PER_1K, 6)
+
+
+def record(endpoint, prompt_tokens, completion_tokens):
+    """
+    Stores one completion's token usage for the current account.
+    """
+    global _writes
+    account = _account.get()
+    with _lock:
+        usage = _request_usage.get()
+        if usage is not None:
+            usage["calls"] += 1
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+        # Keep recent budget checks close to the truth between refreshes
+        for key in {account, None}:
+            if key in _window_cache:
+                checked_at, tokens = _window_cache[key]
+                _window_cache[key] = (checked_at, tokens + prompt_tokens + completion_tokens)
+        _writes += 1
+        prune = _writes % PRUNE_EVERY == 0
+
+    try:
+        conn = _connection()
+        conn.execute(
+            "INSERT INTO llm_usage (account, endpoint, prompt_tokens, completion_tokens, recorded_at) VALUES (?, ?, ?, ?, ?)",
+            (account, endpoint, prompt_tokens, completion_tokens, time.time())
+        )
+        if prune:
+            conn.execute("DELETE FROM llm_usage WHERE recorded_at < ?", (time.time() - USAGE_RETENTION_DAYS * 86400,))
+    except Exception as e:
+        logging.error("Error recording LLM usage: %s", e)
+
+
+def window_tokens(account=None):
+    """
+    Tokens used in the current budget window, by account or (None) by everyone.
+    """
+    since = time.time() - BUDGET_WINDOW_SECONDS
+    if account is None:
+        row = _connection().execute(
+            "SELECT SUM(prompt_tokens + completion_tokens) FROM llm_usage WHERE recorded_at >= ?", (since,)
+        ).fetchone()
+    else:
+        row = _connection().execute(
+            "SELECT SUM(prompt_tokens + completion_tokens) FROM llm_usage WHERE account = ? AND recorded_at >= ?",
+            (account, since)
+        ).fetchone()
+    return row[0] or 0
+
+
+def _cached_window_tokens(account):
+    now = time.monotonic()
+    with _lock:
+        cached = _window_cache.get(account)
+    if cached and now - cached[0] < CHECK_TTL_SECONDS:
+        return cached[1]
+    tokens = window_tokens(account)
+    with _lock:
+        _window_cache[account] = (now, tokens)
+    return tokens
+
+
+def allow(account=None):
+    """
+    False when the account's or the global token budget for the window is used up.
+    Errors reading the usage table never block extraction.
+    """
+    try:
+        if GLOBAL_TOKEN_BUDGET and _cached_window_tokens(None) >= GLOBAL_TOKEN_BUDGET:
+            return False
+        if ACCOUNT_TOKEN_BUDGET and account and _cached_window_tokens(account) >= ACCOUNT_TOKEN_BUDGET:
+            return False
+    except Exception as e:
+        logging.error("Error checking LLM budget: %s", e)
+    return True
+
+
+def note_degraded(account):
+    global _degraded
+    with _lock:
+        _degraded += 1
+    logging.info("LLM token budget exhausted for %s, using heuristics", account or "all accounts")
+
+
+def _totals(where, params):
+    conn = _connection()
+    row = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0) FROM llm_usage WHERE {where}",
+        params
+    ).fetchone()
+    by_endpoint = conn.execute(
+        f"""
+        SELECT endpoint, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens)
+        FROM llm_usage WHERE {where} GROUP BY endpoint ORDER BY endpoint
+        """,
+        params
+    ).fetchall()
+
+    def entry(calls, prompt_tokens, completion_tokens):
+        return {
+            "calls": calls,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "cost_usd": cost(prompt_tokens, completion_tokens),
+        }
+
+    result = entry(*row)
+    result["by_endpoint"] = {endpoint: entry(*values) for endpoint, *values in by_endpoint}
+    return result
+
+
+def _budget(limit, used):
+    if not limit:
+        return None
+    return {"limit": limit, "used": used, "remaining": max(0, limit - used), "exhausted": used >= limit}
+
+
+def summary(account=None):
+    """
+    Usage in the current budget window for everyone and, if given, for one account,
+    with per-endpoint breakdowns and the budgets that apply.
+    """
+    since = time.time() - BUDGET_WINDOW_SECONDS
+    overall = _totals("recorded_at >= ?", (since,))
+    overall["budget"] = _budget(GLOBAL_TOKEN_BUDGET, overall["total_tokens"])
+    result = {"window_seconds": BUDGET_WINDOW_SECONDS, "global": overall}
+    if account:
+        mine = _totals("account = ? AND recorded_at >= ?", (account, since))
+        mine["budget"] = _budget(ACCOUNT_TOKEN_BUDGET, mine["total_tokens"])
+        result["account"] = dict(mine, email=account)
+    return result
+
+
+def stats():
+    """
+    Process-level numbers for /metrics.
+    """
+    with _lock:
+        degraded = _degraded
+    try:
+        tokens = window_tokens()
+    except Exception as e:
+        logging.error("Error reading LLM usage: %s", e)
+        tokens = None
+    return {
+        "window_tokens": tokens,
+        "global_token_budget": GLOBAL_TOKEN_BUDGET,
+        "account_token_budget": ACCOUNT_TOKEN_BUDGET,
+        "degraded_emails": degraded,
+    }
@@ -0,0 +1,138 @@
+import os
+import time
+import json
+import hashlib
+import logging
+import threading
+from tasks.db import get_connection, DB_PATH
+
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() != "false"
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", DB_PATH)
+CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 50000))
+
+# Run eviction every this many writes instead of on every write
+EVICT_EVERY = 100
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+_initialized_paths = set()
+
+
+def _connection():
+    conn = get_connection(CACHE_PATH)
+    if CACHE_PATH not in _initialized_paths:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+        _initialized_paths.add(CACHE_PATH)
+    return conn
+
+
+def _bump(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+
+def make_key(*parts):
+    """
+    Builds a content-addressed key from the parts (model, prompt, input, ...).
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key):
+    """
+    Returns the cached value for key, or None on a miss or expired entry.
+    """
+    if not CACHE_ENABLED:
+        return None
+
+    try:
+        conn = _connection()
+        row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > CACHE_TTL_SECONDS:
+            if row is not None:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            _bump("misses")
+            return None
+
+        conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        _bump("hits")
+        return json.loads(row[0])
+    except Exception as e:
+        logging.error("Error reading LLM cache: %s", e)
+        _bump("misses")
+        return None
+
+
+def put(key, value, kind=""):
+    """
+    Stores value under key. Expired and least recently used entries are evicted periodically.
+    """
+    if not CACHE_ENABLED:
+        return
+
+    try:
+        conn = _connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, kind, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, kind, json.dumps(value), now, now)
+        )
+        with _lock:
+            _stats["writes"] += 1
+            should_evict = _stats["writes"] % EVICT_EVERY == 0
+        if should_evict:
+            evict()
+    except Exception as e:
+        logging.error("Error writing LLM cache: %s", e)
+
+
+def evict():
+    """
+    Drops expired entries, then the least recently used ones above CACHE_MAX_ENTRIES.
+    """
+    conn = _connection()
+    removed = conn.execute(
+        "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - CACHE_TTL_SECONDS,)
+    ).rowcount
+    removed += conn.execute(
+        """
+        DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+        )
+        """,
+        (CACHE_MAX_ENTRIES,)
+    ).rowcount
+    if removed:
+        logging.debug("Evicted %d LLM cache entries", removed)
+        _bump("evictions", removed)
+
+
+def stats():
+    """
+    Returns hit/miss counters for this process plus the current cache size.
+    """
+    with _lock:
+        result = dict(_stats)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else 0.0
+    try:
+        result["entries"] = _connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    except Exception as e:
+        logging.error("Error reading LLM cache size: %s", e)
+        result["entries"] = None
+    result["enabled"] = CACHE_ENABLED
+    return result
@@ -0,0 +1,234 @@
+"""
+Local pre-classifier that skips the LLM for emails it is confident have no
+actionable task. It sits between the importance score and extract_tasks.
+
+Every LLM verdict is stored as hashed token counts (no email text is kept),
+and a TF-IDF + logistic regression model is trained from them offline:
+
+    python -m tasks.classifier eval     # precision / recall per threshold
+    python -m tasks.classifier train    # fit on all examples and save the model
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import importlib.util
+from tasks.db import get_connection
+
+# scikit-learn comes from requirements-ml.txt; without it the classifier stays off
+CLASSIFIER_ENABLED = (
+    os.getenv("CLASSIFIER_ENABLED", "true").lower() == "true"
+    and importlib.util.find_spec("sklearn") is not None
+)
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", "classifier.joblib")
+# Skip the LLM when P(no actionable task) is at least this
+CLASSIFIER_SKIP_THRESHOLD = float(os.getenv("CLASSIFIER_SKIP_THRESHOLD", 0.9))
+CLASSIFIER_MIN_EXAMPLES = int(os.getenv("CLASSIFIER_MIN_EXAMPLES", 200))
+N_FEATURES = 2 ** 18
+MAX_TEXT_CHARS = 5000
+# How often to look for a retrained model file
+RELOAD_CHECK_SECONDS = 60
+
+_initialized = False
+_vectorizer = None
+_model = None
+_model_mtime = None
+_model_checked = 0.0
+_lock = threading.Lock()
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classifier_examples (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                features TEXT NOT NULL,
+                actionable INTEGER NOT NULL,
+                recorded_at REAL NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+            """
+        )
+        _initialized = True
+    return conn
+
+
+def _get_vectorizer():
+    global _vectorizer
+    if _vectorizer is None:
+        # Imported lazily, scikit-learn is slow to import and only needed here
+        from sklearn.feature_extraction.text import HashingVectorizer
+        _vectorizer = HashingVectorizer(
+            n_features=N_FEATURES,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm=None,
+            strip_accents="unicode",
+        )
+    return _vectorizer
+
+
+def email_text(email):
+    sender = email.get("from") or ""
+    domain = sender.rsplit("@", 1)[-1].strip("> ").replace(".", "_") if "@" in sender else ""
+    return f"fromdomain_{domain} {email.get('subject') or ''}\n{(email.get('body') or '')[:MAX_TEXT_CHARS]}"
+
+
+def _features(email):
+    return _get_vectorizer().transform([email_text(email)])
+
+
+def record_example(email, actionable):
+    """
+    Stores an LLM verdict as a training example. Emails without an account or id are ignored.
+    Only pass answers the LLM actually gave: failed calls and budget fallbacks
+    would teach the model to skip exactly the emails that were throttled.
+    """
+    if not CLASSIFIER_ENABLED or not email.get("account") or not email.get("id"):
+        return
+    try:
+        row = _features(email)
+        features = json.dumps({"i": row.indices.tolist(), "v": row.data.tolist()})
+        _connection().execute(
+            "INSERT OR REPLACE INTO classifier_examples (account, message_id, features, actionable, recorded_at) VALUES (?, ?, ?, ?, ?)",
+            (email["account"], email["id"], features, int(bool(actionable)), time.time())
+        )
+    except Exception as e:
+        logging.error("Error recording classifier example: %s", e)
+
+
+def load_examples():
+    """
+    Returns (X, y): a sparse matrix of hashed token counts and the 0/1 actionable labels.
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    rows = _connection().execute("SELECT features, actionable FROM classifier_examples ORDER BY recorded_at").fetchall()
+    data, indices, indptr, labels = [], [], [0], []
+    for features, actionable in rows:
+        features = json.loads(features)
+        indices.extend(features["i"])
+        data.extend(features["v"])
+        indptr.append(len(indices))
+        labels.append(actionable)
+    X = csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), np.array(indptr)), shape=(len(labels), N_FEATURES))
+    return X, np.array(labels, dtype=np.int64)
+
+
+def build_model():
+    from sklearn.pipeline import make_pipeline
+    from sklearn.feature_extraction.text import TfidfTransformer
+    from sklearn.linear_model import LogisticRegression
+    return make_pipeline(
+        TfidfTransformer(sublinear_tf=True),
+        LogisticRegression(C=4.0, class_weight="balanced", max_iter=1000),
+    )
+
+
+def train(path=None, min_examples=None):
+    """
+    Fits the model on all stored examples and saves it. Returns the number of
+    examples used, or None when there are too few (or only one class).
+    """
+    import joblib
+
+    X, y = load_examples()
+    if len(y) < (min_examples or CLASSIFIER_MIN_EXAMPLES) or len(set(y.tolist())) < 2:
+        logging.warning("Not enough classifier examples to train (%d)", len(y))
+        return None
+
+    model = build_model().fit(X, y)
+    joblib.dump(model, path or CLASSIFIER_MODEL_PATH)
+    logging.info("Trained classifier on %d examples (%d actionable)", len(y), int(y.sum()))
+    return len(y)
+
+
+def evaluate(thresholds=(0.5, 0.7, 0.8, 0.9, 0.95, 0.98), test_size=0.25):
+    """
+    Holds out part of the stored examples and reports, per skip threshold:
+    skip_rate (LLM calls saved), missed_rate (actionable emails wrongly skipped)
+    and skip_precision (skipped emails that really had no task).
+    """
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import roc_auc_score
+
+    X, y = load_examples()
+    if len(set(y.tolist())) < 2:
+        raise ValueError("Need examples of both classes to evaluate")
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, stratify=y, random_state=0)
+    model = build_model().fit(X_train, y_train)
+    p_skip = model.predict_proba(X_test)[:, list(model.classes_).index(0)]
+
+    report = {"examples": len(y), "test_examples": len(y_test), "auc": round(roc_auc_score(y_test, 1 - p_skip), 4), "thresholds": []}
+    for threshold in thresholds:
+        skipped = p_skip >= threshold
+        report["thresholds"].append({
+            "threshold": threshold,
+            "skip_rate": round(float(skipped.mean()), 4),
+            "missed_rate": round(float((skipped & (y_test == 1)).sum() / max(1, (y_test == 1).sum())), 4),
+            "skip_precision": round(float((skipped & (y_test == 0)).sum() / max(1, skipped.sum())), 4),
+        })
+    return report
+
+
+def _load_model():
+    global _model, _model_mtime, _model_checked
+    now = time.monotonic()
+    if now - _model_checked < RELOAD_CHECK_SECONDS:
+        return _model
+    with _lock:
+        _model_checked = now
+        try:
+            mtime = os.path.getmtime(CLASSIFIER_MODEL_PATH)
+        except OSError:
+            _model = None
+            return None
+        if mtime != _model_mtime:
+            try:
+                import joblib
+                _model = joblib.load(CLASSIFIER_MODEL_PATH)
+                _model_mtime = mtime
+                logging.info("Loaded classifier model from %s", CLASSIFIER_MODEL_PATH)
+            except Exception as e:
+                logging.error("Error loading classifier model: %s", e)
+                _model = None
+    return _model
+
+
+def no_task_probability(email):
+    """
+    P(no actionable task) for the email, or None when no trained model is available.
+    """
+    if not CLASSIFIER_ENABLED:
+        return None
+    model = _load_model()
+    if model is None:
+        return None
+    try:
+        return float(model.predict_proba(_features(email))[0][list(model.classes_).index(0)])
+    except Exception as e:
+        logging.error("Error running classifier: %s", e)
+        return None
+
+
+def should_skip(email, threshold=None):
+    probability = no_task_probability(email)
+    skip = probability is not None and probability >= (threshold or CLASSIFIER_SKIP_THRESHOLD)
+    if skip:
+        logging.debug("Classifier skipped email %s (p_no_task=%.3f)", email.get("id"), probability)
+    return skip
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    command = sys.argv[1] if len(sys.argv) > 1 else "eval"
+    if command == "train":
+        sys.exit(0 if train() else 1)
+    print(json.dumps(evaluate(), indent=2))
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+import threading
+
+# Local SQLite file shared by the caches and stores in tasks/
+DB_PATH = os.getenv("SORTIFY_DB_PATH", "sortify.db")
+
+_local = threading.local()
+
+
+def get_connection(path=None):
+    """
+    Returns a SQLite connection for the current thread.
+    Connections are reused per thread and path, so callers should not close them.
+    """
+    path = path or DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = conn
+    return conn
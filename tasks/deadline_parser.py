@@ -0,0 +1,209 @@
+"""
+Rule-based deadline resolver that runs before extract_deadline_with_chatgpt.
+
+resolve_deadline() turns explicit dates ("2025-01-20", "April 20", "20/04")
+and common relative phrases ("tomorrow", "next Friday", "end of month",
+"in 3 days") into YYYY-MM-DD against a reference date. It returns "" when the
+text has no date at all and None when it is ambiguous, in which case the LLM
+is asked as before. Dates earlier than today are ignored, like the LLM prompt.
+
+A weekday only counts after a deadline word ("by Friday", "next Monday");
+"last Friday", "Monday's call" and any other weekday, day ordinal ("the 20th")
+or day/month the rules could not read are left to the LLM.
+"""
+import re
+import calendar
+import threading
+from datetime import date, datetime, time, timedelta
+from dateutil import parser as date_parser
+from dateutil.relativedelta import relativedelta
+
+MONTHS = r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?"
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+WEEKDAY_PATTERN = "|".join(WEEKDAYS)
+
+ISO_PATTERN = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+# Without a year, 20/04 only counts after a deadline word, so "24/7" is not a date
+NUMERIC_PATTERN = re.compile(
+    r"\b(?:(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})|(?:by|on|due|until|before)\s+(\d{1,2})/(\d{1,2}))\b",
+    re.IGNORECASE
+)
+MONTH_DAY_PATTERN = re.compile(
+    rf"\b(?:(?:{MONTHS})\.?\s+\d{{1,2}}(?:st|nd|rd|th)?(?:,?\s+\d{{4}})?|\d{{1,2}}(?:st|nd|rd|th)?\s+(?:of\s+)?(?:{MONTHS})\.?(?:,?\s+\d{{4}})?)\b",
+    re.IGNORECASE
+)
+RELATIVE_PATTERN = re.compile(
+    r"\b(?:(?P<today>today|tonight|eod|end of (?:the )?day)"
+    r"|(?P<day_after>day after tomorrow)"
+    r"|(?P<tomorrow>tomorrow|tmrw)"
+    r"|(?P<eow>eow|end of (?:the |this )?week)"
+    r"|(?P<eom>eom|end of (?:the |this )?month)"
+    r"|(?P<eoq>end of (?:the |this )?quarter)"
+    r"|(?P<next_week>next week)"
+    r"|(?P<next_month>next month)"
+    rf"|(?P<weekday_next>next\s+(?:{WEEKDAY_PATTERN})(?!['’]s\b))"
+    rf"|(?P<weekday>(?:this|on|by|due|until|before)\s+(?:{WEEKDAY_PATTERN})(?!['’]s\b))"
+    r"|in\s+(?P<count>\d{1,3}|a|an|one|two|three|four|five|six|seven)\s+(?P<unit>days?|weeks?|months?))\b",
+    re.IGNORECASE
+)
+# Words that suggest a deadline the rules above could not pin down
+VAGUE_PATTERN = re.compile(
+    rf"\b(?:asap|soon|eo[qy]|q[1-4]|this week|this month|next year|end of|(?:{MONTHS})\s+\d{{4}})\b",
+    re.IGNORECASE
+)
+# Date-like words left over once the patterns above have matched
+LEFTOVER_PATTERN = re.compile(
+    rf"\b(?:{WEEKDAY_PATTERN}|\d{{1,2}}(?:st|nd|rd|th)|\d{{1,2}}/\d{{1,2}})\b",
+    re.IGNORECASE
+)
+COUNT_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7}
+# A month/day without a year that already passed this year means next year if within this many months
+ROLLOVER_MONTHS = 6
+
+_stats = {"resolved": 0, "no_deadline": 0, "ambiguous": 0}
+_stats_lock = threading.Lock()
+
+
+def _weekday_index(word):
+    word = word.lower()
+    return next(i for i, name in enumerate(WEEKDAYS) if name.startswith(word[:3]))
+
+
+def _upcoming_weekday(today, weekday):
+    return today + timedelta(days=(weekday - today.weekday()) % 7)
+
+
+def _relative_date(match, today):
+    kind = match.lastgroup if match.lastgroup != "unit" else "in"
+    text = match.group(0).lower()
+    if kind == "today":
+        return today
+    if kind == "day_after":
+        return today + timedelta(days=2)
+    if kind == "tomorrow":
+        return today + timedelta(days=1)
+    if kind == "eow":
+        return _upcoming_weekday(today, 4)
+    if kind == "eom":
+        return today.replace(day=calendar.monthrange(today.year, today.month)[1])
+    if kind == "eoq":
+        last_month = (today.month - 1) // 3 * 3 + 3
+        return date(today.year, last_month, calendar.monthrange(today.year, last_month)[1])
+    if kind == "next_week":
+        return today + timedelta(days=7 - today.weekday())
+    if kind == "next_month":
+        return (today + relativedelta(months=1)).replace(day=1)
+    if kind == "weekday_next":
+        # "next Friday" is the Friday of next week
+        next_monday = today + timedelta(days=7 - today.weekday())
+        return next_monday + timedelta(days=_weekday_index(text.split()[-1]))
+    if kind == "weekday":
+        return _upcoming_weekday(today, _weekday_index(text.split()[-1]))
+    count = match.group("count").lower()
+    count = COUNT_WORDS.get(count) or int(count)
+    unit = match.group("unit").lower().rstrip("s")
+    return today + relativedelta(**{f"{unit}s": count})
+
+
+def _absolute_dates(text, today):
+    """
+    Yields (date or None) for each explicit date in text; None marks an ambiguous one.
+    """
+    for year, month, day in ISO_PATTERN.findall(text):
+        try:
+            yield date(int(year), int(month), int(day))
+        except ValueError:
+            yield None
+
+    for match in MONTH_DAY_PATTERN.finditer(text):
+        has_year = re.search(r"\d{4}", match.group(0))
+        try:
+            parsed = date_parser.parse(match.group(0), default=datetime.combine(today, time())).date()
+        except (ValueError, OverflowError):
+            yield None
+            continue
+        yield parsed if has_year else _roll_year(parsed, today)
+
+    for first, second, year, short_first, short_second in NUMERIC_PATTERN.findall(text):
+        first, second = int(first or short_first), int(second or short_second)
+        if first > 12 and second <= 12:
+            day, month = first, second
+        elif second > 12 and first <= 12:
+            month, day = first, second
+        elif first == second:
+            month = day = first
+        else:
+            # 04/05 could be April 5 or 4 May
+            yield None
+            continue
+        try:
+            if year:
+                yield date(int(year) + (2000 if len(year) == 2 else 0), month, day)
+            else:
+                yield _roll_year(date(today.year, month, day), today)
+        except ValueError:
+            yield None
+
+
+def _roll_year(parsed, today):
+    if parsed < today and parsed + relativedelta(years=1) <= today + relativedelta(months=ROLLOVER_MONTHS):
+        return parsed + relativedelta(years=1)
+    return parsed
+
+
+def _has_leftover(text):
+    """
+    True if text has a weekday, day ordinal or day/month outside the dates already matched.
+    """
+    spans = [
+        match.span()
+        for pattern in (ISO_PATTERN, MONTH_DAY_PATTERN, NUMERIC_PATTERN, RELATIVE_PATTERN)
+        for match in pattern.finditer(text)
+    ]
+    return any(
+        not any(start <= match.start() and match.end() <= end for start, end in spans)
+        for match in LEFTOVER_PATTERN.finditer(text)
+    )
+
+
+def resolve_deadline(text, today=None):
+    """
+    Returns the earliest deadline in text that is not before today as
+    YYYY-MM-DD, "" when there is none, or None when the LLM should decide.
+    """
+    today = today or date.today()
+    text = text or ""
+
+    candidates = list(_absolute_dates(text, today))
+    candidates += [_relative_date(match, today) for match in RELATIVE_PATTERN.finditer(text)]
+
+    if any(candidate is None for candidate in candidates) or _has_leftover(text):
+        result = None
+    elif candidates:
+        upcoming = [candidate for candidate in candidates if candidate >= today]
+        result = min(upcoming).isoformat() if upcoming else ""
+    elif VAGUE_PATTERN.search(text):
+        result = None
+    else:
+        result = ""
+
+    with _stats_lock:
+        if result is None:
+            _stats["ambiguous"] += 1
+        elif result:
+            _stats["resolved"] += 1
+        else:
+            _stats["no_deadline"] += 1
+    return result
+
+
+def stats():
+    """
+    Counts of resolved / no_deadline / ambiguous texts; hit_rate is the share
+    answered without the LLM.
+    """
+    with _stats_lock:
+        result = dict(_stats)
+    total = sum(result.values())
+    result["hit_rate"] = round((result["resolved"] + result["no_deadline"]) / total, 4) if total else 0.0
+    return result
@@ -1,123 +1,387 @@
 import os
 import base64
 from datetime import datetime, timedelta, timezone
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import logging
 import json
-from tasks.utils import is_important_email
+import time
+from tasks.utils import importance_score, score_email_metadata
+from tasks import sync_state, message_store, preprocess, metrics
+from tasks.gmail_client import gmail_service, get_account_email, remember_account_email
+from tasks.threads import collapse_threads
 
 # Scopes required for Gmail API
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-TOKEN_URI = os.getenv("TOKEN_URI")
 
-def fetch_emails(access_token, refresh_token, fetch_from, fetch_to):
-    logging.debug("Fetching emails using provided access token.")
+# Gmail batch requests accept at most 100 calls each
+BATCH_SIZE = 100
+LIST_PAGE_SIZE = 500
+BATCH_RETRIES = 2
+# Only the parts of a message that fetch_emails actually reads
+MESSAGE_FIELDS = "id,threadId,historyId,sizeEstimate,payload(headers(name,value),parts(mimeType,body/data))"
+METADATA_FIELDS = "id,threadId,snippet,payload(headers(name,value))"
+METADATA_HEADERS = ["Subject", "From", "Date"]
+
+# Two-stage fetch: score headers + snippet first and only download bodies for
+# emails scoring above PREFILTER_DROP_AT_OR_BELOW. The snippet misses most of
+# the body, so borderline emails (score between the cutoff and 0) still go on.
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() != "false"
+PREFILTER_DROP_AT_OR_BELOW = int(os.getenv("PREFILTER_DROP_AT_OR_BELOW", -6))
+
+
+@metrics.timed("gmail_list")
+def list_message_ids(service, query):
+    """
+    Lists the ids of all messages matching query, following nextPageToken.
+    """
+    message_ids = []
+    page_token = None
+    while True:
+        results = service.users().messages().list(
+            userId="me",
+            q=query,
+            maxResults=LIST_PAGE_SIZE,
+            pageToken=page_token
+        ).execute()
+        message_ids.extend(msg["id"] for msg in results.get("messages", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return message_ids
+
+
+@metrics.timed("gmail_get")
+def get_messages(service, message_ids, format="full", fields=MESSAGE_FIELDS, metadata_headers=None, failed=None):
+    """
+    Fetches messages through Gmail batch requests of up to BATCH_SIZE calls.
+    Calls that are rate limited or fail on the server side are retried with backoff.
+    Returns the messages in the order of message_ids, skipping ones that failed.
+    With a failed list, the ids that could not be fetched are appended to it;
+    messages that no longer exist (404) are not.
+    """
+    fetched = {}
+    pending = list(message_ids)
+
+    for attempt in range(BATCH_RETRIES + 1):
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                fetched[request_id] = response
+            elif isinstance(exception, HttpError) and exception.resp.status in (429, 500, 503) and attempt < BATCH_RETRIES:
+                retry.append(request_id)
+            else:
+                logging.error("Failed to fetch message %s: %s", request_id, exception)
+                if failed is not None and not (isinstance(exception, HttpError) and exception.resp.status == 404):
+                    failed.append(request_id)
+
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for message_id in pending[start:start + BATCH_SIZE]:
+                batch.add(
+                    service.users().messages().get(
+                        userId="me",
+                        id=message_id,
+                        format=format,
+                        fields=fields,
+                        metadataHeaders=metadata_headers
+                    ),
+                    request_id=message_id
+                )
+            batch.execute()
+
+        if not retry:
+            break
+        logging.warning("Retrying %d rate limited message fetches", len(retry))
+        time.sleep(2 ** attempt)
+        pending = retry
+
+    return [fetched[message_id] for message_id in message_ids if message_id in fetched]
 
-    # Create credentials from the access token
-    creds = Credentials(
-        token=access_token,
-        refresh_token=refresh_token,
-        client_id=CLIENT_ID,
-        client_secret=CLIENT_SECRET,
-        token_uri=TOKEN_URI
-    )
 
-    # Build the Gmail API client
-    service = build("gmail", "v1", credentials=creds)
+def parse_message(msg_data):
+    """
+    Turns a Gmail message resource into the email dict used by the pipeline.
+    """
+    headers = msg_data.get("payload", {}).get("headers", [])
+    subject = next((h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
+    sender = next((h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
+    date_str = next((h["value"] for h in headers if h["name"] == "Date"), None)
+    size = int(msg_data.get("sizeEstimate", 0))
 
+    # Parse the email date
+    email_time = datetime.now(timezone.utc)
+    if date_str:
+        try:
+            email_time = datetime.strptime(date_str, "%a, %d %b %Y %H:%M:%S %z")
+        except ValueError:
+            logging.warning("Unable to parse date: %s, defaulting to current time", date_str)
+
+    # Decode the body (if available)
+    body = ""
+    if "parts" in msg_data.get("payload", {}):
+        for part in msg_data["payload"]["parts"]:
+            if part.get("mimeType") == "text/plain":
+                body = base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8", errors="ignore")
+                break
+    # Scoring and extraction both work on the cleaned body
+    body, body_stats = preprocess.clean_body(body)
+
+    return {
+        "id": msg_data.get("id"),
+        "thread_id": msg_data.get("threadId"),
+        "subject": subject,
+        "from": sender,
+        "date": email_time,
+        "size": size,
+        "body": body,
+        "body_stats": body_stats,
+    }
+
+
+def window_query(fetch_from, fetch_to=None):
+    """
+    Builds the Gmail search query for the inbox between fetch_from and fetch_to.
+    """
     try:
         fetch_from_dt = datetime.strptime(fetch_from, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
-    except ValueError:
+    except (TypeError, ValueError):
         logging.warning("Unable to parse fetch_from: %s. Defaulting to 3 days ago.", fetch_from)
         fetch_from_dt = datetime.now(timezone.utc) - timedelta(days=3)
 
     try:
         fetch_to_dt = datetime.strptime(fetch_to, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
-    except ValueError:
+    except (TypeError, ValueError):
         logging.warning("Unable to parse fetch_to: %s. Defaulting to now.", fetch_to)
         fetch_to_dt = datetime.now(timezone.utc)
 
     fetch_from_ts = int(fetch_from_dt.timestamp())
     fetch_to_ts = int(fetch_to_dt.timestamp())
     logging.debug("Fetching emails between timestamps: %d and %d", fetch_from_ts, fetch_to_ts)
+    return f"after:{fetch_from_ts} before:{fetch_to_ts} in:inbox"
 
-    # Use Gmail API to search for emails from the past day
-    try:
-        results = service.users().messages().list(
+
+@metrics.timed("gmail_list")
+def list_history_message_ids(service, start_history_id):
+    """
+    Lists the ids of inbox messages added since start_history_id.
+    Raises HttpError 404 when the history id is too old to be used.
+    """
+    message_ids = []
+    seen = set()
+    page_token = None
+    while True:
+        results = service.users().history().list(
             userId="me",
-            q=f"after:{fetch_from_ts} before:{fetch_to_ts} in:inbox"
+            startHistoryId=start_history_id,
+            historyTypes="messageAdded",
+            labelId="INBOX",
+            pageToken=page_token
         ).execute()
+        for record in results.get("history", []):
+            for added in record.get("messagesAdded", []):
+                message = added.get("message", {})
+                if message.get("id") and message["id"] not in seen and "INBOX" in message.get("labelIds", ["INBOX"]):
+                    seen.add(message["id"])
+                    message_ids.append(message["id"])
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return message_ids
 
-        messages = results.get("messages", [])
-        if not messages:
-            logging.info("No emails found.")
-            return []
 
-        emails = []
-        for msg in messages:
-            # logging.debug("Processing message with id: %s", msg["id"])
-            # Fetch email details
-            msg_data = service.users().messages().get(userId="me", id=msg["id"]).execute()
-            
-            # Extract relevant details
-            headers = msg_data.get("payload", {}).get("headers", [])
-            subject = next((h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
-            sender = next((h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
-            date_str = next((h["value"] for h in headers if h["name"] == "Date"), None)
-            size = int(msg_data.get("sizeEstimate", 0))
-            # logging.debug("Email details - Subject: %s, From: %s, Date: %s, Size: %d", subject, sender, date_str if date_str else "None", size)
-
-            # Parse the email date
-            email_time = datetime.now(timezone.utc)
-            if date_str:
-                try:
-                    email_time = datetime.strptime(date_str, "%a, %d %b %Y %H:%M:%S %z")
-                except ValueError:
-                    logging.warning("Unable to parse date: %s, defaulting to current time", date_str)
-
-            # Decode the body (if available)
-            body = ""
-            if "parts" in msg_data.get("payload", {}):
-                for part in msg_data["payload"]["parts"]:
-                    if part.get("mimeType") == "text/plain":
-                        body = base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8", errors="ignore")
-                        # logging.debug("Decoded email body for message id: %s", msg["id"])
-                        break
-
-            logging.info("SENDER: %s", sender)
-            # Append to the email list
-            emails.append({
-                "subject": subject,
-                "from": sender,
-                "date": email_time,
-                "size": size,
-                "body": body,
+@metrics.timed("prefilter_scoring")
+def split_prefiltered(metadata_messages, account=None):
+    """
+    Scores messages fetched with format=metadata on their headers and snippet.
+    Returns the ids worth downloading in full; the rest are recorded as unimportant.
+    """
+    candidates = []
+    dropped = []
+    for msg_data in metadata_messages:
+        headers = msg_data.get("payload", {}).get("headers", [])
+        subject = next((h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
+        sender = next((h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
+        score = score_email_metadata(subject, msg_data.get("snippet", ""), sender=sender)
+        if score > PREFILTER_DROP_AT_OR_BELOW:
+            candidates.append(msg_data["id"])
+        else:
+            logging.info("Prefiltered Email: %s (score %d)", json.dumps(subject), score)
+            dropped.append((msg_data["id"], msg_data.get("threadId"), score, "unimportant", None))
+
+    if account:
+        message_store.record(account, dropped)
+    logging.info("Prefilter kept %d of %d emails.", len(candidates), len(metadata_messages))
+    return candidates
+
+
+def prefilter_message_ids(service, message_ids, account=None, failed=None):
+    """
+    Stage one of the fetch: scores each message on its metadata and snippet
+    and returns the ids worth downloading in full.
+    """
+    metadata_messages = get_messages(
+        service, message_ids, format="metadata", fields=METADATA_FIELDS, metadata_headers=METADATA_HEADERS, failed=failed
+    )
+    return split_prefiltered(metadata_messages, account)
+
+
+def split_processed(message_ids, account):
+    """
+    Looks the ids up in the processed-message store.
+    Returns (processed_emails, remaining_ids): the messages that produced a task
+    come back with that task under "processed", the other known ones are skipped.
+    """
+    if not account:
+        return [], list(message_ids)
+
+    known = message_store.get_processed(account, message_ids)
+    processed_emails = []
+    for message_id in message_ids:
+        entry = known.get(message_id)
+        if entry and entry["status"] == "task":
+            processed_emails.append({
+                "id": message_id,
+                "thread_id": entry["thread_id"],
+                "account": account,
+                "subject": entry["task"]["subject"],
+                "from": entry["task"]["from"],
+                "processed": entry["task"],
             })
+    logging.info("Skipping %d already processed emails.", len(known))
+    return processed_emails, [message_id for message_id in message_ids if message_id not in known]
 
-        logging.info("Fetched %d emails.", len(emails))
-        important_emails = [email for email in emails if is_important_email(email["subject"], email["body"], sender=email["from"])]
-        unimportant_emails = [email for email in emails if not is_important_email(email["subject"], email["body"], sender=email["from"])]
-        logging.info("Important emails (%d):", len(important_emails))
-        for email in unimportant_emails:
-            logging.info("Unimportant Email: %s", json.dumps(email["subject"]))
-        for email in important_emails:
-            logging.info("Important Email: %s", json.dumps(email["subject"]))
-        return important_emails
-
-    except HttpError as e:
-        if e.resp.status == 401:
-            logging.error("Unauthorized: Invalid access token.")
-            return {"error": "Unauthorized", "status": 401}
-        else:
-            logging.error("An error occurred while fetching emails: %s", str(e))
+
+def select_important(emails, account=None):
+    """
+    Scores the downloaded emails once and keeps the important ones.
+    """
+    for email in emails:
+        logging.info("SENDER: %s", email["from"])
+        email["account"] = account
+
+    logging.info("Fetched %d emails.", len(emails))
+    # Score each email once and split on the result
+    with metrics.span("scoring"):
+        for email in emails:
+            footer = email.get("body_stats", {}).get("footer")
+            email["score"] = importance_score(email["subject"], email["body"], sender=email["from"], footer=footer)
+    important_emails = [email for email in emails if email["score"] > 0]
+    unimportant_emails = [email for email in emails if email["score"] <= 0]
+    logging.info("Important emails (%d):", len(important_emails))
+    for email in unimportant_emails:
+        logging.info("Unimportant Email: %s", json.dumps(email["subject"]))
+    for email in important_emails:
+        logging.info("Important Email: %s", json.dumps(email["subject"]))
+
+    if account:
+        message_store.record(account, [
+            (email["id"], email["thread_id"], email["score"], "unimportant", None) for email in unimportant_emails
+        ])
+    return important_emails
+
+
+def fetch_important_emails(service, message_ids, account=None, failed=None):
+    """
+    Downloads the messages and keeps only the important ones.
+    With an account, messages already in the processed-message store are not
+    downloaded again (see split_processed). Ids that could not be downloaded
+    are appended to failed, if given.
+    """
+    processed_emails, message_ids = split_processed(message_ids, account)
+
+    if PREFILTER_ENABLED and message_ids:
+        message_ids = prefilter_message_ids(service, message_ids, account, failed)
+    if not message_ids:
+        return collapse_threads(processed_emails, account)
+
+    emails = [parse_message(msg_data) for msg_data in get_messages(service, message_ids, failed=failed)]
+    metrics.inc("emails_fetched_total", len(emails))
+    return collapse_threads(processed_emails + select_important(emails, account), account)
+
+
+def _handle_fetch_error(e):
+    metrics.inc("errors_total", stage="gmail")
+    if isinstance(e, HttpError) and e.resp.status == 401:
+        logging.error("Unauthorized: Invalid access token.")
+        return {"error": "Unauthorized", "status": 401}
+    logging.error("An error occurred while fetching emails: %s", str(e))
+    return []
+
+
+def fetch_window_emails(access_token, refresh_token, fetch_from, fetch_to=None, failed=None):
+    """
+    fetch_emails for callers that retry: Gmail errors are raised instead of
+    being turned into [], and the ids of messages that could not be
+    downloaded are appended to failed.
+    """
+    query = window_query(fetch_from, fetch_to)
+
+    # Use Gmail API to search for emails in the window
+    with gmail_service(access_token, refresh_token) as service:
+        message_ids = list_message_ids(service, query)
+        if not message_ids:
+            logging.info("No emails found.")
             return []
+        account = get_account_email(service, access_token, refresh_token)
+        return fetch_important_emails(service, message_ids, account, failed)
+
+
+def fetch_emails(access_token, refresh_token, fetch_from, fetch_to=None):
+    logging.debug("Fetching emails using provided access token.")
+    try:
+        return fetch_window_emails(access_token, refresh_token, fetch_from, fetch_to)
+    except Exception as e:
+        return _handle_fetch_error(e)
+
+
+def list_new_message_ids(service, account, start_history_id, fetch_from, fetch_to=None):
+    """
+    Ids of the messages added since start_history_id, or of the whole window
+    when there is no start id yet or Gmail no longer has that history.
+    """
+    if start_history_id:
+        try:
+            message_ids = list_history_message_ids(service, start_history_id)
+            logging.debug("History sync for %s found %d new messages", account, len(message_ids))
+            return message_ids
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logging.warning("History %s expired for %s, falling back to a full scan", start_history_id, account)
+    return list_message_ids(service, window_query(fetch_from, fetch_to))
+
+
+def fetch_new_emails(access_token, refresh_token, fetch_from, fetch_to=None):
+    """
+    Incremental variant of fetch_emails.
+    Uses the historyId stored for the account to list only messages added since
+    the last sync, and falls back to a full window scan on the first sync or
+    when Gmail no longer has that history. Messages that could not be
+    downloaded or extracted are kept as pending (see sync_state) and listed
+    again by the next sync, since the history pointer has moved past them.
+    """
+    logging.debug("Fetching new emails using provided access token.")
+
+    try:
+        with gmail_service(access_token, refresh_token) as service:
+            # Read the current historyId first so nothing added during the sync is skipped next time
+            profile = service.users().getProfile(userId="me").execute()
+            account = profile["emailAddress"]
+            remember_account_email(access_token, refresh_token, account)
+            start_history_id = sync_state.get_history_id(account)
+            message_ids = list_new_message_ids(service, account, start_history_id, fetch_from, fetch_to)
+            pending = sync_state.get_pending(account)
+            listed = set(message_ids)
+            message_ids += [message_id for message_id in pending if message_id not in listed]
+            failed = []
+            emails = fetch_important_emails(service, message_ids, account, failed) if message_ids else []
+        sync_state.set_history_id(account, profile["historyId"])
+        sync_state.remove_pending(account, pending)
+        sync_state.add_pending(account, failed)
+        if failed:
+            logging.warning("Could not fetch %d messages for %s, they are retried on the next sync", len(failed), account)
+        return emails
     except Exception as e:
-        logging.error("An error occurred while fetching emails: %s", str(e))
-        return []
+        return _handle_fetch_error(e)
 
 # Example usage
 if __name__ == "__main__":
@@ -1,15 +1,129 @@
 import os
+import time
+import logging
 import smtplib
+import threading
+from contextlib import contextmanager
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate
+from tasks import metrics
 
 gmail_user = os.getenv("EMAIL_ADDRESS")
 gmail_app_password = os.getenv("EMAIL_PASSWORD")
 
-def send_email_via_smtp(sender_name, recipient_email, deadline, task):
-    if not gmail_user or not gmail_app_password:
-        raise Exception("SMTP credentials not set in environment variables.")
+# Point these at a local server (e.g. aiosmtpd with SMTP_STARTTLS=false) for testing
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() != "false"
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", 30))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 4))
+# Gmail drops idle SMTP sessions after a few minutes, reconnect instead of reusing older ones
+SMTP_MAX_IDLE_SECONDS = int(os.getenv("SMTP_MAX_IDLE_SECONDS", 120))
+
+
+class SMTPConnectionPool:
+    """
+    Keeps logged-in SMTP connections open between sends.
+    Connections are checked with NOOP before reuse and re-established
+    (connect, STARTTLS, login) when the server has dropped them.
+    """
+
+    def __init__(self, host, port, size, starttls=True, timeout=30, max_idle_seconds=120):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = []  # (connection, last_used)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        logging.debug("Opening SMTP connection to %s:%d", self.host, self.port)
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        server.ehlo()
+        if self.starttls:
+            server.starttls()
+            server.ehlo()
+        # Local stand-ins usually do not offer AUTH
+        if server.has_extn("auth"):
+            server.login(gmail_user, gmail_app_password)
+        return server
+
+    def _is_alive(self, server, last_used):
+        if time.monotonic() - last_used > self.max_idle_seconds:
+            return False
+        try:
+            return server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a live connection. It is closed instead of returned
+        to the pool if the block raises.
+        """
+        with self._slots:
+            server = None
+            while server is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    server = self._connect()
+                elif self._is_alive(*idle):
+                    server = idle[0]
+                else:
+                    self._close(idle[0])
+
+            try:
+                yield server
+            except Exception:
+                self._close(server)
+                raise
+            with self._lock:
+                self._idle.append((server, time.monotonic()))
+
+    @metrics.timed("smtp_send")
+    def send(self, from_addr, to_addrs, message):
+        """
+        Sends on a pooled connection, retrying once on a fresh one if the server hung up.
+        """
+        try:
+            with self.connection() as server:
+                server.sendmail(from_addr, to_addrs, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            logging.warning("SMTP connection dropped, retrying on a new connection")
+            with self.connection() as server:
+                server.sendmail(from_addr, to_addrs, message)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+
+smtp_pool = SMTPConnectionPool(
+    SMTP_HOST, SMTP_PORT, SMTP_POOL_SIZE,
+    starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT, max_idle_seconds=SMTP_MAX_IDLE_SECONDS
+)
+
+
+def build_task_message(sender_name, recipient_email, deadline, task):
+    """
+    Builds the plain text + HTML email that shares a task with recipient_email.
+    """
 
     subject = f"You’ve got a task from {sender_name}"
 
@@ -57,9 +171,14 @@ Thanks for using Sortify!
     msg.attach(MIMEText(text_body.strip(), 'plain'))
     msg.attach(MIMEText(html_body.strip(), 'html'))
 
-    # Send the email
-    with smtplib.SMTP("smtp.gmail.com", 587) as server:
-        server.ehlo()
-        server.starttls()
-        server.login(gmail_user, gmail_app_password)
-        server.sendmail(gmail_user, recipient_email, msg.as_string())
+    return msg
+
+
+def send_email_via_smtp(sender_name, recipient_email, deadline, task):
+    if not gmail_user or not gmail_app_password:
+        raise Exception("SMTP credentials not set in environment variables.")
+
+    msg = build_task_message(sender_name, recipient_email, deadline, task)
+
+    # Send the email over a pooled connection
+    smtp_pool.send(gmail_user, recipient_email, msg.as_string())
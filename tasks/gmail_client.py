@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+CLIENT_ID = os.getenv("CLIENT_ID")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+TOKEN_URI = os.getenv("TOKEN_URI")
+
+# Idle clients are dropped after this long, and at most this many are kept per process
+GMAIL_POOL_MAX_IDLE_SECONDS = int(os.getenv("GMAIL_POOL_MAX_IDLE_SECONDS", 600))
+GMAIL_POOL_MAX_SIZE = int(os.getenv("GMAIL_POOL_MAX_SIZE", 64))
+GMAIL_HTTP_TIMEOUT = int(os.getenv("GMAIL_HTTP_TIMEOUT", 60))
+# Override (e.g. http://127.0.0.1:8801/) to send Gmail traffic, batches included, to a stand-in
+GMAIL_API_ROOT = os.getenv("GMAIL_API_ROOT")
+
+_lock = threading.Lock()
+_idle = {}  # pool key -> list of idle _PooledClient
+_stats = {"created": 0, "reused": 0, "evicted": 0}
+_accounts = {}  # pool key -> Gmail address
+
+
+class _PooledClient:
+    def __init__(self, service, credentials, supplied_token):
+        self.service = service
+        self.credentials = credentials
+        self.supplied_token = supplied_token
+        self.last_used = time.monotonic()
+
+
+def _pool_key(access_token, refresh_token):
+    # The refresh token identifies the account for longer than any access token
+    return hashlib.sha256((refresh_token or access_token or "").encode("utf-8")).hexdigest()
+
+
+def build_client(access_token, refresh_token):
+    """
+    Builds a Gmail client from the discovery document bundled with
+    google-api-python-client, on a keep-alive HTTP transport that refreshes
+    the access token by itself when Gmail answers 401.
+    """
+    # Imported here so startup does not pay for the Google client libraries
+    import httplib2
+    from google.oauth2.credentials import Credentials
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient import discovery_cache
+    from googleapiclient.discovery import build, build_from_document
+
+    credentials = Credentials(
+        token=access_token,
+        refresh_token=refresh_token,
+        client_id=CLIENT_ID,
+        client_secret=CLIENT_SECRET,
+        token_uri=TOKEN_URI
+    )
+    http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT))
+    if GMAIL_API_ROOT:
+        document = json.loads(discovery_cache.get_static_doc("gmail", "v1"))
+        # The batch endpoint is derived from rootUrl, which client_options cannot change
+        document["rootUrl"] = GMAIL_API_ROOT.rstrip("/") + "/"
+        service = build_from_document(document, http=http)
+    else:
+        service = build("gmail", "v1", http=http, cache_discovery=False, static_discovery=True)
+    return _PooledClient(service, credentials, access_token)
+
+
+def _evict_idle(now):
+    # Caller holds _lock
+    for key in list(_idle):
+        fresh = [client for client in _idle[key] if now - client.last_used <= GMAIL_POOL_MAX_IDLE_SECONDS]
+        _stats["evicted"] += len(_idle[key]) - len(fresh)
+        if fresh:
+            _idle[key] = fresh
+        else:
+            del _idle[key]
+
+    total = sum(len(clients) for clients in _idle.values())
+    while total > GMAIL_POOL_MAX_SIZE:
+        key = min(_idle, key=lambda k: _idle[k][0].last_used)
+        _idle[key].pop(0)
+        if not _idle[key]:
+            del _idle[key]
+        _stats["evicted"] += 1
+        total -= 1
+
+
+@contextmanager
+def gmail_service(access_token, refresh_token):
+    """
+    Checks out a Gmail service for the account, reusing a pooled one when available.
+    A client is used by one caller at a time (httplib2 is not thread-safe);
+    it goes back to the pool afterwards unless the block raised.
+    """
+    key = _pool_key(access_token, refresh_token)
+    with _lock:
+        _evict_idle(time.monotonic())
+        clients = _idle.get(key)
+        client = clients.pop() if clients else None
+        if clients is not None and not clients:
+            del _idle[key]
+        _stats["reused" if client else "created"] += 1
+
+    if client is None:
+        client = build_client(access_token, refresh_token)
+    elif access_token and access_token != client.supplied_token:
+        # The caller has a newer access token than the one this client started with
+        client.credentials.token = access_token
+        client.credentials.expiry = None
+        client.supplied_token = access_token
+
+    yield client.service
+
+    client.last_used = time.monotonic()
+    with _lock:
+        _idle.setdefault(key, []).append(client)
+        _evict_idle(client.last_used)
+
+
+def remember_account_email(access_token, refresh_token, email_address):
+    with _lock:
+        _accounts[_pool_key(access_token, refresh_token)] = email_address
+
+
+def known_account_email(access_token, refresh_token):
+    """
+    Returns the Gmail address seen earlier for these tokens, or None.
+    """
+    with _lock:
+        return _accounts.get(_pool_key(access_token, refresh_token))
+
+
+def get_account_email(service, access_token, refresh_token):
+    """
+    Returns the Gmail address of the account, asking Gmail only the first time.
+    """
+    email_address = known_account_email(access_token, refresh_token)
+    if email_address is None:
+        email_address = service.users().getProfile(userId="me").execute()["emailAddress"]
+        remember_account_email(access_token, refresh_token, email_address)
+    return email_address
+
+
+def pool_stats():
+    with _lock:
+        result = dict(_stats)
+        result["idle"] = sum(len(clients) for clients in _idle.values())
+    return result
+
+
+def clear_pool():
+    with _lock:
+        _idle.clear()
+    logging.debug("Gmail client pool cleared")
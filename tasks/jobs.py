@@ -0,0 +1,362 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from googleapiclient.errors import HttpError
+from tasks.db import get_connection
+from tasks.email_reader import fetch_window_emails
+from tasks.pipeline import process_emails, request_failures
+from tasks import rate_limiter, push
+
+# Backfills are fetched and extracted in windows of this many hours
+JOB_CHUNK_HOURS = int(os.getenv("JOB_CHUNK_HOURS", 24))
+# A running job whose worker has not checked in for this long is picked up again
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 1200))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# A job put back after an error waits this long per attempt before it is claimed again
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", 30))
+# Running jobs refresh their heartbeat this often, well inside JOB_STALE_SECONDS
+JOB_HEARTBEAT_SECONDS = JOB_STALE_SECONDS / 4
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+# Idle workers look for Gmail watches to renew this often
+WATCH_RENEW_CHECK_SECONDS = int(os.getenv("WATCH_RENEW_CHECK_SECONDS", 3600))
+# Finished push syncs are kept this long for inspection
+PUSH_SYNC_RETENTION_SECONDS = 24 * 3600
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+_initialized = False
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                cursor TEXT NOT NULL,
+                window_end TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                heartbeat_at REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                task TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )
+            """
+        )
+        _initialized = True
+    return conn
+
+
+def _parse_date(value, default):
+    try:
+        return datetime.strptime(value, DATE_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return default
+
+
+def enqueue_backfill(access_token, refresh_token, fetch_from, fetch_to=None):
+    """
+    Queues a backfill of the inbox between fetch_from and fetch_to (default now).
+    Returns the job id right away; a worker does the fetching and extraction.
+    """
+    now = datetime.now(timezone.utc)
+    window_start = _parse_date(fetch_from, now - timedelta(days=3))
+    window_end = _parse_date(fetch_to, now)
+
+    job_id = uuid.uuid4().hex
+    params = {"access_token": access_token, "refresh_token": refresh_token}
+    _connection().execute(
+        "INSERT INTO jobs (id, kind, status, params, cursor, window_end, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (job_id, "backfill", "queued", json.dumps(params), window_start.strftime(DATE_FORMAT), window_end.strftime(DATE_FORMAT), time.time(), time.time())
+    )
+    logging.debug("Queued backfill job %s from %s to %s", job_id, window_start, window_end)
+    return job_id
+
+
+def enqueue_push_sync(account, history_id):
+    """
+    Queues a sync of a watched account up to history_id. Notifications that
+    arrive while a sync for the account is still queued join that job.
+    """
+    conn = _connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE kind = 'push_sync' AND status = 'queued' AND params = ?",
+            (json.dumps({"account": account}),)
+        ).fetchone()
+        if row is None:
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, params, cursor, window_end, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, "push_sync", "queued", json.dumps({"account": account}), str(history_id), "", now, now)
+            )
+        else:
+            job_id = row[0]
+            conn.execute("UPDATE jobs SET cursor = ?, updated_at = ? WHERE id = ?", (str(history_id), now, job_id))
+        conn.execute(
+            "DELETE FROM jobs WHERE kind = 'push_sync' AND status = 'done' AND updated_at < ?",
+            (now - PUSH_SYNC_RETENTION_SECONDS,)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logging.debug("Queued push sync job %s for %s at history %s", job_id, account, history_id)
+    return job_id
+
+
+def get_job(job_id, include_tasks=True):
+    """
+    Returns the status of a job and, when include_tasks, the tasks extracted so far.
+    Returns None for unknown job ids.
+    """
+    conn = _connection()
+    row = conn.execute(
+        "SELECT id, status, cursor, window_end, attempts, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+    if row is None:
+        return None
+
+    job = {
+        "job_id": row[0],
+        "status": row[1],
+        "processed_until": row[2],
+        "window_end": row[3],
+        "attempts": row[4],
+        "error": row[5],
+        "created_at": row[6],
+        "updated_at": row[7],
+    }
+    if include_tasks:
+        rows = conn.execute("SELECT task FROM job_results WHERE job_id = ? ORDER BY seq", (job_id,)).fetchall()
+        job["tasks"] = [json.loads(r[0]) for r in rows]
+    return job
+
+
+def claim_job(worker_id):
+    """
+    Atomically takes the oldest queued job, or a running one whose worker went quiet.
+    Push syncs go before backfills, since someone is waiting for that mail.
+    Jobs put back after an error are held for JOB_RETRY_SECONDS per attempt.
+    Returns (job_id, kind, params, cursor, window_end) or None when there is nothing to do.
+    """
+    conn = _connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """
+            SELECT id, kind, params, cursor, window_end FROM jobs
+            WHERE (status = 'queued' AND updated_at + attempts * ? <= ?) OR (status = 'running' AND heartbeat_at < ?)
+            ORDER BY kind != 'push_sync', created_at LIMIT 1
+            """,
+            (JOB_RETRY_SECONDS, now, now - JOB_STALE_SECONDS)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now, now, row[0])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    if row is None:
+        return None
+    return row[0], row[1], json.loads(row[2]), row[3], row[4]
+
+
+def _save_chunk(job_id, tasks, next_cursor):
+    """
+    Stores the tasks of one chunk and moves the cursor in one transaction,
+    so a restarted job resumes exactly after the last finished chunk.
+    Attempts count from the current chunk, so a long backfill is not failed
+    by errors spread over many chunks.
+    """
+    conn = _connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        seq = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM job_results WHERE job_id = ?", (job_id,)).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO job_results (job_id, seq, task) VALUES (?, ?, ?)",
+            [(job_id, seq + i, json.dumps(task)) for i, task in enumerate(tasks)]
+        )
+        conn.execute(
+            "UPDATE jobs SET cursor = ?, attempts = 1, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+            (next_cursor, now, now, job_id)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _finish_job(job_id, status, error=None):
+    if status in ("done", "failed"):
+        # Finished jobs do not need the account's tokens any more
+        _connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, params = '{}', updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id)
+        )
+    else:
+        _connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id)
+        )
+
+
+@contextmanager
+def _heartbeat(job_id, worker_id):
+    """
+    Refreshes the job's heartbeat from a background thread while the block
+    runs, so a chunk that takes longer than JOB_STALE_SECONDS is not picked
+    up by another worker.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                _connection().execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                    (time.time(), job_id, worker_id)
+                )
+            except Exception as e:
+                logging.error("Error refreshing heartbeat of job %s: %s", job_id, e)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job_id, params, cursor, window_end):
+    """
+    Fetches and extracts the job window chunk by chunk, starting at cursor.
+    """
+    chunk_start = _parse_date(cursor, None)
+    end = _parse_date(window_end, None)
+
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(hours=JOB_CHUNK_HOURS), end)
+        logging.debug("Job %s: processing %s to %s", job_id, chunk_start, chunk_end)
+
+        # Errors are raised so run_worker retries the chunk instead of moving past it
+        failed = []
+        try:
+            emails = fetch_window_emails(
+                params["access_token"],
+                params["refresh_token"],
+                chunk_start.strftime(DATE_FORMAT),
+                chunk_end.strftime(DATE_FORMAT),
+                failed
+            )
+        except HttpError as e:
+            if e.resp.status == 401:
+                _finish_job(job_id, "failed", "Unauthorized")
+                return
+            raise
+        if failed:
+            raise RuntimeError(f"Could not fetch {len(failed)} messages from Gmail")
+
+        # Backfills yield the OpenAI quota to interactive requests
+        with rate_limiter.priority(rate_limiter.BACKFILL), request_failures() as failed:
+            tasks = process_emails(emails)
+        if failed:
+            # The emails that worked are in the message store, so the retry is cheap
+            raise RuntimeError(f"Task extraction failed for {len(failed)} emails")
+        _save_chunk(job_id, tasks, chunk_end.strftime(DATE_FORMAT))
+        chunk_start = chunk_end
+
+    _finish_job(job_id, "done")
+    logging.info("Job %s done", job_id)
+
+
+def run_push_sync(job_id, params):
+    """
+    Extracts the mail a Gmail push notification announced into the task store.
+    """
+    push.sync_account(params["account"])
+    _finish_job(job_id, "done")
+    logging.debug("Push sync job %s done", job_id)
+
+
+def run_worker(worker_id=None, once=False):
+    """
+    Processes jobs until stopped. With once=True, returns when the queue is empty.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    logging.info("Job worker %s started", worker_id)
+    renew_checked_at = 0
+
+    while True:
+        job = claim_job(worker_id)
+        if job is None:
+            if once:
+                return
+            if time.monotonic() - renew_checked_at >= WATCH_RENEW_CHECK_SECONDS:
+                renew_checked_at = time.monotonic()
+                try:
+                    push.renew_watches()
+                except Exception as e:
+                    logging.error("Error renewing Gmail watches: %s", e)
+            time.sleep(JOB_POLL_SECONDS)
+            continue
+
+        job_id, kind, params, cursor, window_end = job
+        try:
+            with _heartbeat(job_id, worker_id):
+                if kind == "push_sync":
+                    run_push_sync(job_id, params)
+                else:
+                    run_job(job_id, params, cursor, window_end)
+        except Exception as e:
+            logging.error("Job %s failed: %s", job_id, str(e))
+            attempts = _connection().execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            # Put it back in the queue; it resumes from the last saved chunk
+            _finish_job(job_id, "failed" if attempts >= JOB_MAX_ATTEMPTS else "queued", str(e))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv("JOB_WORKER_PROCESSES", 1))
+    if processes <= 1:
+        run_worker()
+    else:
+        workers = [multiprocessing.Process(target=run_worker) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
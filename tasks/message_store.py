@@ -0,0 +1,95 @@
+import json
+import time
+from tasks.db import get_connection
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_CHUNK_SIZE = 500
+
+_initialized = False
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed_messages (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                thread_id TEXT,
+                score INTEGER,
+                status TEXT NOT NULL,
+                task TEXT,
+                processed_at REAL NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+            """
+        )
+        _initialized = True
+    return conn
+
+
+def get_processed(account, message_ids):
+    """
+    Bulk lookup of already processed messages.
+    Returns {message_id: {"thread_id", "score", "status", "task"}} for the ids found,
+    where status is "unimportant", "no_task", "task" or "merged" (superseded by a
+    later message of the same thread) and task is the stored task dict.
+    """
+    conn = _connection()
+    found = {}
+    message_ids = list(message_ids)
+    for start in range(0, len(message_ids), LOOKUP_CHUNK_SIZE):
+        chunk = message_ids[start:start + LOOKUP_CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(
+            f"SELECT message_id, thread_id, score, status, task FROM processed_messages WHERE account = ? AND message_id IN ({placeholders})",
+            [account] + chunk
+        ).fetchall()
+        for message_id, thread_id, score, status, task in rows:
+            found[message_id] = {
+                "thread_id": thread_id,
+                "score": score,
+                "status": status,
+                "task": json.loads(task) if task else None,
+            }
+    return found
+
+
+def record(account, entries):
+    """
+    Stores processing results. entries is an iterable of
+    (message_id, thread_id, score, status, task) tuples; task is a dict or None.
+    """
+    now = time.time()
+    rows = [
+        (account, message_id, thread_id, score, status, json.dumps(task) if task else None, now)
+        for message_id, thread_id, score, status, task in entries
+    ]
+    if rows:
+        _connection().executemany(
+            """
+            INSERT OR REPLACE INTO processed_messages (account, message_id, thread_id, score, status, task, processed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+
+
+def record_email(email, task):
+    """
+    Stores the extraction result for an email returned by fetch_emails, and
+    then the thread context that now includes it (see threads.collapse_threads).
+    Emails without an account or id (e.g. built by hand) are ignored.
+    """
+    from tasks import threads
+
+    if not email.get("account") or not email.get("id"):
+        return
+    entries = [(email["id"], email.get("thread_id"), email.get("score"), "task" if task else "no_task", task)]
+    # Messages collapsed into this one by threads.collapse_threads
+    entries += [(message_id, thread_id, None, "merged", None) for message_id, thread_id in email.get("merged", [])]
+    record(email["account"], entries)
+    if "thread_context" in email:
+        threads.save_context(email["account"], email.get("thread_id"), email["id"], email["thread_context"])
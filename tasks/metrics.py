@@ -0,0 +1,166 @@
+"""
+In-process metrics: timing spans per pipeline stage and labelled counters,
+rendered in the Prometheus text format by GET /metrics.
+
+Spans also feed an optional per-request breakdown: inside request_timings(),
+every span (including ones in pipeline worker threads, which copy the
+caller's context) is added to the dict it yields.
+
+Values are per process; with several gunicorn workers each one reports its own.
+"""
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = "sortify_"
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # stage -> [bucket counts..., +Inf count, sum]
+_help = {
+    "stage_seconds": "Time spent per pipeline stage.",
+    "stage_errors_total": "Exceptions raised out of a pipeline stage.",
+    "errors_total": "Errors handled inside a stage.",
+    "emails_fetched_total": "Emails downloaded from Gmail.",
+    "emails_processed_total": "Emails sent through the extraction pipeline.",
+    "tasks_extracted_total": "Actionable tasks returned by the pipeline.",
+    "llm_calls_total": "OpenAI chat completions by outcome.",
+    "llm_tokens_total": "OpenAI tokens used, by type.",
+    "llm_budget_degraded_total": "Emails handled by heuristics because the token budget was spent.",
+    "extraction_failures_total": "Emails left unextracted because their OpenAI calls failed.",
+}
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """
+    Adds value to the counter name{labels}.
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(stage, seconds):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [0] * (len(BUCKETS) + 2)
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+        timings = _timings.get()
+        if timings is not None:
+            entry = timings.setdefault(stage, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + seconds * 1000, 3)
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the block as one run of stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("stage_errors_total", stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def timed(stage):
+    """
+    Decorator form of span, for plain and async functions.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def request_timings():
+    """
+    Collects the spans run inside the block into the yielded dict,
+    as {stage: {"count", "total_ms"}}.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def render(gauges=None):
+    """
+    Prometheus text exposition of all counters and stage histograms, plus
+    point-in-time gauges given as {name: number}.
+    """
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {stage: list(values) for stage, values in _histograms.items()}
+
+    by_name = {}
+    for (name, labels), value in sorted(counters.items()):
+        by_name.setdefault(name, []).append((labels, value))
+    for name, samples in by_name.items():
+        if name in _help:
+            lines.append(f"# HELP {PREFIX}{name} {_help[name]}")
+        lines.append(f"# TYPE {PREFIX}{name} counter")
+        lines.extend(f"{PREFIX}{name}{_format_labels(labels)} {value}" for labels, value in samples)
+
+    if histograms:
+        name = f"{PREFIX}stage_seconds"
+        lines.append(f"# HELP {name} {_help['stage_seconds']}")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, values in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {round(values[-1], 6)}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        lines.append(f"{PREFIX}{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -0,0 +1,191 @@
+"""
+Outbox for task emails. Entries are kept in SQLite next to the jobs, so a
+send queued before a restart still goes out and /outbox answers from any
+worker. Each process runs OUTBOX_WORKERS sender threads that claim due
+entries; one left "sending" by a process that died is sent again after
+OUTBOX_STALE_SECONDS.
+"""
+import os
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+from tasks.db import get_connection
+from tasks.email_sender import send_email_via_smtp
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 2))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", 2))
+# Finished entries are forgotten after this long
+OUTBOX_STATUS_TTL_SECONDS = int(os.getenv("OUTBOX_STATUS_TTL_SECONDS", 3600))
+# Idle sender threads look for due entries this often
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 0.5))
+# An entry stuck in "sending" for this long belonged to a worker that went away
+OUTBOX_STALE_SECONDS = int(os.getenv("OUTBOX_STALE_SECONDS", 300))
+
+_lock = threading.Lock()
+_workers = []
+# Wakes the local sender threads when an entry is queued in this process
+_wakeup = threading.Event()
+_initialized = False
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                sender_name TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                deadline TEXT,
+                task TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                not_before REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, not_before)")
+        _initialized = True
+    return conn
+
+
+def start_workers():
+    """
+    Starts this process's sender threads if they are not running yet.
+    """
+    with _lock:
+        alive = [worker for worker in _workers if worker.is_alive()]
+        for i in range(len(alive), OUTBOX_WORKERS):
+            worker = threading.Thread(target=_work, name=f"outbox-{i}", daemon=True)
+            worker.start()
+            alive.append(worker)
+        _workers[:] = alive
+
+
+def enqueue(sender_name, recipient_email, deadline, task):
+    """
+    Queues one task email and returns its outbox id; sending happens in the background.
+    """
+    return enqueue_many(sender_name, [recipient_email], [{"task": task, "deadline": deadline}])[0]
+
+
+def enqueue_many(sender_name, recipients, tasks):
+    """
+    Queues every task for every recipient. tasks is a list of {"task", "deadline"} dicts.
+    Returns the outbox ids in recipient-major order.
+    """
+    now = time.time()
+    rows = [
+        (uuid.uuid4().hex, sender_name, recipient, item.get("deadline"), item["task"], "queued", 0, now, now)
+        for recipient in recipients
+        for item in tasks
+    ]
+    _connection().executemany(
+        "INSERT INTO outbox (id, sender_name, recipient, deadline, task, status, not_before, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    start_workers()
+    _wakeup.set()
+    return [row[0] for row in rows]
+
+
+def status(outbox_ids):
+    """
+    Returns the public state of the given outbox entries; unknown ids are left out.
+    """
+    if not outbox_ids:
+        return []
+    rows = _connection().execute(
+        f"SELECT id, recipient, task, status, attempts, error, updated_at FROM outbox WHERE id IN ({','.join('?' * len(outbox_ids))})",
+        list(outbox_ids)
+    ).fetchall()
+    keys = ("id", "recipient", "task", "status", "attempts", "error", "updated_at")
+    entries = {row[0]: dict(zip(keys, row)) for row in rows}
+    return [entries[outbox_id] for outbox_id in outbox_ids if outbox_id in entries]
+
+
+def _claim():
+    """
+    Atomically takes the entry that has been due the longest, or one whose sender went away.
+    Returns (id, sender_name, recipient, deadline, task, attempts) or None.
+    """
+    conn = _connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """
+            SELECT id, sender_name, recipient, deadline, task, attempts FROM outbox
+            WHERE (status IN ('queued', 'retrying') AND not_before <= ?) OR (status = 'sending' AND updated_at < ?)
+            ORDER BY not_before LIMIT 1
+            """,
+            (now, now - OUTBOX_STALE_SECONDS)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (now, row[0])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    if row is None:
+        return None
+    return row[:5] + (row[5] + 1,)
+
+
+def send_next():
+    """
+    Sends the entry that has been due the longest. Returns False when nothing was due.
+    """
+    entry = _claim()
+    if entry is None:
+        return False
+    outbox_id, sender_name, recipient, deadline, task, attempts = entry
+
+    not_before = 0
+    try:
+        send_email_via_smtp(sender_name, recipient, deadline, task)
+        outcome, error = "sent", None
+    except Exception as e:
+        logging.error("Outbox send %s failed (attempt %d): %s", outbox_id, attempts, str(e))
+        outcome, error = "retrying", str(e)
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            outcome = "failed"
+        else:
+            backoff = OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+            not_before = time.time() + backoff * random.uniform(0.5, 1.5)
+
+    now = time.time()
+    conn = _connection()
+    conn.execute(
+        "UPDATE outbox SET status = ?, error = ?, not_before = ?, updated_at = ? WHERE id = ?",
+        (outcome, error, not_before, now, outbox_id)
+    )
+    conn.execute(
+        "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND updated_at < ?",
+        (now - OUTBOX_STATUS_TTL_SECONDS,)
+    )
+    return True
+
+
+def _work():
+    while True:
+        try:
+            if send_next():
+                continue
+        except sqlite3.Error as e:
+            logging.error("Error reading the outbox: %s", e)
+        _wakeup.wait(OUTBOX_POLL_SECONDS)
+        _wakeup.clear()
@@ -0,0 +1,264 @@
+import os
+import logging
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tasks.ai_processor import ExtractionError, extract_tasks, extract_deadline_with_chatgpt, extract_task_and_deadline, extract_tasks_batched
+from tasks.sortify_processor import extract_sortify_task
+from tasks.utils import heuristic_task
+from tasks import message_store, classifier, metrics, budget, sync_state
+
+gmail_user = os.getenv("EMAIL_ADDRESS")
+
+# Upper bound on emails being sent to OpenAI at the same time
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+
+# "two_call" runs extract_tasks then extract_deadline_with_chatgpt,
+# "combined" gets both from a single JSON completion,
+# "batch" packs several emails into one extract_tasks completion
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "two_call")
+
+_failures = contextvars.ContextVar("extraction_failures", default=None)
+_degraded = contextvars.ContextVar("degraded_emails", default=None)
+
+
+class _ContextExecutor(ThreadPoolExecutor):
+    """
+    Runs each call in a copy of the submitter's context, so worker threads keep
+    the caller's LLM priority lane.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def is_sortify_email(email):
+    return bool(email.get("from") and gmail_user and gmail_user in email.get("from"))
+
+
+def build_task(email, detailed_tasks, deadline):
+    return {
+        "subject": email["subject"],
+        "from": email["from"],
+        "summary": detailed_tasks,
+        "deadline": deadline if deadline else "No deadline"
+    }
+
+
+def process_email(email, mode=None):
+    """
+    Turns a single email into a task dict.
+    Returns None when the email has no actionable tasks, or when its extraction
+    failed; failed emails are not stored, so the next fetch extracts them again.
+    """
+    if "processed" in email:
+        # Extracted on an earlier request, see message_store
+        return email["processed"]
+
+    logging.debug("Processing email from: %s with subject: %s", email.get("from"), email.get("subject"))
+    if _classifier_skips(email):
+        message_store.record_email(email, None)
+        return None
+    if _over_budget(email):
+        return degraded_task(email)
+
+    with budget.charge_to(email.get("account")):
+        try:
+            task = _extract(email, mode or EXTRACTION_MODE)
+        except ExtractionError:
+            note_failed(email)
+            return None
+    message_store.record_email(email, task)
+    if not is_sortify_email(email):
+        classifier.record_example(email, task is not None)
+    return task
+
+
+def _classifier_skips(email):
+    # Sortify emails are parsed locally and never reach the LLM anyway
+    return not is_sortify_email(email) and classifier.should_skip(email)
+
+
+@contextmanager
+def request_failures():
+    """
+    Collects the ids of the emails whose extraction failed inside the block
+    into the yielded list, so the caller can report partial results.
+    """
+    failed = []
+    token = _failures.set(failed)
+    try:
+        yield failed
+    finally:
+        _failures.reset(token)
+
+
+@contextmanager
+def request_degraded():
+    """
+    Collects the ids of the emails handled by degraded_task inside the block.
+    """
+    degraded = []
+    token = _degraded.set(degraded)
+    try:
+        yield degraded
+    finally:
+        _degraded.reset(token)
+
+
+def note_failed(email):
+    failed = _failures.get()
+    if failed is not None:
+        failed.append(email.get("id"))
+    metrics.inc("extraction_failures_total")
+    logging.warning("Extraction failed for email %s, it is retried on the next fetch", email.get("id"))
+    if email.get("account") and email.get("id"):
+        # The next incremental sync lists it again even though its history has passed
+        sync_state.add_pending(email["account"], [email["id"]])
+
+
+def _over_budget(email):
+    return not is_sortify_email(email) and not budget.allow(email.get("account"))
+
+
+def degraded_task(email):
+    """
+    LLM-free extraction for when the token budget is spent. The result is not
+    stored, so the email is extracted properly once the budget frees up.
+    Tasks come back marked "degraded"; every degraded email is also listed in
+    request_degraded(), including the ones the heuristics found nothing in.
+    """
+    degraded = _degraded.get()
+    if degraded is not None:
+        degraded.append(email.get("id"))
+    budget.note_degraded(email.get("account"))
+    metrics.inc("llm_budget_degraded_total")
+    footer = email.get("body_stats", {}).get("footer")
+    result = heuristic_task(email.get("subject"), email.get("body"), email.get("from"), footer)
+    return dict(build_task(email, *result), degraded=True) if result else None
+
+
+def _extract(email, mode):
+    if is_sortify_email(email):
+        with metrics.span("sortify_parse"):
+            detailed_tasks, deadline = extract_sortify_task(email["body"])
+    elif mode == "combined":
+        detailed_tasks, deadline = extract_task_and_deadline(email["body"])
+        if "No actionable tasks" in detailed_tasks:
+            return None
+    else:
+        detailed_tasks = extract_tasks(email["body"])  # Extract detailed tasks
+        if "No actionable tasks" in detailed_tasks:  # Filter out non-actionable tasks
+            return None
+        deadline = extract_deadline_with_chatgpt(detailed_tasks)  # Extract deadline
+
+    return build_task(email, detailed_tasks, deadline)
+
+
+def _process_emails_batched(emails, executor):
+    """
+    Batch mode: task extraction is packed into shared completions,
+    deadlines are then extracted per actionable task.
+    """
+    results = [None] * len(emails)
+    llm_indexes = []
+    for i, email in enumerate(emails):
+        if "processed" in email or is_sortify_email(email):
+            results[i] = process_email(email)
+        elif _classifier_skips(email):
+            message_store.record_email(email, None)
+        elif _over_budget(email):
+            results[i] = degraded_task(email)
+        else:
+            llm_indexes.append(i)
+
+    # A request covers one account, so its batches are charged to it
+    account = emails[llm_indexes[0]].get("account") if llm_indexes else None
+    with budget.charge_to(account):
+        extracted = extract_tasks_batched([emails[i]["body"] for i in llm_indexes], map_fn=executor.map)
+        failed = {i for i, task in zip(llm_indexes, extracted) if task is None}
+        actionable = [
+            (i, task) for i, task in zip(llm_indexes, extracted)
+            if task is not None and "No actionable tasks" not in task
+        ]
+
+        deadlines = executor.map(lambda item: _deadline_or_none(item[1]), actionable)
+        for (i, task), deadline in zip(actionable, deadlines):
+            if deadline is None:
+                failed.add(i)
+            else:
+                results[i] = build_task(emails[i], task, deadline)
+    for i in llm_indexes:
+        if i in failed:
+            # No verdict to store or learn from
+            note_failed(emails[i])
+            continue
+        message_store.record_email(emails[i], results[i])
+        classifier.record_example(emails[i], results[i] is not None)
+    return results
+
+
+def _deadline_or_none(task):
+    try:
+        return extract_deadline_with_chatgpt(task)
+    except ExtractionError:
+        return None
+
+
+def process_emails(emails, max_workers=None, mode=None):
+    """
+    Runs process_email over all emails with at most max_workers in flight.
+    Returns the actionable tasks in the same order as the input emails.
+    """
+    if not emails:
+        return []
+
+    mode = mode or EXTRACTION_MODE
+    max_workers = max(1, min(max_workers or LLM_MAX_CONCURRENCY, len(emails)))
+    logging.debug("Processing %d emails with %d workers in %s mode", len(emails), max_workers, mode)
+
+    with _ContextExecutor(max_workers=max_workers) as executor:
+        if mode == "batch":
+            results = _process_emails_batched(emails, executor)
+        else:
+            results = list(executor.map(lambda email: process_email(email, mode), emails))
+
+    tasks = [task for task in results if task is not None]
+    metrics.inc("emails_processed_total", len(emails))
+    metrics.inc("tasks_extracted_total", len(tasks))
+    return tasks
+
+
+def iter_process_emails(emails, max_workers=None, mode=None):
+    """
+    Streaming variant of process_emails.
+    Yields (index, task) pairs as soon as each email is done, in completion order;
+    task is None for emails without actionable tasks.
+    In batch mode results are yielded once all batches have finished.
+    """
+    if not emails:
+        return
+
+    mode = mode or EXTRACTION_MODE
+    max_workers = max(1, min(max_workers or LLM_MAX_CONCURRENCY, len(emails)))
+    logging.debug("Streaming %d emails with %d workers in %s mode", len(emails), max_workers, mode)
+
+    metrics.inc("emails_processed_total", len(emails))
+    with _ContextExecutor(max_workers=max_workers) as executor:
+        if mode == "batch":
+            results = _process_emails_batched(emails, executor)
+            metrics.inc("tasks_extracted_total", sum(1 for task in results if task is not None))
+            yield from enumerate(results)
+            return
+
+        futures = {executor.submit(process_email, email, mode): index for index, email in enumerate(emails)}
+        try:
+            for future in as_completed(futures):
+                task = future.result()
+                if task is not None:
+                    metrics.inc("tasks_extracted_total")
+                yield futures.pop(future), task
+        finally:
+            # The client went away or a task failed, drop the work that has not started
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,133 @@
+import os
+import re
+import logging
+import threading
+
+# Bodies are cut to about this many tokens before scoring and prompting
+BODY_TOKEN_BUDGET = int(os.getenv("BODY_TOKEN_BUDGET", 1500))
+
+# Start of the quoted history in a reply ("On Mon, ... wrote:", Outlook headers)
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r"^On\s[^\n]{0,300}(?:\n[^\n]{0,300})?\bwrote:\s*$", re.MULTILINE),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.MULTILINE | re.IGNORECASE),
+    re.compile(r"^From:\s.*\n(?:Sent|Date):\s", re.MULTILINE),
+]
+SIGNATURE_PATTERNS = [
+    re.compile(r"^-- ?$", re.MULTILINE),  # RFC 3676 signature delimiter
+    re.compile(r"^Sent from my \w+.*$", re.MULTILINE | re.IGNORECASE),
+    re.compile(r"^Get Outlook for \w+.*$", re.MULTILINE | re.IGNORECASE),
+]
+# Paragraphs that are boilerplate rather than message content
+FOOTER_PATTERN = re.compile(
+    r"unsubscribe|manage (?:your )?(?:email )?preferences|view (?:this email )?in (?:your )?browser|"
+    r"this (?:e-?mail|message)(?: and any attachments?)? (?:is|are|may be) (?:confidential|privileged)|"
+    r"intended (?:solely )?for the (?:named |intended )?(?:recipient|addressee)|"
+    r"you (?:are )?receiv(?:ed|ing) this (?:e-?mail|message) because",
+    re.IGNORECASE
+)
+URL_PATTERN = re.compile(r"<?https?://([^/\s>]+)[^\s>]*>?")
+INLINE_SPACE_PATTERN = re.compile(r"[ \t\u00a0\u200b]+")
+BLANK_LINES_PATTERN = re.compile(r"\n{3,}")
+
+_stats = {"emails": 0, "bytes_in": 0, "bytes_out": 0, "tokens_saved": 0, "truncated": 0}
+_stats_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about 4 characters per token for English text).
+    """
+    return len(text or "") // 4 + 1
+
+
+def strip_quoted(body):
+    """
+    Drops the quoted history of a reply. Falls back to the quoted text when
+    nothing was written above it.
+    """
+    cut = len(body)
+    for pattern in QUOTE_HEADER_PATTERNS:
+        match = pattern.search(body)
+        if match:
+            cut = min(cut, match.start())
+    top = "\n".join(line for line in body[:cut].splitlines() if not line.lstrip().startswith(">"))
+    if top.strip():
+        return top
+    return "\n".join(line.lstrip("> ") for line in body.splitlines())
+
+
+def strip_signature(body):
+    for pattern in SIGNATURE_PATTERNS:
+        match = pattern.search(body)
+        # Only trust a delimiter that leaves some content above it
+        if match and body[:match.start()].strip():
+            body = body[:match.start()]
+    return body
+
+
+def strip_footers(body):
+    """
+    Returns (body without footer paragraphs, the footer paragraphs).
+    """
+    paragraphs = re.split(r"\n\s*\n", body)
+    footers = [p for p in paragraphs[1:] if FOOTER_PATTERN.search(p)]
+    # The first paragraph is always kept, even if it mentions e.g. "unsubscribe"
+    return "\n\n".join(paragraphs[:1] + [p for p in paragraphs[1:] if not FOOTER_PATTERN.search(p)]), footers
+
+
+def collapse(body):
+    body = URL_PATTERN.sub(lambda m: f"[link: {m.group(1)}]", body)
+    lines = [INLINE_SPACE_PATTERN.sub(" ", line).strip() for line in body.splitlines()]
+    return BLANK_LINES_PATTERN.sub("\n\n", "\n".join(lines)).strip()
+
+
+def truncate(body, token_budget=None):
+    """
+    Cuts the body to about token_budget tokens at a word boundary.
+    """
+    max_chars = (token_budget or BODY_TOKEN_BUDGET) * 4
+    if len(body) <= max_chars:
+        return body, False
+    cut = body.rfind(" ", 0, max_chars)
+    return body[:cut if cut > max_chars // 2 else max_chars].rstrip() + " [truncated]", True
+
+
+def clean_body(body, token_budget=None):
+    """
+    Normalizes a decoded text/plain body for scoring and prompting: strips quoted
+    history, signatures and footers, collapses whitespace and URLs, and trims
+    it to the token budget. Returns (cleaned_body, stats); stats["footer"] keeps
+    the stripped footers, whose "unsubscribe" and the like still count in scoring.
+    """
+    if not body:
+        return body or "", {"bytes_saved": 0, "tokens_saved": 0, "truncated": False, "footer": ""}
+
+    cleaned = body.replace("\r\n", "\n").replace("\r", "\n")
+    cleaned = strip_quoted(cleaned)
+    cleaned = strip_signature(cleaned)
+    cleaned, footers = strip_footers(cleaned)
+    cleaned = collapse(cleaned)
+    cleaned, truncated = truncate(cleaned, token_budget)
+
+    bytes_in, bytes_out = len(body.encode("utf-8")), len(cleaned.encode("utf-8"))
+    stats = {
+        "bytes_saved": bytes_in - bytes_out,
+        "tokens_saved": estimate_tokens(body) - estimate_tokens(cleaned),
+        "truncated": truncated,
+        "footer": collapse("\n\n".join(footers)),
+    }
+    with _stats_lock:
+        _stats["emails"] += 1
+        _stats["bytes_in"] += bytes_in
+        _stats["bytes_out"] += bytes_out
+        _stats["tokens_saved"] += stats["tokens_saved"]
+        _stats["truncated"] += int(truncated)
+    logging.debug("Preprocessed body: %d -> %d bytes, %d tokens saved", bytes_in, bytes_out, stats["tokens_saved"])
+    return cleaned, stats
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result["bytes_saved"] = result["bytes_in"] - result["bytes_out"]
+    return result
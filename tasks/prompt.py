@@ -48,4 +48,33 @@ Your role is to extract **one actionable to-do item** from each email. You must
 
 Your job is to **cut through the noise** and return only what **truly requires action.**  
 If in doubt, lean toward surfacing tasks that help people stay organized and responsive.
-"""
\ No newline at end of file
+"""
+
+combined_prompt = prompt + """
+---
+
+### Output format:
+Respond with a single JSON object and nothing else, using exactly these keys:
+{"task": "<the to-do item, or No actionable tasks.>", "deadline": "<YYYY-MM-DD or empty string>"}
+
+- Today's date is {today}.
+- `deadline` is the single most relevant deadline for the task (e.g., the earliest).
+- Convert vague expressions like 'tomorrow', 'next week', or 'Friday' into an actual date.
+- Never return a deadline earlier than today. If there is no deadline, or it has passed, use "".
+- Do not wrap the JSON in markdown or add any explanation.
+"""
+
+
+batch_prompt = prompt + """
+---
+
+### Batch mode:
+You will receive several emails, each starting with a header like `### Email 3`.
+Apply the rules above to **each email separately**.
+
+Respond with a single JSON array and nothing else, with exactly one object per email:
+[{"index": <email number>, "task": "<the to-do item, or No actionable tasks.>"}]
+
+- Every email number must appear exactly once.
+- Do not wrap the JSON in markdown or add any explanation.
+"""
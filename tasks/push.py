@@ -0,0 +1,267 @@
+"""
+Push ingestion: Gmail users.watch sends a Pub/Sub notification to POST
+/gmail/push whenever an inbox changes, and a push_sync job (tasks/jobs.py)
+extracts the new mail right away into tasks/task_store.py. The dashboard then
+reads the ready tasks from /tasks instead of running a fetch and extraction
+on every poll.
+
+A watch keeps the account's tokens so the job worker can fetch on its own. It
+has its own history pointer, separate from the incremental /fetch-emails sync,
+so neither path skips mail for the other. Gmail lets a watch lapse after 7
+days; the job worker renews the ones that expire within WATCH_RENEW_SECONDS.
+The history pointer only moves past mail whose tasks the LLM has extracted:
+after a failed download or extraction the sync job is retried, and tasks degraded by the
+token budget are stored marked "degraded" until a later sync replaces them.
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import logging
+from datetime import datetime, timedelta, timezone
+from tasks.db import get_connection
+from tasks.gmail_client import gmail_service, remember_account_email
+from tasks.email_reader import list_new_message_ids, fetch_important_emails
+from tasks.pipeline import iter_process_emails, request_failures, request_degraded
+from tasks import task_store
+
+# Pub/Sub topic Gmail publishes to, e.g. projects/my-project/topics/gmail-push
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC")
+# Shared secret expected as ?token=... on the push subscription's endpoint URL
+GMAIL_PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN")
+WATCH_RENEW_SECONDS = int(os.getenv("GMAIL_WATCH_RENEW_SECONDS", 24 * 3600))
+# The first sync of a new watch extracts this much of the inbox
+WATCH_SEED_DAYS = int(os.getenv("GMAIL_WATCH_SEED_DAYS", 3))
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+_initialized = False
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS gmail_watches (
+                account TEXT PRIMARY KEY,
+                access_token TEXT NOT NULL,
+                refresh_token TEXT,
+                expiration REAL NOT NULL,
+                notified_history_id TEXT,
+                synced_history_id TEXT,
+                synced_at REAL,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        _initialized = True
+    return conn
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, DATE_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def register_watch(access_token, refresh_token):
+    """
+    Starts (or renews) the Gmail watch for the account and queues its first sync.
+    Returns {"account", "history_id", "expiration"}.
+    """
+    from tasks import jobs
+
+    if not GMAIL_PUSH_TOPIC:
+        raise ValueError("GMAIL_PUSH_TOPIC is not configured.")
+    if not refresh_token:
+        # The worker syncs long after the access token has expired
+        raise ValueError("A refresh token is required to watch an account.")
+
+    with gmail_service(access_token, refresh_token) as service:
+        account = service.users().getProfile(userId="me").execute()["emailAddress"]
+        remember_account_email(access_token, refresh_token, account)
+        watch = service.users().watch(userId="me", body={
+            "topicName": GMAIL_PUSH_TOPIC,
+            "labelIds": ["INBOX"],
+            "labelFilterBehavior": "INCLUDE",
+        }).execute()
+
+    expiration = int(watch["expiration"]) / 1000
+    _connection().execute(
+        """
+        INSERT INTO gmail_watches (account, access_token, refresh_token, expiration, updated_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (account) DO UPDATE SET
+            access_token = excluded.access_token,
+            refresh_token = excluded.refresh_token,
+            expiration = excluded.expiration,
+            error = NULL,
+            updated_at = excluded.updated_at
+        """,
+        (account, access_token, refresh_token, expiration, time.time())
+    )
+    jobs.enqueue_push_sync(account, watch["historyId"])
+    logging.info("Gmail watch for %s registered until %s", account, datetime.fromtimestamp(expiration, timezone.utc))
+    return {"account": account, "history_id": watch["historyId"], "expiration": expiration}
+
+
+def stop_watch(access_token, refresh_token):
+    """
+    Stops the Gmail watch and forgets the account's tokens. Stored tasks are kept.
+    """
+    with gmail_service(access_token, refresh_token) as service:
+        account = service.users().getProfile(userId="me").execute()["emailAddress"]
+        service.users().stop(userId="me").execute()
+    _connection().execute("DELETE FROM gmail_watches WHERE account = ?", (account,))
+    logging.info("Gmail watch for %s stopped", account)
+    return account
+
+
+def get_watch(account):
+    row = _connection().execute(
+        "SELECT access_token, refresh_token, expiration, notified_history_id, synced_history_id, synced_at, error FROM gmail_watches WHERE account = ?",
+        (account,)
+    ).fetchone()
+    if row is None:
+        return None
+    keys = ("access_token", "refresh_token", "expiration", "notified_history_id", "synced_history_id", "synced_at", "error")
+    return dict(zip(keys, row))
+
+
+def verify_push_token(token):
+    # Without a configured token every notification is accepted; it can only trigger a sync
+    return not GMAIL_PUSH_TOKEN or hmac.compare_digest(token or "", GMAIL_PUSH_TOKEN)
+
+
+def parse_notification(envelope):
+    """
+    Returns (email_address, history_id) from a Pub/Sub push envelope, or None if malformed.
+    """
+    try:
+        data = json.loads(base64.b64decode(envelope["message"]["data"]))
+        return data["emailAddress"], str(data["historyId"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def handle_notification(envelope):
+    """
+    Queues a sync for the notified account. Returns False for notifications
+    that are malformed or for accounts without a watch; they are still
+    acknowledged so Pub/Sub does not redeliver them.
+    """
+    from tasks import jobs
+
+    notification = parse_notification(envelope)
+    if notification is None:
+        logging.warning("Ignoring malformed Gmail push notification")
+        return False
+    account, history_id = notification
+    updated = _connection().execute(
+        "UPDATE gmail_watches SET notified_history_id = ?, updated_at = ? WHERE account = ?",
+        (history_id, time.time(), account)
+    ).rowcount
+    if not updated:
+        logging.info("Ignoring Gmail push notification for unwatched account %s", account)
+        return False
+    jobs.enqueue_push_sync(account, history_id)
+    return True
+
+
+def sync_account(account):
+    """
+    Extracts the mail added since the last sync of the account's watch into
+    the task store. Returns the number of emails looked at.
+    """
+    watch = get_watch(account)
+    if watch is None:
+        logging.info("Skipping push sync for %s, the watch was stopped", account)
+        return 0
+
+    seed_from = (datetime.now(timezone.utc) - timedelta(days=WATCH_SEED_DAYS)).strftime(DATE_FORMAT)
+    seed_to = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+    try:
+        with gmail_service(watch["access_token"], watch["refresh_token"]) as service:
+            # Read the historyId first so mail added during the sync is picked up next time
+            history_id = service.users().getProfile(userId="me").execute()["historyId"]
+            message_ids = list_new_message_ids(service, account, watch["synced_history_id"], seed_from, seed_to)
+            missing = []
+            emails = fetch_important_emails(service, message_ids, account, missing) if message_ids else []
+    except Exception as e:
+        _connection().execute("UPDATE gmail_watches SET error = ?, updated_at = ? WHERE account = ?", (str(e), time.time(), account))
+        raise
+
+    ready, no_task = [], []
+    with request_failures() as failed, request_degraded() as degraded:
+        for index, task in iter_process_emails(emails):
+            if task is not None:
+                ready.append((emails[index]["id"], emails[index].get("date"), task))
+            elif emails[index]["id"] not in failed:
+                no_task.append(emails[index]["id"])
+    task_store.save(account, ready)
+    # Earlier messages collapsed into a newer reply no longer have their own task,
+    # and a degraded task stored by an earlier sync goes once the LLM finds none
+    task_store.remove(account, no_task + [message_id for email in emails for message_id, _ in email.get("merged", [])])
+
+    if failed or missing:
+        error = f"Could not fetch {len(missing)} and extract {len(failed)} emails"
+        _connection().execute("UPDATE gmail_watches SET error = ?, updated_at = ? WHERE account = ?", (error, time.time(), account))
+        # Raised so the job is retried; the pointer stays where it was, or the
+        # history listing would never return these messages again
+        raise RuntimeError(error)
+    if degraded:
+        # Keep the pointer so the next sync extracts them with the LLM again
+        logging.info("Push sync for %s: %d emails degraded by the token budget, not advancing history", account, len(degraded))
+        _connection().execute("UPDATE gmail_watches SET synced_at = ?, updated_at = ? WHERE account = ?", (time.time(), time.time(), account))
+    else:
+        _connection().execute(
+            "UPDATE gmail_watches SET synced_history_id = ?, synced_at = ?, error = NULL, updated_at = ? WHERE account = ?",
+            (str(history_id), time.time(), time.time(), account)
+        )
+    logging.info("Push sync for %s: %d emails, %d tasks ready", account, len(emails), len(ready))
+    return len(emails)
+
+
+def renew_watches():
+    """
+    Renews the watches that expire within WATCH_RENEW_SECONDS. Returns how many were renewed.
+    Watches that have already lapsed and still cannot be renewed are deleted
+    with their tokens.
+    """
+    rows = _connection().execute(
+        "SELECT account, access_token, refresh_token, expiration FROM gmail_watches WHERE expiration < ?",
+        (time.time() + WATCH_RENEW_SECONDS,)
+    ).fetchall()
+    renewed = 0
+    for account, access_token, refresh_token, expiration in rows:
+        try:
+            register_watch(access_token, refresh_token)
+            renewed += 1
+        except Exception as e:
+            logging.error("Error renewing Gmail watch for %s: %s", account, e)
+            if expiration < time.time():
+                logging.warning("Gmail watch for %s lapsed, forgetting it", account)
+                _connection().execute("DELETE FROM gmail_watches WHERE account = ?", (account,))
+            else:
+                _connection().execute("UPDATE gmail_watches SET error = ?, updated_at = ? WHERE account = ?", (str(e), time.time(), account))
+    return renewed
+
+
+def ready_tasks(account, fetch_from=None, fetch_to=None):
+    """
+    The tasks extracted ahead of time for the account in the window, newest
+    first, with the state of its watch. "watching" is False when the account
+    has no watch, in which case the caller should fall back to /fetch-emails.
+    """
+    watch = get_watch(account)
+    return {
+        "tasks": task_store.list_tasks(account, _parse_date(fetch_from), _parse_date(fetch_to)),
+        "watching": watch is not None,
+        "synced_at": watch["synced_at"] if watch else None,
+        "expiration": watch["expiration"] if watch else None,
+        "error": watch["error"] if watch else None,
+    }
@@ -0,0 +1,323 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from tasks.db import get_connection
+
+# Account quota for the model, per minute. The limiter state is kept in the
+# SQLite db, so all processes on this host share it; with LIMITER_SHARED=false
+# it is per process and the quota has to be split across workers by hand.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", 3500))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", 90000))
+# Buckets hold this many seconds of quota, which bounds bursts
+LIMITER_BURST_SECONDS = float(os.getenv("LIMITER_BURST_SECONDS", 10))
+LIMITER_SHARED = os.getenv("LIMITER_SHARED", "true").lower() != "false"
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", 1))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", 30))
+
+# AIMD: halve the rate on a 429, win back this fraction of the quota per success
+AIMD_DECREASE = 0.5
+AIMD_INCREASE = 0.02
+AIMD_MIN_FACTOR = 0.05
+
+# Waiting callers check the buckets again at least this often
+MAX_WAIT_SECONDS = 0.5
+# A waiting INTERACTIVE caller keeps BACKFILL callers back this much past its expected turn
+INTERACTIVE_HOLD_SECONDS = 0.2
+
+INTERACTIVE = 0
+BACKFILL = 1
+
+_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """
+    Runs the block's LLM calls in the given lane; INTERACTIVE callers go ahead of BACKFILL.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def _header_seconds(value):
+    # OpenAI reset headers look like "1s", "6m0s", "20ms"; retry-after is plain seconds
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total, number = 0.0, ""
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char.isdigit() or char == ".":
+            number += char
+            i += 1
+            continue
+        unit = "ms" if value[i:i + 2] == "ms" else char
+        if unit not in units or not number:
+            return None
+        total += float(number) * units[unit]
+        number = ""
+        i += len(unit)
+    return total
+
+
+class AdaptiveRateLimiter:
+    """
+    Token buckets for requests/minute and tokens/minute shared by all LLM calls.
+    The refill rate adapts AIMD-style: it is cut on every 429 (honouring the
+    reset headers) and grows back slowly on success.
+
+    With shared=True the bucket state lives in the SQLite db, so every gunicorn
+    worker and job process that uses the same SORTIFY_DB_PATH draws from one
+    quota, and BACKFILL callers anywhere yield to INTERACTIVE ones. Waiting
+    INTERACTIVE callers announce themselves in the shared state until they are
+    served. With shared=False the state is per process.
+    """
+
+    def __init__(self, rpm, tpm, burst_seconds=10, shared=False, name="openai"):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst_seconds = burst_seconds
+        self.shared = shared
+        self.name = name
+        self._state = self._initial_state(time.time())
+        self._waiting = {INTERACTIVE: 0, BACKFILL: 0}
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _initial_state(self, now):
+        state = {"factor": 1.0, "blocked_until": 0.0, "interactive_until": 0.0, "updated": now}
+        state["requests"] = self._request_capacity(state)
+        state["tokens"] = self._token_capacity(state)
+        return state
+
+    def _request_capacity(self, state):
+        return max(1.0, self.rpm * state["factor"] / 60 * self.burst_seconds)
+
+    def _token_capacity(self, state):
+        return max(1.0, self.tpm * state["factor"] / 60 * self.burst_seconds)
+
+    def _connection(self):
+        conn = get_connection()
+        if not self._initialized:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    name TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    factor REAL NOT NULL,
+                    blocked_until REAL NOT NULL,
+                    interactive_until REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+                """
+            )
+            self._initialized = True
+        return conn
+
+    def _update(self, fn):
+        """
+        Runs fn(state, now) on the current bucket state and saves the changes.
+        Shared state is read and written in one transaction, so processes never
+        take the same capacity twice. If the db fails, the call falls back to
+        the local state rather than blocking extraction.
+        """
+        now = time.time()
+        if self.shared:
+            try:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(
+                        "SELECT requests, tokens, factor, blocked_until, interactive_until, updated FROM rate_limits WHERE name = ?",
+                        (self.name,)
+                    ).fetchone()
+                    if row is None:
+                        state = self._initial_state(now)
+                    else:
+                        state = dict(zip(("requests", "tokens", "factor", "blocked_until", "interactive_until", "updated"), row))
+                    result = fn(state, now)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO rate_limits (name, requests, tokens, factor, blocked_until, interactive_until, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (self.name, state["requests"], state["tokens"], state["factor"], state["blocked_until"], state["interactive_until"], state["updated"])
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                return result
+            except sqlite3.Error as e:
+                logging.error("Error using the shared rate limiter, falling back to local state: %s", e)
+        with self._lock:
+            return fn(self._state, now)
+
+    def _refill(self, state, now):
+        # Clocks of different processes can be slightly apart, never refill backwards
+        elapsed = max(0.0, now - state["updated"])
+        state["updated"] = max(state["updated"], now)
+        state["requests"] = min(self._request_capacity(state), state["requests"] + elapsed * self.rpm * state["factor"] / 60)
+        state["tokens"] = min(self._token_capacity(state), state["tokens"] + elapsed * self.tpm * state["factor"] / 60)
+
+    def _try_take(self, state, now, tokens, level):
+        """
+        Takes one request and the tokens if available. Returns 0, or the seconds to wait.
+        """
+        self._refill(state, now)
+        if now < state["blocked_until"]:
+            return state["blocked_until"] - now
+        if level == BACKFILL and now < state["interactive_until"]:
+            return min(state["interactive_until"] - now, MAX_WAIT_SECONDS)
+        tokens = min(tokens, self._token_capacity(state))
+        if state["requests"] >= 1 and state["tokens"] >= tokens:
+            state["requests"] -= 1
+            state["tokens"] -= tokens
+            return 0
+        request_wait = max(0.0, (1 - state["requests"]) * 60 / (self.rpm * state["factor"]))
+        token_wait = max(0.0, (tokens - state["tokens"]) * 60 / (self.tpm * state["factor"]))
+        wait = max(request_wait, token_wait, 0.01)
+        if level == INTERACTIVE:
+            # Keep backfills off the capacity this caller is waiting for
+            state["interactive_until"] = max(state["interactive_until"], now + min(wait, MAX_WAIT_SECONDS) + INTERACTIVE_HOLD_SECONDS)
+        return wait
+
+    def try_acquire(self, tokens, level=None):
+        """
+        Non-blocking acquire. Returns 0 when granted, or the seconds to wait before retrying.
+        """
+        level = current_priority() if level is None else level
+        return self._update(lambda state, now: self._try_take(state, now, tokens, level))
+
+    @contextmanager
+    def _waiter(self, level):
+        with self._lock:
+            self._waiting[level] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._waiting[level] -= 1
+
+    def acquire(self, tokens, level=None):
+        """
+        Blocks until a request with about `tokens` tokens may be sent.
+        Waits are capped so capacity given back by other processes is seen.
+        """
+        level = current_priority() if level is None else level
+        with self._waiter(level):
+            while True:
+                wait = self.try_acquire(tokens, level)
+                if wait == 0:
+                    return
+                time.sleep(min(wait, MAX_WAIT_SECONDS) * random.uniform(1, 1.1))
+
+    async def acquire_async(self, tokens, level=None):
+        level = current_priority() if level is None else level
+        with self._waiter(level):
+            while True:
+                if self.shared:
+                    # The db transaction may wait on a lock, keep it off the event loop
+                    wait = await asyncio.to_thread(self.try_acquire, tokens, level)
+                else:
+                    wait = self.try_acquire(tokens, level)
+                if wait == 0:
+                    return
+                await asyncio.sleep(min(wait, MAX_WAIT_SECONDS) * random.uniform(1, 1.1))
+
+    def on_success(self, estimated_tokens, usage=None):
+        def update(state, now):
+            self._refill(state, now)
+            state["factor"] = min(1.0, state["factor"] + AIMD_INCREASE)
+            if usage and usage.get("total_tokens"):
+                # Give back (or charge) the difference between the estimate and real usage
+                state["tokens"] += estimated_tokens - usage["total_tokens"]
+        self._update(update)
+
+    def on_rate_limited(self, headers=None):
+        headers = headers or {}
+
+        def update(state, now):
+            self._refill(state, now)
+            state["factor"] = max(AIMD_MIN_FACTOR, state["factor"] * AIMD_DECREASE)
+            # Empty whichever bucket the server says is exhausted (requests if it doesn't say)
+            if headers.get("x-ratelimit-remaining-tokens") == "0":
+                state["tokens"] = min(state["tokens"], 0)
+            else:
+                state["requests"] = min(state["requests"], 0)
+            wait = max(
+                _header_seconds(headers.get("retry-after")) or 0,
+                _header_seconds(headers.get("x-ratelimit-reset-requests")) or 0
+                if headers.get("x-ratelimit-remaining-requests") == "0" else 0,
+                _header_seconds(headers.get("x-ratelimit-reset-tokens")) or 0
+                if headers.get("x-ratelimit-remaining-tokens") == "0" else 0,
+            )
+            state["blocked_until"] = max(state["blocked_until"], now + wait)
+            return state["factor"], wait
+
+        factor, wait = self._update(update)
+        logging.warning("OpenAI rate limited, rate factor now %.2f, pausing %.1fs", factor, wait)
+
+    def stats(self):
+        def read(state, now):
+            self._refill(state, now)
+            return {
+                "rate_factor": round(state["factor"], 3),
+                "requests_available": round(state["requests"], 2),
+                "tokens_available": round(state["tokens"], 1),
+                "shared": self.shared,
+            }
+
+        result = self._update(read)
+        with self._lock:
+            result["waiting_interactive"] = self._waiting[INTERACTIVE]
+            result["waiting_backfill"] = self._waiting[BACKFILL]
+        return result
+
+
+limiter = AdaptiveRateLimiter(OPENAI_RPM, OPENAI_TPM, LIMITER_BURST_SECONDS, shared=LIMITER_SHARED)
+
+
+def backoff_delay(attempt):
+    """
+    Full-jitter exponential backoff for retry number `attempt` (0-based).
+    """
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def retryable_errors():
+    """
+    Errors worth retrying: rate limits, timeouts and 5xx. openai is only imported
+    once a completion is made, see ai_processor.openai_module.
+    """
+    import openai
+    return (
+        openai.error.RateLimitError,
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIError,
+        asyncio.TimeoutError,
+    )
+
+
+def error_headers(error):
+    headers = getattr(error, "headers", None) or {}
+    return {key.lower(): value for key, value in dict(headers).items()}
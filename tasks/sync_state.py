@@ -0,0 +1,76 @@
+import os
+import time
+from tasks.db import get_connection
+
+# Pending messages that still fail after this long are given up on
+PENDING_MAX_AGE_SECONDS = int(os.getenv("SYNC_PENDING_MAX_AGE_SECONDS", 7 * 86400))
+
+_initialized = False
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_state (
+                account TEXT PRIMARY KEY,
+                history_id TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_pending (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                added_at REAL NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+            """
+        )
+        _initialized = True
+    return conn
+
+
+def get_history_id(account):
+    """
+    Returns the last Gmail historyId synced for the account, or None.
+    """
+    row = _connection().execute("SELECT history_id FROM sync_state WHERE account = ?", (account,)).fetchone()
+    return row[0] if row else None
+
+
+def set_history_id(account, history_id):
+    _connection().execute(
+        "INSERT OR REPLACE INTO sync_state (account, history_id, updated_at) VALUES (?, ?, ?)",
+        (account, str(history_id), time.time())
+    )
+
+
+def get_pending(account):
+    """
+    Ids of messages an earlier sync listed but could not download or extract.
+    """
+    conn = _connection()
+    conn.execute("DELETE FROM sync_pending WHERE account = ? AND added_at < ?", (account, time.time() - PENDING_MAX_AGE_SECONDS))
+    rows = conn.execute("SELECT message_id FROM sync_pending WHERE account = ? ORDER BY added_at", (account,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def add_pending(account, message_ids):
+    """
+    Keeps message ids for the next incremental sync of the account. A message
+    that is already pending keeps its first added_at.
+    """
+    rows = [(account, message_id, time.time()) for message_id in message_ids]
+    if rows:
+        _connection().executemany("INSERT OR IGNORE INTO sync_pending (account, message_id, added_at) VALUES (?, ?, ?)", rows)
+
+
+def remove_pending(account, message_ids):
+    rows = [(account, message_id) for message_id in message_ids]
+    if rows:
+        _connection().executemany("DELETE FROM sync_pending WHERE account = ? AND message_id = ?", rows)
@@ -0,0 +1,76 @@
+import json
+import time
+from tasks.db import get_connection
+
+_initialized = False
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ready_tasks (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                task TEXT NOT NULL,
+                received_at REAL NOT NULL,
+                stored_at REAL NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ready_tasks_received ON ready_tasks (account, received_at)")
+        _initialized = True
+    return conn
+
+
+def save(account, entries):
+    """
+    Stores tasks extracted ahead of time. entries is an iterable of
+    (message_id, received_at, task); received_at is a datetime or None (now).
+    A message that is stored again keeps its earliest received_at.
+    """
+    now = time.time()
+    rows = [
+        (account, message_id, json.dumps(task), received_at.timestamp() if received_at else now, now)
+        for message_id, received_at, task in entries
+    ]
+    if rows:
+        _connection().executemany(
+            """
+            INSERT INTO ready_tasks (account, message_id, task, received_at, stored_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (account, message_id) DO UPDATE SET
+                task = excluded.task,
+                received_at = MIN(ready_tasks.received_at, excluded.received_at),
+                stored_at = excluded.stored_at
+            """,
+            rows
+        )
+
+
+def remove(account, message_ids):
+    """
+    Drops stored tasks, e.g. for messages superseded by a later reply in the thread.
+    """
+    rows = [(account, message_id) for message_id in message_ids]
+    if rows:
+        _connection().executemany("DELETE FROM ready_tasks WHERE account = ? AND message_id = ?", rows)
+
+
+def list_tasks(account, since=None, until=None):
+    """
+    Returns the stored task dicts of the account received in [since, until)
+    (datetimes, both optional), newest first.
+    """
+    query = "SELECT task FROM ready_tasks WHERE account = ?"
+    params = [account]
+    if since:
+        query += " AND received_at >= ?"
+        params.append(since.timestamp())
+    if until:
+        query += " AND received_at < ?"
+        params.append(until.timestamp())
+    rows = _connection().execute(query + " ORDER BY received_at DESC", params).fetchall()
+    return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,136 @@
+"""
+Fan-out for team inboxes: fetches and extracts several accounts in one request.
+
+Accounts run in parallel, each in its own worker with its own share of the LLM
+concurrency, so a large inbox cannot take every slot. A failing or slow account
+only affects its own entry in the result. Tasks shared through Sortify land in
+several team inboxes; merge_tasks() collapses them into one entry that lists
+every account it was shared with.
+"""
+import os
+import re
+import time
+import logging
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
+from tasks.email_reader import fetch_emails, fetch_new_emails
+from tasks.gmail_client import known_account_email
+from tasks.pipeline import LLM_MAX_CONCURRENCY, process_emails, request_failures, is_sortify_email, _ContextExecutor
+
+TEAM_MAX_ACCOUNTS = int(os.getenv("TEAM_MAX_ACCOUNTS", 20))
+# Accounts fetched and extracted at the same time; the rest wait for a free slot
+TEAM_ACCOUNT_CONCURRENCY = int(os.getenv("TEAM_ACCOUNT_CONCURRENCY", 4))
+# Accounts still running after this long are reported as timed out
+TEAM_TIMEOUT_SECONDS = float(os.getenv("TEAM_TIMEOUT_SECONDS", 600))
+
+
+def _process_account(index, account, defaults, incremental, max_workers):
+    started = time.monotonic()
+    result = {"index": index, "email": None}
+    access_token = account.get("access_token")
+    refresh_token = account.get("refresh_token")
+    if not access_token:
+        return dict(result, error="Access token is required.", status=401)
+
+    fetch_from = account.get("fetch_from") or defaults.get("fetch_from")
+    fetch_to = account.get("fetch_to") or defaults.get("fetch_to")
+    try:
+        if incremental:
+            emails = fetch_new_emails(access_token, refresh_token, fetch_from, fetch_to)
+        else:
+            emails = fetch_emails(access_token, refresh_token, fetch_from, fetch_to)
+        result["email"] = known_account_email(access_token, refresh_token)
+        if isinstance(emails, dict):
+            return dict(result, error=emails.get("error"), status=emails.get("status", 500))
+
+        with request_failures() as failed:
+            result["tasks"] = process_emails(emails, max_workers=max_workers)
+        # Emails whose extraction failed are retried on the next request
+        result["failed_emails"] = len(failed)
+    except Exception as e:
+        logging.error("Error processing team account %d: %s", index, e)
+        return dict(result, error=str(e), status=500)
+
+    result["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+    logging.debug("Team account %d (%s): %d tasks in %d ms", index, result["email"], len(result["tasks"]), result["elapsed_ms"])
+    return result
+
+
+def process_accounts(accounts, defaults=None, incremental=False, timeout=None):
+    """
+    Fetches and extracts every account in parallel. Returns one result per
+    account, in input order: {"index", "email", "tasks", "failed_emails", "elapsed_ms"}, or
+    {"index", "email", "error", "status"} for an account that failed.
+    """
+    if not accounts:
+        return []
+
+    defaults = defaults or {}
+    concurrency = max(1, min(TEAM_ACCOUNT_CONCURRENCY, len(accounts)))
+    # Split the LLM concurrency between the accounts running at once
+    max_workers = max(1, LLM_MAX_CONCURRENCY // concurrency)
+    logging.debug("Processing %d team accounts, %d at a time with %d workers each", len(accounts), concurrency, max_workers)
+
+    results = [None] * len(accounts)
+    # The same credentials listed twice are fetched once
+    duplicates = {}
+    for index, account in enumerate(accounts):
+        key = (account.get("access_token"), account.get("refresh_token"), account.get("fetch_from"), account.get("fetch_to"))
+        duplicates.setdefault(key, []).append(index)
+
+    executor = _ContextExecutor(max_workers=concurrency)
+    futures = {
+        executor.submit(_process_account, indexes[0], accounts[indexes[0]], defaults, incremental, max_workers): indexes
+        for indexes in duplicates.values()
+    }
+    try:
+        for future in as_completed(futures, timeout=timeout or TEAM_TIMEOUT_SECONDS):
+            result = future.result()
+            for index in futures[future]:
+                results[index] = dict(result, index=index)
+    except FuturesTimeoutError:
+        logging.warning("Team request timed out with %d accounts unfinished", results.count(None))
+    finally:
+        # Unstarted accounts are dropped; running ones finish in the background and
+        # their results are in the message store for the next refresh
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for index, result in enumerate(results):
+        if result is None:
+            account = accounts[index]
+            email = known_account_email(account.get("access_token"), account.get("refresh_token"))
+            results[index] = {"index": index, "email": email, "error": "Timed out", "status": 504}
+    return results
+
+
+def _shared_key(task):
+    summary = re.sub(r"\s+", " ", task.get("summary") or "").strip().lower()
+    return summary, task.get("deadline")
+
+
+def merge_tasks(results):
+    """
+    Merges the per-account task lists into one list where every task has an
+    "accounts" field. Identical Sortify tasks from several accounts become one entry,
+    and a mailbox listed twice with overlapping windows gives each of its tasks once.
+    """
+    merged = []
+    shared = {}
+    seen = set()
+    for result in results:
+        account = result.get("email") or f"account-{result['index']}"
+        for task in result.get("tasks", []):
+            key = (account, task.get("subject"), task.get("from"), task.get("summary"), task.get("deadline"))
+            if key in seen:
+                continue
+            seen.add(key)
+            if is_sortify_email(task):
+                key = _shared_key(task)
+                if key in shared:
+                    if account not in shared[key]["accounts"]:
+                        shared[key]["accounts"].append(account)
+                    continue
+                entry = shared[key] = dict(task, accounts=[account])
+            else:
+                entry = dict(task, accounts=[account])
+            merged.append(entry)
+    return merged
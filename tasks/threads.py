@@ -0,0 +1,203 @@
+"""
+Thread-level deduplication: messages of one Gmail thread, and near-duplicate
+bodies across threads, are collapsed into a single email so that only one task
+is extracted per conversation.
+
+The latest message is sent with a condensed context of the earlier ones, which
+is kept per thread so a later reply only costs one more extraction. The context
+is saved by message_store.record_email once the latest message has a stored
+verdict, so a failed extraction is retried without itself in the context.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+from datetime import datetime, timezone
+from tasks.db import get_connection
+from tasks.pipeline import is_sortify_email
+
+THREAD_DEDUP_ENABLED = os.getenv("THREAD_DEDUP_ENABLED", "true").lower() == "true"
+# Bodies whose 64-bit SimHashes differ in at most this many bits are near-duplicates
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", 3))
+THREAD_CONTEXT_TOKENS = int(os.getenv("THREAD_CONTEXT_TOKENS", 300))
+# Characters kept per earlier message in the condensed context
+CONTEXT_LINE_CHARS = 200
+
+WORD_PATTERN = re.compile(r"\w+")
+# With at most 3 differing bits, near-duplicates agree on at least one of 4 bands
+SIMHASH_BANDS = SIMHASH_MAX_DISTANCE + 1
+
+_initialized = False
+
+
+def _connection():
+    global _initialized
+    conn = get_connection()
+    if not _initialized:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS thread_context (
+                account TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                latest_message_id TEXT NOT NULL,
+                context TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (account, thread_id)
+            )
+            """
+        )
+        _initialized = True
+    return conn
+
+
+def simhash(text):
+    """
+    64-bit SimHash of the word 3-shingles of text.
+    """
+    words = WORD_PATTERN.findall((text or "").lower())
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    counts = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            counts[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if counts[bit] > 0)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _email_time(email):
+    return email.get("date") or datetime.min.replace(tzinfo=timezone.utc)
+
+
+def group_emails(emails):
+    """
+    Groups emails by thread_id and near-duplicate body. Returns lists of emails,
+    in order of first appearance. Sortify emails are never grouped.
+    """
+    parent = list(range(len(emails)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[find(i)] = find(j)
+
+    by_thread = {}
+    by_band = {}
+    hashes = {}
+    band_bits = 64 // SIMHASH_BANDS
+    for i, email in enumerate(emails):
+        if is_sortify_email(email):
+            continue
+        thread_id = email.get("thread_id")
+        if thread_id:
+            if thread_id in by_thread:
+                union(i, by_thread[thread_id])
+            else:
+                by_thread[thread_id] = i
+        if "processed" in email or not email.get("body"):
+            continue
+        hashes[i] = simhash(email["body"])
+        for band in range(SIMHASH_BANDS):
+            key = (band, hashes[i] >> (band * band_bits) & ((1 << band_bits) - 1))
+            for j in by_band.get(key, []):
+                if find(i) != find(j) and hamming(hashes[i], hashes[j]) <= SIMHASH_MAX_DISTANCE:
+                    union(i, j)
+            by_band.setdefault(key, []).append(i)
+
+    groups = {}
+    for i, email in enumerate(emails):
+        groups.setdefault(find(i), []).append(email)
+    return list(groups.values())
+
+
+def condense(email):
+    """
+    One line summarizing an earlier message for the thread context.
+    """
+    body = " ".join((email.get("body") or "").split())
+    if len(body) > CONTEXT_LINE_CHARS:
+        body = body[:CONTEXT_LINE_CHARS].rsplit(" ", 1)[0] + " ..."
+    return f"{email.get('from', 'Unknown Sender')}: {body}"
+
+
+def _trim_context(lines):
+    # Keep the most recent lines that fit the budget (about 4 characters per token)
+    kept, used = [], 0
+    for line in reversed(lines):
+        used += len(line) + 1
+        if used > THREAD_CONTEXT_TOKENS * 4:
+            break
+        kept.append(line)
+    return list(reversed(kept))
+
+
+def get_context(account, thread_id):
+    if not account or not thread_id:
+        return []
+    row = _connection().execute(
+        "SELECT context FROM thread_context WHERE account = ? AND thread_id = ?", (account, thread_id)
+    ).fetchone()
+    return row[0].splitlines() if row else []
+
+
+def save_context(account, thread_id, latest_message_id, lines):
+    if not account or not thread_id:
+        return
+    _connection().execute(
+        "INSERT OR REPLACE INTO thread_context (account, thread_id, latest_message_id, context, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (account, thread_id, latest_message_id, "\n".join(_trim_context(lines)), time.time())
+    )
+
+
+def _representative(group, account):
+    """
+    The latest new message of the group, with the earlier messages of its
+    thread condensed under it and the other members listed under "merged".
+    "thread_context" holds the lines to save once it has been extracted.
+    """
+    new = sorted((email for email in group if "processed" not in email), key=_email_time)
+    latest = new[-1]
+    thread_id = latest.get("thread_id")
+    earlier = [email for email in new[:-1] if thread_id and email.get("thread_id") == thread_id]
+    context = _trim_context(get_context(account, thread_id) + [condense(email) for email in earlier])
+
+    representative = dict(latest)
+    if context:
+        representative["body"] = latest["body"] + "\n\nEarlier in this thread:\n" + "\n".join(context)
+    representative["merged"] = [
+        (email["id"], email.get("thread_id")) for email in group if email is not latest and email.get("id")
+    ]
+    representative["thread_context"] = context + [condense(latest)]
+    return representative
+
+
+def collapse_threads(emails, account=None):
+    """
+    Replaces each thread / near-duplicate group by a single email.
+    Groups that only hold already processed emails keep their latest task;
+    groups with new messages are extracted again from the latest one.
+    """
+    if not THREAD_DEDUP_ENABLED or len(emails) < 2:
+        return emails
+
+    collapsed = []
+    for group in group_emails(emails):
+        if len(group) == 1:
+            collapsed.append(group[0])
+        elif all("processed" in email for email in group):
+            # Gmail lists newest first, and the store already superseded the rest
+            collapsed.append(group[0])
+        else:
+            collapsed.append(_representative(group, account))
+
+    if len(collapsed) < len(emails):
+        logging.info("Collapsed %d emails into %d threads.", len(emails), len(collapsed))
+    return collapsed
@@ -1,70 +1,141 @@
 import re
 import os
+from tasks.deadline_parser import resolve_deadline
 
 gmail_user = os.getenv("EMAIL_ADDRESS")
 
-def score_email_importance(subject, body, sender=None, my_email=None):
+# Positive weighted keywords (actionable or important)
+IMPORTANT_KEYWORDS = {
+    "invoice": 2, "payment": 2, "billing": 2, "reminder": 2,
+    "domain": 2, "schedule": 2, "meeting": 2, "calendar": 2,
+    "approval": 2, "confirm": 2, "urgent": 4, "immediate": 3,
+    "feedback": 1, "interview": 2, "offer letter": 2, "contract": 2,
+    "ticket": 2, "support": 2, "bug": 2, "outage": 3, "failure": 2,
+    "shipment": 1, "order": 1, "assigned": 1, "task": 2,
+    "reset your password": 2, "account locked": 3, "login attempt": 2,
+    "error": 2, "fix": 2, "update": 2, "upgrade": 2, "renew": 2,
+    "appointment": 2, "verify": 2, "invited": 3, "shared with you": 3,
+    "accept": 2, "collaborate": 2,
+    "failed": 2, "notice": 4, "refund": 2, "final": 4, "mentioned": 4,
+    "mentioned you in a comment": 6
+}
+
+# Negative weighted keywords (promotions, spam, marketing)
+SPAM_KEYWORDS = {
+    "unsubscribe": -10, "subscription": -6, "subscribed": -6,
+    "newsletter": -6, "noreply": -4, "auto-generated": -4,
+    "promotion": -5, "discount": -6, "sale": -6, "exclusive": -6,
+    "download": -5, "free": -6, "deal": -6, "offer": -6, "coaching": -5,
+    "become a member": -6, "limited time": -5, "reward": -5,
+    "bonus": -5, "click here": -5, "webinar": -4, "join now": -4,
+    "register": -4, "watch now": -4, "complete order": -6,
+    "order now": -6, "order completed": -6, "shop": -6,
+    "checkout": -6, "cart": -6, "buy now": -6, "clearance": -5,
+    "get access": -5, "premium subscription": -5, "code to log in": -5
+}
+
+# Senders that only ever send marketing
+SPAM_SENDER_DOMAINS = [
+    "workingnomads.com", "sheinemail.com", "maroonbluebook.com",
+    "hubspot", "mailchimp", "convertkit", "clickfunnels"
+]
+
+# 📉 Common numeric discount formats (e.g., 1200 OFF)
+DISCOUNT_PATTERNS = [
+    re.compile(r"\b\d{2,4}\s*off\b", re.IGNORECASE),  # e.g., 1200 OFF, 50 off
+    re.compile(r"\bup to\s*\d{1,4}%\s*off\b", re.IGNORECASE),  # e.g., up to 70% off
+    re.compile(r"\bsave\s*\d{1,4}\b", re.IGNORECASE),  # e.g., save 100
+    re.compile(r"\b\d{2,4}%\s*discount\b", re.IGNORECASE),
+]
+
+
+def _trie_pattern(words):
     """
-    Scores an email based on importance signals.
-    Returns a numeric score — process only if score > 0.
+    Builds a regex alternation shaped like a trie (shared prefixes are matched once),
+    which keeps the per-position cost low compared with a flat alternation.
     """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
 
-    score = 1
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        optional = "" in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if optional else "")
 
-    # Positive weighted keywords (actionable or important)
-    important_keywords = {
-        "invoice": 2, "payment": 2, "billing": 2, "reminder": 2,
-        "domain": 2, "schedule": 2, "meeting": 2, "calendar": 2,
-        "approval": 2, "confirm": 2, "urgent": 4, "immediate": 3,
-        "feedback": 1, "interview": 2, "offer letter": 2, "contract": 2,
-        "ticket": 2, "support": 2, "bug": 2, "outage": 3, "failure": 2,
-        "shipment": 1, "order": 1, "assigned": 1, "task": 2,
-        "reset your password": 2, "account locked": 3, "login attempt": 2,
-        "error": 2, "fix": 2, "update": 2, "upgrade": 2, "renew": 2,
-        "appointment": 2, "verify": 2, "invited": 3, "shared with you": 3,
-        "accept": 2, "collaborate": 2, "error": 2, "fix": 2, "update": 2,
-        "failed": 2, "notice": 4, "refund": 2, "final": 4, "mentioned": 4,
-        "mentioned you in a comment": 6
-    }
+    return build(trie)
 
-    # Negative weighted keywords (promotions, spam, marketing)
-    spam_keywords = {
-        "unsubscribe": -10, "subscription": -6, "subscribed": -6,
-        "newsletter": -6, "noreply": -4, "auto-generated": -4,
-        "promotion": -5, "discount": -6, "sale": -6, "exclusive": -6,
-        "download": -5, "free": -6, "deal": -6, "offer": -6, "coaching": -5,
-        "become a member": -6, "limited time": -5, "reward": -5,
-        "bonus": -5, "click here": -5, "webinar": -4, "join now": -4,
-        "register": -4, "watch now": -4, "complete order": -6,
-        "order now": -6, "order completed": -6, "shop": -6,
-        "checkout": -6, "cart": -6, "buy now": -6, "clearance": -5,
-        "get access": -5, "premium subscription": -5, "code to log in": -5
-    }
 
-    def keyword_score(text, keywords):
-        score = 0
-        if not text:
-            return score
+def _build_keyword_matcher(*keyword_dicts):
+    """
+    Compiles all keywords into one regex so a text is scanned once.
+
+    The match sits inside a lookahead so that overlapping keywords (e.g. "order"
+    inside "complete order") are still found, and the trie is greedy so the
+    longest keyword at a position wins. The shorter keywords it starts with
+    (e.g. "mentioned" for "mentioned you in a comment") match there as well;
+    those are precomputed per keyword.
+    """
+    weights = {}
+    for keywords in keyword_dicts:
         for keyword, weight in keywords.items():
-            if re.search(rf'\b{re.escape(keyword)}\b', text, re.IGNORECASE):
-                score += weight
-        return score
-
-    # 📉 Score common numeric discount formats (e.g., 1200 OFF)
-    def pattern_score(text):
-        score = 0
-        if not text:
-            return score
-        patterns = [
-            r"\b\d{2,4}\s*off\b",  # e.g., 1200 OFF, 50 off
-            r"\bup to\s*\d{1,4}%\s*off\b",  # e.g., up to 70% off
-            r"\bsave\s*\d{1,4}\b",  # e.g., save 100
-            r"\b\d{2,4}%\s*discount\b",
-        ]
-        for pattern in patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                score -= 6
-        return score
+            weights[keyword] = weights.get(keyword, 0) + weight
+
+    pattern = re.compile(rf"\b(?=({_trie_pattern(weights)})\b)", re.IGNORECASE)
+    implied = {
+        keyword: [other for other in weights if other != keyword and re.match(rf"{re.escape(other)}\b", keyword)]
+        for keyword in weights
+    }
+    return pattern, implied, weights
+
+
+_KEYWORD_PATTERN, _IMPLIED_KEYWORDS, _KEYWORD_WEIGHTS = _build_keyword_matcher(IMPORTANT_KEYWORDS, SPAM_KEYWORDS)
+
+
+def _matched_keyword(text):
+    keyword = text.lower()
+    if keyword in _KEYWORD_WEIGHTS:
+        return keyword
+    # Case-insensitive matches whose lower() differs from the keyword (e.g. "ſale")
+    return next(k for k in _KEYWORD_WEIGHTS if re.fullmatch(re.escape(k), text, re.IGNORECASE))
+
+
+def keyword_score(text):
+    """
+    Sums the weights of all important and spam keywords found in text.
+    Each keyword counts once per text, however often it appears.
+    """
+    if not text:
+        return 0
+    found = set()
+    for match in _KEYWORD_PATTERN.finditer(text):
+        keyword = _matched_keyword(match.group(1))
+        if keyword not in found:
+            found.add(keyword)
+            found.update(_IMPLIED_KEYWORDS[keyword])
+    return sum(_KEYWORD_WEIGHTS[keyword] for keyword in found)
+
+
+def pattern_score(text):
+    if not text:
+        return 0
+    return sum(-6 for pattern in DISCOUNT_PATTERNS if pattern.search(text))
+
+
+def score_email_importance(subject, body, sender=None, my_email=None):
+    """
+    Scores an email based on importance signals.
+    Returns a numeric score — process only if score > 0.
+    """
+
+    score = 1
 
     # ✉️ Score sender trust
     if sender:
@@ -75,36 +146,81 @@ def score_email_importance(subject, body, sender=None, my_email=None):
             score -= 2
         if my_email and my_email.lower() in sender_lower:
             score -= 2
-        if any(domain in sender_lower for domain in [
-            "workingnomads.com", "sheinemail.com", "maroonbluebook.com",
-            "hubspot", "mailchimp", "convertkit", "clickfunnels"
-        ]):
+        if any(domain in sender_lower for domain in SPAM_SENDER_DOMAINS):
             score -= 5
 
     # 🧠 Score subject & body based on weighted keywords
-    score += keyword_score(subject, important_keywords)
-    score += keyword_score(body, important_keywords)
-    score += keyword_score(subject, spam_keywords)
-    score += keyword_score(body, spam_keywords)
+    score += keyword_score(subject)
+    score += keyword_score(body)
     score += pattern_score(subject)
     score += pattern_score(body)
 
     return score
 
-def is_important_email(email_subject, email_body, sender=None, my_email=None):
+def score_email_metadata(subject, snippet, sender=None, my_email=None):
     """
-    Determines if an email should be processed based on importance score.
-    Uses a weighted scoring system to balance important and spam indicators.
+    Scores an email from its headers and snippet only, before the body is downloaded.
+    Applies the same sender, keyword and spam-domain rules as score_email_importance.
     """
+    return score_email_importance(
+        subject=subject or "",
+        body=snippet or "",
+        sender=sender,
+        my_email=my_email or gmail_user
+    )
 
-    score = score_email_importance(
+def importance_score(email_subject, email_body, sender=None, my_email=None, footer=None):
+    """
+    Scores an email with the defaults used by is_important_email. footer is the
+    boilerplate preprocess stripped from the body, scored along with it.
+    """
+    return score_email_importance(
         subject=email_subject or "",
-        body=email_body or "",
+        body="\n\n".join(part for part in (email_body, footer) if part),
         sender=sender,
         my_email=my_email or gmail_user
     )
 
+def is_important_email(email_subject, email_body, sender=None, my_email=None):
+    """
+    Determines if an email should be processed based on importance score.
+    Uses a weighted scoring system to balance important and spam indicators.
+    """
+
+    score = importance_score(email_subject, email_body, sender=sender, my_email=my_email)
+
     # Debug print (optional)
     # print(f"[DEBUG] Email scored {score} — Subject: {email_subject[:60]}")
 
     return score > 0
+
+
+# Phrases that mark a sentence as a request, for the LLM-free fallback
+ACTION_PATTERN = re.compile(
+    r"\b(?:please|kindly|can you|could you|would you|will you|need you to|make sure|don't forget|"
+    r"remember to|action required|reminder|required|must|due by|deadline|asap)\b",
+    re.IGNORECASE
+)
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+# Emails without a request sentence still become a review task above this score
+HEURISTIC_MIN_SCORE = 4
+
+
+def heuristic_task(subject, body, sender=None, footer=None):
+    """
+    Extracts (task, deadline) without the LLM, used when the token budget is spent.
+    The task is the first sentence that reads like a request, or a review of the
+    subject for important emails; returns None when neither applies.
+    """
+    sentences = [sentence.strip() for sentence in SENTENCE_SPLIT.split(body or "") if sentence.strip()]
+    request = next((sentence for sentence in sentences if ACTION_PATTERN.search(sentence)), None)
+    if request:
+        task = request if len(request) <= 200 else request[:197].rstrip() + "..."
+    elif importance_score(subject, body, sender=sender, footer=footer) >= HEURISTIC_MIN_SCORE:
+        task = f"Review: {subject or 'email'}"
+    else:
+        return None
+
+    # Ambiguous dates (None) are left empty rather than guessed
+    deadline = resolve_deadline(f"{subject or ''}\n{request or ''}") or ""
+    return task, deadline
@@ -0,0 +1,41 @@
+from datetime import date
+
+import pytest
+
+from tasks.deadline_parser import resolve_deadline
+
+# A Wednesday
+TODAY = date(2026, 10, 14)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Please send it by Friday.", "2026-10-16"),
+    ("This is due Monday", "2026-10-19"),
+    ("Can we sync this Thursday?", "2026-10-15"),
+    ("Let's review it next Friday", "2026-10-23"),
+    ("Reply by tomorrow", "2026-10-15"),
+    ("Send the slides by 20/10", "2026-10-20"),
+    ("The board meeting is on the 5th of November", "2026-11-05"),
+    ("Deadline: 2026-12-01", "2026-12-01"),
+    ("Thanks for the update!", ""),
+])
+def test_resolves_deadlines(text, expected):
+    assert resolve_deadline(text, TODAY) == expected
+
+
+@pytest.mark.parametrize("text", [
+    # Weekdays in past or descriptive context
+    "Submit the report last Friday",
+    "We discussed this on Monday's call",
+    "See you at next Friday's sync",
+    "Friday works for me",
+    # Day ordinals and numbers without a month
+    "Please reply by the 20th",
+    "The board meeting on the 5th",
+    "Support is available 24/7",
+    # A resolved date next to one the rules cannot read
+    "Reply by tomorrow or Friday at the latest",
+    "Sometime soon",
+])
+def test_leaves_ambiguous_text_to_the_llm(text):
+    assert resolve_deadline(text, TODAY) is None
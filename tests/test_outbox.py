@@ -0,0 +1,87 @@
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller
+
+from tasks import db, email_sender, outbox
+
+
+class Handler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch, tmp_path):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "outbox.db"))
+    monkeypatch.setattr(outbox, "_initialized", False)
+    # The test sends with send_next() instead of background threads
+    monkeypatch.setattr(outbox, "start_workers", lambda: None)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_BASE_SECONDS", 0)
+    monkeypatch.setattr(email_sender, "gmail_user", "sortify@example.com")
+    monkeypatch.setattr(email_sender, "gmail_app_password", "secret")
+
+    port = _free_port()
+    monkeypatch.setattr(email_sender, "smtp_pool", email_sender.SMTPConnectionPool("127.0.0.1", port, 2, starttls=False))
+    handler = Handler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield handler
+    controller.stop()
+
+
+def _in_other_thread(fn, *args):
+    # Another thread has its own SQLite connection, like another worker process would
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn(*args)))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_sends_queued_emails(smtp):
+    handler = smtp
+    outbox_ids = outbox.enqueue_many("Ana", ["a@example.com", "b@example.com"], [{"task": "Pay the invoice", "deadline": "2026-10-20"}])
+
+    while _in_other_thread(outbox.send_next):
+        pass
+
+    assert sorted(message.rcpt_tos[0] for message in handler.messages) == ["a@example.com", "b@example.com"]
+    assert [entry["status"] for entry in outbox.status(outbox_ids)] == ["sent", "sent"]
+
+
+def test_status_is_shared_between_connections(smtp):
+    outbox_id = outbox.enqueue("Ana", "a@example.com", None, "Review the draft")
+
+    assert [entry["id"] for entry in _in_other_thread(outbox.status, [outbox_id, "unknown"])] == [outbox_id]
+
+
+def test_retries_until_the_server_is_back(smtp, monkeypatch):
+    handler = smtp
+    pool = email_sender.smtp_pool
+    monkeypatch.setattr(email_sender, "smtp_pool", email_sender.SMTPConnectionPool("127.0.0.1", _free_port(), 2, starttls=False))
+    outbox_id = outbox.enqueue("Ana", "a@example.com", None, "Review the draft")
+
+    assert outbox.send_next()
+    assert outbox.status([outbox_id])[0]["status"] == "retrying"
+
+    monkeypatch.setattr(email_sender, "smtp_pool", pool)
+    assert outbox.send_next()
+    assert outbox.status([outbox_id])[0] | {"updated_at": None} == {
+        "id": outbox_id, "recipient": "a@example.com", "task": "Review the draft",
+        "status": "sent", "attempts": 2, "error": None, "updated_at": None,
+    }
+    assert len(handler.messages) == 1
@@ -0,0 +1,53 @@
+import base64
+
+from tasks.email_reader import parse_message, select_important
+from tasks.utils import importance_score
+
+NEWSLETTER = """Hi there,
+
+Here is what happened this week at Acme: we shipped the new dashboard and
+fixed a few things you told us about.
+
+Read the full story on our blog.
+
+You are receiving this email because you signed up at acme.example.
+Unsubscribe | Manage your email preferences | View in browser
+"""
+
+REQUEST = """Hi,
+
+Could you send me the signed contract by Friday? The invoice is attached.
+
+Thanks,
+Maria
+"""
+
+
+def _message(message_id, subject, sender, body):
+    return {
+        "id": message_id,
+        "threadId": message_id,
+        "payload": {
+            "headers": [{"name": "Subject", "value": subject}, {"name": "From", "value": sender}],
+            "parts": [{"mimeType": "text/plain", "body": {"data": base64.urlsafe_b64encode(body.encode()).decode()}}],
+        },
+    }
+
+
+def test_newsletter_footer_still_counts():
+    email = parse_message(_message("n1", "This week at Acme", "Acme <hello@acme.example>", NEWSLETTER))
+
+    # The footer is not sent to the LLM, but its keywords keep the email out of it
+    assert "Unsubscribe" not in email["body"]
+    assert "Unsubscribe" in email["body_stats"]["footer"]
+    assert importance_score(email["subject"], email["body"], sender=email["from"]) > 0
+    assert importance_score(email["subject"], email["body"], sender=email["from"], footer=email["body_stats"]["footer"]) <= 0
+
+
+def test_select_important_drops_the_newsletter():
+    emails = [
+        parse_message(_message("n1", "This week at Acme", "Acme <hello@acme.example>", NEWSLETTER)),
+        parse_message(_message("r1", "Contract", "Maria <maria@example.com>", REQUEST)),
+    ]
+
+    assert [email["id"] for email in select_important(emails)] == ["r1"]
@@ -0,0 +1,22 @@
+from tasks.team import merge_tasks
+
+
+def _task(subject):
+    return {"subject": subject, "from": "boss@example.com", "summary": f"Handle {subject}", "deadline": "No deadline"}
+
+
+def test_same_mailbox_with_overlapping_windows():
+    results = [
+        {"index": 0, "email": "a@example.com", "tasks": [_task("one"), _task("two")]},
+        {"index": 1, "email": "a@example.com", "tasks": [_task("two"), _task("three")]},
+        {"index": 2, "email": "b@example.com", "tasks": [_task("two")]},
+    ]
+
+    merged = [(task["subject"], task["accounts"]) for task in merge_tasks(results)]
+
+    assert merged == [
+        ("one", ["a@example.com"]),
+        ("two", ["a@example.com"]),
+        ("three", ["a@example.com"]),
+        ("two", ["b@example.com"]),
+    ]
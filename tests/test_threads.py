@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tasks import db, message_store, threads
+
+START = datetime(2026, 10, 12, 9, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def database(monkeypatch, tmp_path):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "threads.db"))
+    monkeypatch.setattr(threads, "_initialized", False)
+    monkeypatch.setattr(message_store, "_initialized", False)
+
+
+def _email(message_id, body, hours):
+    return {
+        "id": message_id, "thread_id": "t1", "account": "me@example.com", "from": "maria@example.com",
+        "subject": "Contract", "body": body, "date": START + timedelta(hours=hours),
+    }
+
+
+def test_context_is_saved_once_the_latest_message_is_stored():
+    first = _email("m1", "Can you review the contract draft?", 0)
+    latest = _email("m2", "Please sign the final version by Friday.", 1)
+
+    [email] = threads.collapse_threads([latest, first], "me@example.com")
+    assert email["id"] == "m2"
+    # A failed extraction leaves nothing behind, so the retry sees the same context
+    assert threads.get_context("me@example.com", "t1") == []
+    [retry] = threads.collapse_threads([latest, first], "me@example.com")
+    assert retry["body"] == email["body"]
+    assert retry["body"].count("sign the final version") == 1
+
+    message_store.record_email(email, {"summary": "Sign the contract"})
+    assert threads.get_context("me@example.com", "t1") == [threads.condense(first), threads.condense(latest)]